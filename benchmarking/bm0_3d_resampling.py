@@ -12,7 +12,7 @@ import pickle
 from calie.fields import generate as gen
 from calie.transformations import se2
 from calie.visualisations.fields import triptych
-from calie.fields import compose as cp
+from calie.fields import compose_out_of_core as cp_ooc
 from calie.fields import coordinate as coord
 from calie.operations import lie_exp
 from calie.transformations import linear
@@ -202,23 +202,26 @@ if __name__ == '__main__':
         #     pickle.dump(int_curves, f)
 
         # get resampled images and save:
+        # as before, each step resamples the output of the previous step (with the default order 2 of
+        # compose.scalar_dot_lagrangian). The images are read through the memory mapped proxy and written block by
+        # block, so they are saved uncompressed (.nii instead of .nii.gz).
+        pfi_slab_resampled_previous = pfi_slab
         for st in range(num_steps_integrations):
             alpha = -1 * (st + 1) / float(num_steps_integrations)
             sdisp_0 = l_exp.gss_aei(alpha * svf_0)
-            slab_resampled_st = cp.scalar_dot_lagrangian(im_slab.get_data(), sdisp_0)
 
             pfi_slab_resampled_st = jph(
-                pfo_output_A1_3d, '{}_slab_step_{}.nii.gz'.format(subject_id, st+1)
+                pfo_output_A1_3d, '{}_slab_step_{}.nii'.format(subject_id, st+1)
             )
-            im_slab = utils_nib.set_new_data(im_slab, slab_resampled_st)
-
-            nib.save(im_slab, pfi_slab_resampled_st)
+            cp_ooc.scalar_dot_lagrangian_out_of_core(pfi_slab_resampled_previous, sdisp_0, pfi_slab_resampled_st,
+                                                     s_i_o=2)
+            pfi_slab_resampled_previous = pfi_slab_resampled_st
 
     else:
         assert os.path.exists(pfi_slab)
         assert os.path.exists(pfi_svf0)
         for st in range(num_steps_integrations):
-            assert os.path.exists(jph(pfo_output_A1_3d, '{}_slab_step_{}.nii.gz'.format(subject_id, st+1)))
+            assert os.path.exists(jph(pfo_output_A1_3d, '{}_slab_step_{}.nii'.format(subject_id, st+1)))
 
     # ----------------------------------------------------
     # ---------- SHOW ------------------------------------
@@ -233,7 +236,7 @@ if __name__ == '__main__':
     #     svf_0 = nib.load(pfi_svf0)
     #     # load latest transformed
     #     pfi_slab_resampled_last = jph(
-    #         pfo_output_A1_3d, '{}_slab_step_{}.nii.gz'.format(subject_id, num_steps_integrations)
+    #         pfo_output_A1_3d, '{}_slab_step_{}.nii'.format(subject_id, num_steps_integrations)
     #     )
     #     im_slab_resampled = nib.load(pfi_slab_resampled_last)
     #     # load integral curves
@@ -264,7 +267,7 @@ if __name__ == '__main__':
     #
     #         pylab.close('all')
     #
-    #         pfi_slab_resampled = jph(pfo_output_A1_3d, '{}_slab_step_{}.nii.gz'.format(subject_id, st + 1))
+    #         pfi_slab_resampled = jph(pfo_output_A1_3d, '{}_slab_step_{}.nii'.format(subject_id, st + 1))
     #         im_slab_resampled = nib.load(pfi_slab_resampled)
     #
     #         int_curves_step = [ic[:st+1, :] for ic in int_curves]
@@ -0,0 +1,85 @@
+import time
+from collections import OrderedDict
+
+import tabulate
+import numpy as np
+from sympy.core.cache import clear_cache
+
+from calie.fields import generate as gen
+from calie.fields import queries as qr
+from calie.operations import lie_exp
+from calie.operations import lie_log
+
+"""
+Module for the benchmarking of the Lie logarithm.
+For a dataset of random gaussian SVF v, the deformation exp(v) is computed with scaling and squaring, then the
+logarithm is computed with each method. The time of the logarithm is compared with the time of the exponential
+(exp -> log round trip) and the error is the norm of log(exp(v)) - v.
+Warm start is tested initialising the logarithm of each sample with a rescaling of the ground truth.
+"""
+
+if __name__ == '__main__':
+
+    clear_cache()
+
+    # parameters:
+
+    params = OrderedDict()
+
+    params.update({'omega'           : (60, 60)})
+    params.update({'passepartout'    : 10})
+    params.update({'sigma_init'      : 5})
+    params.update({'sigma_gaussian'  : 2})
+    params.update({'scale'           : 1})
+    params.update({'sio'             : 3})
+    params.update({'random_seed'     : 0})
+    params.update({'num_samples'     : 10})
+    params.update({'methods'         : OrderedDict([('iss', {}),
+                                                    ('bch', {}),
+                                                    ('iss warm start', {'method': 'iss'}),
+                                                    ('bch warm start', {'method': 'bch'})])})
+
+    np.random.seed(params['random_seed'])
+
+    l_exp = lie_exp.LieExp()
+    l_exp.s_i_o = params['sio']
+
+    # generate dataset and time the exponentials
+
+    dataset = []
+    exp_time = 0
+    for s in range(params['num_samples']):
+        svf_0 = params['scale'] * gen.generate_random(params['omega'],
+                                                      parameters=(params['sigma_init'], params['sigma_gaussian']))
+        start = time.time()
+        disp_0 = l_exp.scaling_and_squaring(svf_0)
+        exp_time += (time.time() - start) / params['num_samples']
+        dataset.append((svf_0, disp_0))
+
+    # time and error of the logarithms
+
+    tab = [['exp (scaling and squaring)', exp_time, '-', '-', '-']]
+
+    for method_name, method_options in params['methods'].items():
+        mean_time, mean_error, mean_iterations, num_converged = 0, 0, 0, 0
+
+        for svf_0, disp_0 in dataset:
+            options = {'method': method_name}
+            options.update(method_options)
+            if method_name.endswith('warm start'):
+                options.update({'warm_start': 0.95 * svf_0})
+
+            start = time.time()
+            svf_log, converged, iterations = lie_log.lie_logarithm(disp_0, s_i_o=params['sio'],
+                                                                   return_convergence=True, **options)
+            mean_time += (time.time() - start) / params['num_samples']
+
+            mean_error += qr.norm(svf_log, reference_vf=svf_0, passe_partout_size=params['passepartout'],
+                                  normalized=True) / params['num_samples']
+            mean_iterations += iterations / float(params['num_samples'])
+            num_converged += int(converged)
+
+        tab.append([method_name, mean_time, mean_error, mean_iterations, num_converged])
+
+    print('\nLogarithm of exp(v), mean over {} samples:'.format(params['num_samples']))
+    print(tabulate.tabulate(tab, headers=['method', 'time (sec)', 'error (mm)', 'iterations', 'converged']))
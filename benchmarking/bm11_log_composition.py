@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+import tabulate
+import numpy as np
+from sympy.core.cache import clear_cache
+
+from calie.fields import generate as gen
+from calie.fields import queries as qr
+from calie.operations import jacobians as jac
+from calie.operations import within_structures as ws
+
+"""
+Module for the benchmarking of the log-composition.
+For a dataset of couples of random gaussian SVF u, v, log(exp(u) o exp(v)) is approximated with each kind of
+log-composition and compared with the round trip exponential - composition - logarithm ('ground').
+The error is computed in the group, between the exponential of the approximation and exp(u) o exp(v).
+The last row reuses the jacobian of u, as in an atlas update loop where the same u is composed with many v.
+"""
+
+if __name__ == '__main__':
+
+    clear_cache()
+
+    # parameters:
+
+    params = OrderedDict()
+
+    params.update({'omega'           : (60, 60)})
+    params.update({'passepartout'    : 10})
+    params.update({'sigma_init'      : 5})
+    params.update({'sigma_gaussian'  : 5})
+    params.update({'sio'             : 3})
+    params.update({'random_seed'     : 0})
+    params.update({'num_samples'     : 10})
+    params.update({'kinds'           : ['ground', 'bch0', 'bch1', 'bch1.5', 'bch2', 'pt', 'pt_warp']})
+
+    np.random.seed(params['random_seed'])
+
+    dataset = []
+    for s in range(params['num_samples']):
+        svf_u = gen.generate_random(params['omega'], parameters=(params['sigma_init'], params['sigma_gaussian']))
+        svf_v = gen.generate_random(params['omega'], parameters=(params['sigma_init'], params['sigma_gaussian']))
+        disp_ground = ws.lie_log_composition(svf_u, svf_v, kind='ground', answer='disp', s_i_o=params['sio'])
+        dataset.append((svf_u, svf_v, disp_ground))
+
+    tab = []
+    for kind in params['kinds'] + ['bch2 cached']:
+        mean_time, mean_error = 0, 0
+
+        for svf_u, svf_v, disp_ground in dataset:
+            options = {'kind': kind, 's_i_o': params['sio']}
+            if kind == 'bch2 cached':
+                options.update({'kind': 'bch2', 'jacobian_left': jac.compute_jacobian(svf_u)})
+
+            start = time.time()
+            ws.lie_log_composition(svf_u, svf_v, **options)
+            mean_time += (time.time() - start) / params['num_samples']
+
+            options.update({'answer': 'disp'})
+            disp_result = ws.lie_log_composition(svf_u, svf_v, **options)
+            mean_error += qr.norm(disp_result, reference_vf=disp_ground, passe_partout_size=params['passepartout'],
+                                  normalized=True) / params['num_samples']
+
+        tab.append([kind, mean_time, mean_error])
+
+    print('\nLog-composition, mean over {} samples:'.format(params['num_samples']))
+    print(tabulate.tabulate(tab, headers=['kind', 'time (sec)', 'error (mm)']))
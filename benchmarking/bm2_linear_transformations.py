@@ -159,7 +159,8 @@ if __name__ == '__main__':
                     stop = (time.time() - start)
 
                     # compute error:
-                    error = qr.norm(disp_computed - flow1_ground, passe_partout_size=params['passepartout'], normalized=True)
+                    error = qr.norm(disp_computed, reference_vf=flow1_ground, passe_partout_size=params['passepartout'],
+                                    normalized=True)
 
                     df_time_error['subject'][s] = 'sj{}'.format(s+1)
                     df_time_error['time (sec)'][s] = stop
@@ -13,6 +13,7 @@ from sympy.core.cache import clear_cache
 
 from calie.fields import generate as gen
 from calie.fields import queries as qr
+from calie.operations import svf_dataset
 
 from benchmarking.a_main_controller import methods, spline_interpolation_order, steps, num_samples
 from benchmarking.b_path_manager import pfo_output_A4_GAU
@@ -57,6 +58,7 @@ if __name__ == '__main__':
     params.update({'centre_delta'    : centre_delta})
     params.update({'sio'             : spline_interpolation_order})
     params.update({'random_seed'     : 0})
+    params.update({'generator'       : 'random'})  # 'random' (generate_random) or 'spectral'
     params.update({'num_samples'     : num_samples})
     params.update({'steps'           : steps})
 
@@ -68,43 +70,43 @@ if __name__ == '__main__':
     # Generate dataset #
     ####################
 
-    if control['generate_dataset']:
+    # Samples and ground truth flows are generated lazily and cached in a single memory mapped store,
+    # gau-algebra.npy and gau-group.npy, where each sample is a slice. The store records the generation
+    # parameters, and is generated again from scratch when generate_dataset is True.
+
+    # Each sample is seeded from (random_seed, index), so a partially filled store is completed with the same
+    # samples in any order: generate_random_spectral has its own generator per sample, generate_random draws from
+    # the global random state, seeded per sample if random_seed > 0 (otherwise not reproducible).
 
+    def svf_generator(index):
+        if params['generator'] == 'spectral':
+            return gen.generate_random_spectral(omega, parameters=(params['sigma_init'], params['sigma_filter']),
+                                                seed=params['random_seed'], first_sample=index)
         if params['random_seed'] > 0:
-            np.random.seed(params['random_seed'])
+            np.random.seed([params['random_seed'], index])
+        return gen.generate_random(omega, 1, (params['sigma_init'], params['sigma_filter']))
+
+    dataset = svf_dataset.SVFDataset(pfo_output_A4_GAU, 'gau', params['num_samples'], omega, svf_generator,
+                                     ground_method=params['selected_ground'],
+                                     ground_num_steps=params['selected_n_steps'],
+                                     s_i_o=params['sio'],
+                                     parameters={k: params[k] for k in ['sigma_init', 'sigma_filter', 'generator',
+                                                                        'random_seed', 'selected_ground',
+                                                                        'selected_n_steps', 'sio']},
+                                     overwrite=control['generate_dataset'])
+
+    if control['generate_dataset']:
 
         print('--------------------------------------------------------------------------')
-        print('Generating dataset GAU! filename: gau-<s>-<algebra/group>.npy j = 1,...,N ')
+        print('Generating dataset GAU! store: gau-<algebra/group>.npy                    ')
         print('--------------------------------------------------------------------------')
 
-        for s in range(params['num_samples']):  # sample s
-
-            # Generate SVF
-
-            svf1         = gen.generate_random(omega, 1, (params['sigma_init'], params['sigma_filter']))
-            flow1_ground = methods[params['selected_ground']][0](svf1, input_num_steps=params['selected_n_steps'])
-
-            pfi_svf0 = jph(pfo_output_A4_GAU, 'gau-{}-algebra.npy'.format(s + 1))
-            pfi_flow = jph(pfo_output_A4_GAU, 'gau-{}-group.npy'.format(s + 1))
-
-            np.save(pfi_svf0, svf1)
-            np.save(pfi_flow, flow1_ground)
-
-            print('svf saved in {}'.format(pfi_svf0))
-            print('flow saved in {}'.format(pfi_flow))
+        dataset.generate()
 
         print('\n------------------------------------------')
         print('Data computed and saved in external files!')
         print('------------------------------------------')
 
-    else:
-
-        for s in range(params['num_samples']):
-            pfi_svf0 = jph(pfo_output_A4_GAU, 'gau-{}-algebra.npy'.format(s + 1))
-            pfi_flow = jph(pfo_output_A4_GAU, 'gau-{}-group.npy'.format(s + 1))
-            assert os.path.exists(pfi_svf0), pfi_svf0
-            assert os.path.exists(pfi_flow), pfi_flow
-
     ############################
     #   Compute exponentials   #
     ############################
@@ -134,11 +136,7 @@ if __name__ == '__main__':
 
                 for s in range(params['num_samples']):
 
-                    pfi_svf0 = jph(pfo_output_A4_GAU, 'gau-{}-algebra.npy'.format(s + 1))
-                    pfi_flow = jph(pfo_output_A4_GAU, 'gau-{}-group.npy'.format(s + 1))  # Ground truth
-
-                    svf1         = np.load(pfi_svf0)
-                    flow1_ground = np.load(pfi_flow)
+                    svf1, flow1_ground = dataset[s]  # Ground truth flow
 
                     if methods[method_name][6]:
                         raise IOError('TODO for point-wise methods differentiate vode, lsoda')
@@ -149,7 +147,8 @@ if __name__ == '__main__':
                     stop = (time.time() - start)
 
                     # compute error:
-                    error = qr.norm(disp_computed - flow1_ground, passe_partout_size=params['passepartout'], normalized=True)
+                    error = qr.norm(disp_computed, reference_vf=flow1_ground, passe_partout_size=params['passepartout'],
+                                    normalized=True)
 
                     df_time_error['subject'][s] = 'sj{}'.format(s+1)
                     df_time_error['time (sec)'][s] = stop
@@ -107,7 +107,7 @@ def three_assessments_collector(control):
                     elif control['computation'] == 'SE':
                         exp_st_svf1          = exp_method(svf1, input_num_steps=st)
                         exp_st_plus_one_svf1 = exp_method(svf1, input_num_steps=st+1)
-                        error = qr.norm(exp_st_svf1 - exp_st_plus_one_svf1, normalized=True)
+                        error = qr.norm(exp_st_svf1, reference_vf=exp_st_plus_one_svf1, normalized=True)
 
                     else:
                         raise IOError('Input control computation {} not defined.'.format(control['computation']))
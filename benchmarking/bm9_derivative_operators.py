@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+
+import tabulate
+import numpy as np
+from sympy.core.cache import clear_cache
+
+from calie.transformations import se2
+from calie.fields import generate as gen
+from calie.fields import queries as qr
+from calie.operations import lie_exp
+from calie.operations import jacobians as jac
+
+"""
+Module for the comparison of the derivative operators used in the jacobian based exponential methods.
+For a dataset of 2d SVF generated with matrix of se2_a, it compares the computational time of the jacobian
+alone and the error of the exponential computed with each derivative operator and number of steps.
+Only the jacobian changes between the runs, so the error reduction bought by each operator can be weighted
+against its cost and against the cost of increasing the number of steps.
+"""
+
+if __name__ == '__main__':
+
+    clear_cache()
+
+    # parameters:
+
+    params = OrderedDict()
+
+    omega = (50, 50)
+    centre_delta = (5, 5)
+    max_angle = np.pi / 8
+
+    params.update({'omega'           : omega})
+    params.update({'passepartout'    : 5})
+    params.update({'interval_theta'  : (- max_angle, max_angle)})
+    params.update({'epsilon'         : np.pi / 12})
+    params.update({'interval_center' : (int(omega[0] / 2 - centre_delta[0]), int(omega[0] / 2 + centre_delta[0]),
+                                        int(omega[1] / 2 - centre_delta[1]), int(omega[1] / 2 + centre_delta[1]))})
+    params.update({'sio'             : 3})
+    params.update({'random_seed'     : 0})
+    params.update({'num_samples'     : 10})
+    params.update({'steps'           : [2, 4, 6, 8]})
+    params.update({'methods'         : ['gss_aei', 'euler_aei', 'gss_ei_mod']})
+    params.update({'operators'       : jac.derivative_operators})
+
+    np.random.seed(params['random_seed'])
+
+    # generate dataset
+
+    dataset = []
+    for s in range(params['num_samples']):
+        m_0 = se2.se2g_randomgen_custom_center(interval_theta=params['interval_theta'],
+                                               interval_center=params['interval_center'],
+                                               epsilon_zero_avoidance=params['epsilon'])
+        dm_0 = se2.se2g_log(m_0)
+
+        svf_0 = gen.generate_from_matrix(omega, dm_0.get_matrix, t=1, structure='algebra')
+        disp_0 = gen.generate_from_matrix(omega, m_0.get_matrix, t=1, structure='group')
+        dataset.append((svf_0, disp_0))
+
+    # cost of the jacobian alone
+
+    tab_jacobian_time = []
+    for operator in params['operators']:
+        start = time.time()
+        for svf_0, _ in dataset:
+            jac.compute_jacobian(svf_0, operator=operator)
+        tab_jacobian_time.append([operator, (time.time() - start) / params['num_samples']])
+
+    print('\nComputational time of the jacobian (sec):')
+    print(tabulate.tabulate(tab_jacobian_time, headers=['operator', 'time']))
+
+    # error and time of the exponential
+
+    l_exp = lie_exp.LieExp()
+    l_exp.s_i_o = params['sio']
+
+    for method_name in params['methods']:
+
+        tab_errors = np.zeros([len(params['operators']), len(params['steps'])])
+        tab_comp_time = np.zeros([len(params['operators']), len(params['steps'])])
+
+        for operator_index, operator in enumerate(params['operators']):
+            l_exp.derivative_operator = operator
+            exp_method = getattr(l_exp, method_name)
+
+            for st_index, st in enumerate(params['steps']):
+                for svf_0, disp_0 in dataset:
+                    start = time.time()
+                    disp_computed = exp_method(svf_0, input_num_steps=st)
+                    tab_comp_time[operator_index, st_index] += (time.time() - start) / params['num_samples']
+
+                    tab_errors[operator_index, st_index] += qr.norm(disp_computed, reference_vf=disp_0,
+                                                                    passe_partout_size=params['passepartout'],
+                                                                    normalized=True) / params['num_samples']
+
+        l_exp.derivative_operator = 'central'
+
+        print('\nMethod {}'.format(method_name))
+        print('Mean errors (mm):')
+        print(tabulate.tabulate([[op] + list(row) for op, row in zip(params['operators'], tab_errors)],
+                                headers=['operator'] + ['steps {}'.format(st) for st in params['steps']]))
+        print('Mean computational time (sec):')
+        print(tabulate.tabulate([[op] + list(row) for op, row in zip(params['operators'], tab_comp_time)],
+                                headers=['operator'] + ['steps {}'.format(st) for st in params['steps']]))
@@ -175,6 +175,18 @@ def matrix_vector_field_product(j_input, v_input):
     return np.einsum('...kl,...l->...k', temp, v_input)
 
 
+def _matrix_fields_product(a_input, b_input, d):
+    """
+    Point-wise product of two matrix fields with the same shape, without sanity checks.
+    :param a_input: matrix field, with the d * d matrices row major in the last axis.
+    :param b_input: matrix field, with the same shape of a_input.
+    :param d: size of the matrices.
+    :return: matrix field a_input[i,j,:] times b_input[i,j,:] for each i, j.
+    """
+    sh = a_input.shape
+    return np.matmul(a_input.reshape(sh[:-1] + (d, d)), b_input.reshape(sh[:-1] + (d, d))).reshape(sh)
+
+
 def matrix_fields_product(a_input, b_input):
     """
     Multiplies the matrix a_input[i,j,:] times b_input[i,j,:] for each i, j.
@@ -187,13 +199,35 @@ def matrix_fields_product(a_input, b_input):
     np.testing.assert_array_equal(a_input.shape, b_input.shape)
 
     d = int(np.sqrt(a_input.shape[-1]))
-    vol = list(a_input.shape[:d])
-    extra_ones = len(a_input.shape) - (len(vol) + 1)
 
-    temp_a = a_input.reshape(vol + [1] * extra_ones + [d, d])  # transform in squared block with additional ones
-    temp_b = b_input.reshape(vol + [1] * extra_ones + [d, d])
+    return _matrix_fields_product(a_input, b_input, d)
 
-    return np.einsum('...kl,...lm', temp_a, temp_b).reshape(vol + [1] * extra_ones + [d * d])
+
+def matrix_fields_power(a_input, n=1):
+    """
+    Power of a matrix field, for matrices defined at each point of a grid, row major.
+    Computed by binary exponentiation, with O(log n) point-wise matrix products.
+    :param a_input: matrix field
+    :param n: exponent. For n < 1 the input is returned, as in matrix_fields_product_iterative.
+    :return: a_input^n point-wise
+    """
+    d = int(np.round(np.sqrt(a_input.shape[-1])))
+    if not d ** 2 == a_input.shape[-1]:
+        raise IOError('Last axis of length {} does not contain square matrices.'.format(a_input.shape[-1]))
+
+    if n <= 1:
+        return a_input[...]
+
+    ans = None
+    power_of_a = a_input
+    while n > 0:
+        if n & 1:
+            ans = power_of_a if ans is None else _matrix_fields_product(ans, power_of_a, d)
+        n >>= 1
+        if n > 0:
+            power_of_a = _matrix_fields_product(power_of_a, power_of_a, d)
+
+    return ans
 
 
 def matrix_fields_product_iterative(a_input, n=1):
@@ -204,19 +238,16 @@ def matrix_fields_product_iterative(a_input, n=1):
     :param n: number of iterations
     :return: a_input^n point-wise
     """
-    ans = a_input[...]
-    for _ in range(1, n):
-        ans = matrix_fields_product(ans, a_input)
-
-    return ans
+    return matrix_fields_power(a_input, n)
 
 
-def id_matrix_field(domain):
+def id_matrix_field(domain, broadcast=False):
     """
     From a domain of dimension dim =2,3, it returns the identity field
     that at each point of the domain has the (row mayor) vectorized identity
     matrix.
     :param domain: a squared or cubed domain
+    :param broadcast: if True the result is a read-only view of a single identity matrix (numpy.broadcast_to).
     :return:
     """
     dim = len(domain)
@@ -224,6 +255,8 @@ def id_matrix_field(domain):
         assert IOError
 
     shape = list(domain) + [1] * (4 - dim) + [dim**2]
+    if broadcast:
+        return np.broadcast_to(np.eye(dim).reshape(dim**2), shape)
     flat_id = np.eye(dim).reshape(1, dim**2)
     return np.repeat(flat_id, np.prod(domain)).reshape(shape, order='F')
 
@@ -1,8 +1,11 @@
+import hashlib
+import os
+
 import numpy as np
 from scipy import ndimage
+from scipy import sparse
 from scipy.interpolate import griddata, Rbf
 
-from calie.aux import matrices
 from calie.fields import queries as qr
 from calie.fields import coordinate as cs
 
@@ -88,26 +91,62 @@ def lagrangian_dot_eulerian(vf_left_lag, vf_right_eul,
     omega_right = qr.get_omega(vf_right_eul)
     d = len(omega_right)
 
-    if affine_left_right is not None:
-        A_l, A_r = affine_left_right
-        vf_right_eul = matrices.matrix_vector_field_product(np.linalg.inv(A_l).dot(A_r), vf_right_eul)
-
-    coord = [vf_right_eul[..., i].reshape(omega_right, order='F') for i in range(d)]
+    coord = field_coordinates(qr.as_array(vf_right_eul), affine_left_right=affine_left_right)
+    components, prefilter = _components_to_sample(vf_left_lag, d, s_i_o, mode, prefilter)
+    extrapolation_coefficients = _extrapolation_coefficients(vf_left_lag, components, mode)
+    vf_left_lag = qr.as_array(vf_left_lag)
     result = np.squeeze(np.zeros_like(vf_left_lag))
 
     for i in range(d):  # see if the for can be avoided with tests.
 
-        ndimage.map_coordinates(np.squeeze(vf_left_lag[..., i]),
-                                coord,
-                                output=result[..., i],
-                                order=s_i_o,
-                                mode=mode,
-                                cval=cval,
-                                prefilter=prefilter)
+        displacement_at_coordinates(components[i],
+                                    coord,
+                                    output=result[..., i],
+                                    s_i_o=s_i_o,
+                                    mode=mode,
+                                    cval=cval,
+                                    prefilter=prefilter,
+                                    extrapolation_coefficients=extrapolation_coefficients[i])
     if add_right:  # option for the scaling and squaring.
-        return result.reshape(vf_left_lag.shape) + cs.eulerian_to_lagrangian(vf_right_eul)
-    else:
-        return result.reshape(vf_left_lag.shape)
+        # add the displacement of the (affinely transformed) right field, coordinates minus identity.
+        grid = np.ogrid[tuple(slice(0, n) for n in omega_right)]
+        for i in range(d):
+            result[..., i] += coord[i]
+            result[..., i] -= grid[i]
+
+    return result.reshape(vf_left_lag.shape)
+
+
+def _components_to_sample(vf_left_lag, d, s_i_o, mode, prefilter):
+    """
+    Components of the left field of a composition. If it is a queries.VectorField, its spline coefficients are
+    computed once and kept in it, and the prefilter of the interpolation is not needed any more.
+    Modes padded by scipy before the prefilter ('nearest', 'grid-constant' and the extrapolation modes) are not
+    cached.
+    :return: list of d components and the prefilter flag for the interpolation.
+    """
+    components = [np.squeeze(vf_left_lag[..., i]) for i in range(d)]
+    if not (isinstance(vf_left_lag, qr.VectorField) and prefilter and s_i_o > 1) or \
+            mode in ('nearest', 'grid-constant') + extrapolation_modes:
+        return components, prefilter
+
+    coefficients = vf_left_lag.cached(('spline_coefficients', s_i_o, mode),
+                                      lambda: [ndimage.spline_filter(c, order=s_i_o, output=np.float64, mode=mode)
+                                               for c in components])
+    return coefficients, False
+
+
+def _extrapolation_coefficients(vf_left_lag, components, mode):
+    """
+    Coefficients of mode='affine_extrapolation' for the components of the left field of a composition, computed
+    once and kept in it if it is a queries.VectorField.
+    :return: list with the coefficients of each component, or with None (computed at sampling) for plain arrays
+    and for the other modes.
+    """
+    if not (mode == 'affine_extrapolation' and isinstance(vf_left_lag, qr.VectorField)):
+        return [None] * len(components)
+    return vf_left_lag.cached('affine_extrapolation_coefficients',
+                              lambda: [affine_extrapolation_coefficients(c) for c in components])
 
 
 def scalar_dot_eulerian(sf_left,
@@ -121,18 +160,11 @@ def scalar_dot_eulerian(sf_left,
     omega_right = qr.get_omega(vf_right_eul)
     d = len(omega_right)
 
-    if affine_left_right is not None:
-        A_l, A_r = affine_left_right
-        # multiply each point of the vector field by the transformation matrix
-        vf_right_eul = matrices.matrix_vector_field_product(np.linalg.inv(A_l).dot(A_r), vf_right_eul)
-
     if d == 2:
         assert vf_right_eul.shape[:2] == sf_left.shape[::-1], 'Shape inconsistency.'
-        coord = [vf_right_eul[..., i].reshape(omega_right, order='F').T for i in range(d)][::-1]
-        result = np.zeros_like(sf_left)
-    else:
-        coord = [vf_right_eul[..., i].reshape(omega_right, order='F') for i in range(d)]
-        result = np.zeros_like(sf_left)
+
+    coord = eulerian_to_coordinates(vf_right_eul, affine_left_right=affine_left_right)
+    result = np.zeros_like(sf_left)
 
     ndimage.map_coordinates(sf_left,
                             coord,
@@ -145,6 +177,231 @@ def scalar_dot_eulerian(sf_left,
     return result
 
 
+def eulerian_to_coordinates(vf_right_eul, affine_left_right=None):
+    """
+    Coordinates where a scalar image is sampled to be resampled by the given deformation.
+    They are computed once and can be shared by all the channels of a multi-channel image.
+    :param vf_right_eul: vector field in Eulerian coordinates.
+    :param affine_left_right: optional couple of affine transformations (A_l, A_r).
+    :return: list of d arrays with the sampling coordinates, in the image convention of scalar_dot_eulerian
+    (in 2d the scalar images are indexed as (y, x)).
+    """
+    d = qr.check_is_vf(vf_right_eul)
+    coord = field_coordinates(vf_right_eul, affine_left_right=affine_left_right)
+
+    if d == 2:
+        return [c.T for c in coord][::-1]
+    else:
+        return coord
+
+
+def affine_left_right_to_matrix(affine_left_right, d):
+    """
+    :param affine_left_right: couple of affine transformations (A_l, A_r), 3x3 or 4x4 (as nifti affines).
+    :param d: dimension of the domain.
+    :return: (d + 1) x (d + 1) matrix inv(A_l) A_r in homogeneous coordinates, translation included.
+    """
+    A_l, A_r = affine_left_right
+    m = np.linalg.inv(A_l).dot(A_r)
+
+    if m.shape == (d + 1, d + 1):
+        return m
+    elif m.shape == (4, 4) and d == 2:
+        return m[np.ix_([0, 1, 3], [0, 1, 3])]
+    else:
+        raise IOError('Affine transformations of shape {} not compatible with a {}d field.'.format(m.shape, d))
+
+
+def field_coordinates(vf_right_eul, affine_left_right=None):
+    """
+    Positions of the Eulerian vector field, one array per component, indexed as the field.
+    If the affine transformations are given, the points are transformed while generating the coordinates:
+    coord_i = sum_j M_ij v_j + M_id, with M = inv(A_l) A_r. No transformed copy of the field is allocated.
+    :param vf_right_eul: vector field in Eulerian coordinates.
+    :param affine_left_right: optional couple of affine transformations (A_l, A_r).
+    :return: list of d arrays of shape omega. Without affine they are views of the input field.
+    """
+    omega_right = qr.get_omega(vf_right_eul)
+    d = len(omega_right)
+
+    if affine_left_right is None:
+        return [vf_right_eul[..., i].reshape(omega_right, order='F') for i in range(d)]
+
+    m = affine_left_right_to_matrix(affine_left_right, d)
+    components = [vf_right_eul[..., j].reshape(omega_right, order='F') for j in range(d)]
+    buffer = np.empty(omega_right, dtype=np.float64)
+
+    coord = []
+    for i in range(d):
+        c = np.full(omega_right, m[i, d], dtype=np.float64)
+        for j in range(d):
+            if m[i, j] != 0:
+                np.multiply(components[j], m[i, j], out=buffer)
+                c += buffer
+        coord.append(c)
+
+    return coord
+
+
+# ---- Boundary extrapolation ---- #
+
+
+extrapolation_modes = ('linear_extrapolation', 'affine_extrapolation')
+
+
+def boundary_band(omega, band=3):
+    """
+    :param omega: domain.
+    :param band: width of the band in voxels.
+    :return: boolean mask of the voxels closer than band to the boundary of the domain.
+    """
+    mask = np.ones(omega, dtype=bool)
+    if all(n > 2 * band for n in omega):
+        mask[tuple(slice(band, -band) for _ in omega)] = False
+    return mask
+
+
+def affine_extrapolation_coefficients(component, band=3):
+    """
+    Local affine functions used by mode='affine_extrapolation': at each voxel of the boundary of the domain, the
+    affine function fitted (least squares) on the voxels of the cube of side 2 * band + 1 centered in it and clipped
+    to the domain. The sums of the normal equations are box filters computed on slabs of thickness band + 1 along
+    each face, never on the whole domain.
+    :param component: scalar component of the displacement field, with shape omega.
+    :param band: half side of the cubes, in voxels.
+    :return: list of 2 d arrays, for the faces (axis 0 low, axis 0 high, axis 1 low, ...), with the shape of the
+    face (omega without the axis) plus the d + 1 coefficients a, b of the function a . x + b, in voxel coordinates.
+    """
+    omega = component.shape
+    d = len(omega)
+    size = 2 * band + 1
+
+    coefficients = []
+    for k, n in enumerate(omega):
+        for side in range(2):
+            thickness = min(band + 1, n)
+            axis_slice = slice(0, thickness) if side == 0 else slice(n - thickness, n)
+            slab = tuple(axis_slice if j == k else slice(0, omega[j]) for j in range(d))
+            face = tuple((0 if side == 0 else thickness - 1) if j == k else slice(None) for j in range(d))
+
+            # coordinates centered in the slab, for the conditioning of the covariances
+            grid = np.ogrid[slab]
+            centers = [0.5 * (sl.start + sl.stop - 1) for sl in slab]
+            x = [np.broadcast_to(g - c, component[slab].shape) for g, c in zip(grid, centers)]
+            f = component[slab]
+
+            # averages on the cubes clipped to the domain (the box filter is zero outside the slab)
+            weight = ndimage.uniform_filter(np.ones(f.shape), size=size, mode='constant', cval=0.0)[face]
+
+            def window_mean(g):
+                return ndimage.uniform_filter(g, size=size, mode='constant', cval=0.0)[face] / weight
+
+            mean_x = [window_mean(x[i]) for i in range(d)]
+            mean_f = window_mean(f)
+            covariance = np.empty(weight.shape + (d, d))
+            for i in range(d):
+                for j in range(i, d):
+                    covariance[..., i, j] = covariance[..., j, i] = window_mean(x[i] * x[j]) - mean_x[i] * mean_x[j]
+            cross = np.stack([window_mean(f * x[i]) - mean_x[i] * mean_f for i in range(d)], axis=-1)
+
+            a = np.einsum('...ij,...j->...i', np.linalg.pinv(covariance), cross)
+            b = mean_f - np.einsum('...i,...i->...', a, np.stack(mean_x, axis=-1) + centers)
+            coefficients.append(np.concatenate([a, b[..., np.newaxis]], axis=-1))
+
+    return coefficients
+
+
+def displacement_at_coordinates(component,
+                                coord,
+                                s_i_o=2,
+                                mode='constant',
+                                cval=0.0,
+                                prefilter=True,
+                                output=None,
+                                band=3,
+                                extrapolation_coefficients=None):
+    """
+    Sample one component of a displacement field at the given coordinates.
+    Besides the modes of scipy.ndimage.map_coordinates, two extrapolation modes are available for the points
+    outside the domain, so that compositions stay accurate near the boundary without padding the fields:
+    'linear_extrapolation': first order Taylor expansion from the closest point of the domain, with one sided
+    finite differences.
+    'affine_extrapolation': affine function fitted (least squares) on the voxels closer than band to the closest
+    voxel of the boundary, see affine_extrapolation_coefficients.
+    Only the points outside the domain are corrected, inside the domain the field is interpolated as in
+    mode='nearest'.
+    :param component: scalar component of the displacement field, with shape omega.
+    :param coord: list of d arrays (or array d x n) with the sampling coordinates.
+    :param s_i_o: spline interpolation order.
+    :param mode: see scipy.ndimage.map_coordinates, or one of extrapolation_modes.
+    :param cval: see scipy.ndimage.map_coordinates, unused by the extrapolation modes.
+    :param prefilter: see scipy.ndimage.map_coordinates.
+    :param output: optional array where to store the result, with the shape of the coordinates.
+    :param band: half side of the neighbourhoods used by 'affine_extrapolation'.
+    :param extrapolation_coefficients: output of affine_extrapolation_coefficients(component, band), if already
+    available (e.g. when the same field is sampled several times). If None it is computed.
+    :return: sampled component.
+    """
+    if output is None:
+        output = np.zeros(coord[0].shape, dtype=np.float64)
+
+    if mode not in extrapolation_modes:
+        ndimage.map_coordinates(component, coord, output=output, order=s_i_o, mode=mode, cval=cval,
+                                prefilter=prefilter)
+        return output
+
+    ndimage.map_coordinates(component, coord, output=output, order=s_i_o, mode='nearest', prefilter=prefilter)
+
+    omega = component.shape
+    outside = np.zeros(coord[0].shape, dtype=bool)
+    for c, n in zip(coord, omega):
+        outside |= (c < 0) | (c > n - 1)
+
+    if not np.any(outside):
+        return output
+
+    points = np.array([c[outside] for c in coord])
+
+    if mode == 'linear_extrapolation':
+        closest = np.array([np.clip(points[k], 0, n - 1) for k, n in enumerate(omega)])
+        values_closest = ndimage.map_coordinates(component, closest, order=s_i_o, mode='nearest', prefilter=prefilter)
+        values = np.copy(values_closest)
+
+        for k, n in enumerate(omega):
+            delta = points[k] - closest[k]
+            if n < 2 or not np.any(delta):
+                continue
+            # one sided difference, towards the inside of the domain
+            step = -np.sign(delta)
+            shifted = np.copy(closest)
+            shifted[k] += step
+            values_shifted = ndimage.map_coordinates(component, shifted, order=s_i_o, mode='nearest',
+                                                     prefilter=prefilter)
+            values += (values_closest - values_shifted) * (-step) * delta
+
+    else:
+        if extrapolation_coefficients is None:
+            extrapolation_coefficients = affine_extrapolation_coefficients(component, band=band)
+
+        # each point takes the affine function of the closest voxel of the boundary, on the face of the first axis
+        # along which it is outside the domain.
+        closest = np.array([np.rint(np.clip(points[k], 0, n - 1)).astype(np.int64) for k, n in enumerate(omega)])
+        face_of_point = np.full(points.shape[1], -1)
+        for k, n in reversed(list(enumerate(omega))):
+            face_of_point[points[k] < 0] = 2 * k
+            face_of_point[points[k] > n - 1] = 2 * k + 1
+
+        values = np.empty(points.shape[1], dtype=np.float64)
+        for f in np.unique(face_of_point):
+            on_face = face_of_point == f
+            k = f // 2
+            a = extrapolation_coefficients[f][tuple(closest[j, on_face] for j in range(len(omega)) if j != k)]
+            values[on_face] = np.einsum('ij,ji->i', a[:, :-1], points[:, on_face]) + a[:, -1]
+
+    output[outside] = values
+    return output
+
+
 # ---- Derived methods ---- #
 
 
@@ -154,9 +411,15 @@ def lagrangian_dot_lagrangian(vf_left_lag, vf_right_lag,
                               mode='constant',
                               cval=0.0,
                               prefilter=True,
-                              add_right=True):
-
-    vf_right_eul = cs.lagrangian_to_eulerian(vf_right_lag)
+                              add_right=True,
+                              eulerian_buffer=None):
+    """
+    As lagrangian_dot_eulerian, with the right field in Lagrangian coordinates.
+    :param eulerian_buffer: optional array with the shape of vf_right_lag, where the right field in Eulerian
+    coordinates is written instead of in a new array. Reused across compositions (e.g. by the scaling and squaring)
+    it saves the allocation of a field at each call. vf_right_lag itself can be given, if it can be overwritten.
+    """
+    vf_right_eul = cs.lagrangian_to_eulerian(vf_right_lag, out=eulerian_buffer)
 
     return lagrangian_dot_eulerian(vf_left_lag, vf_right_eul,
                                    affine_left_right=affine_left_right,
@@ -223,6 +486,390 @@ def scalar_dot_lagrangian(sf_left,
                                cval=cval,
                                prefilter=prefilter)
 
+
+# ---- Region of interest methods ---- #
+
+
+def roi_to_indices(roi):
+    """
+    :param roi: boolean mask with shape omega, or tuple of index arrays as returned by numpy.nonzero.
+    :return: tuple of d index arrays of the voxels in the region of interest.
+    """
+    if isinstance(roi, tuple):
+        return roi
+    return np.nonzero(roi)
+
+
+def dilate_roi(roi_mask, margin):
+    """
+    Dilation of the region of interest with a cube of side 2 * margin + 1, so that every voxel
+    closer than margin (in any norm) to the region is included.
+    :param roi_mask: boolean mask with shape omega.
+    :param margin: number of voxels added on each side.
+    :return: dilated boolean mask.
+    """
+    if margin <= 0:
+        return roi_mask.astype(bool)
+    return ndimage.maximum_filter(roi_mask.astype(np.uint8), size=2 * margin + 1, mode='constant') > 0
+
+
+def prefilter_halo(s_i_o):
+    """
+    Voxels beyond which the values of a field have a negligible influence (below 1e-6 of their size) on the spline
+    coefficients computed by the prefilter of the given order, so that the prefilter can be computed on a box
+    around the sampled points. The influence decays as |z| ** distance, with z the largest pole of the
+    filter (|z| < 0.44 up to order 5).
+    :param s_i_o: spline interpolation order.
+    :return: halo in voxels, 0 for the orders without prefilter.
+    """
+    if s_i_o <= 1:
+        return 0
+    return 4 * s_i_o
+
+
+def roi_margin(input_vf, s_i_o=2, num_steps=1, prefilter=True):
+    """
+    Automatic margin around a region of interest, for num_steps compositions of the input field with itself as in
+    the scaling and squaring (each step sampling the field computed by the previous one).
+    Each step needs the maximal displacement of its field and the support of the interpolating spline. The
+    displacements halve at each step backwards, so their sum is bounded by the maximal displacement of the input
+    field, while the support is added at every step. The halo of the prefilter is added once: the spline
+    coefficients of each field are computed once on the whole dilated region, so its boundary stays at a halo
+    from the values sampled.
+    :param input_vf: vector field in Lagrangian coordinates (the field of the last step).
+    :param s_i_o: spline interpolation order.
+    :param num_steps: number of compositions.
+    :param prefilter: if False the prefilter halo is not added, e.g. when the prefilter is computed on the whole
+    domain.
+    :return: margin in voxels.
+    """
+    d = qr.check_is_vf(input_vf)
+    max_norm = np.sqrt(np.max(np.sum(qr.as_array(input_vf)[..., :d] ** 2, axis=-1)))
+    halo = prefilter_halo(s_i_o) if prefilter else 0
+    return int(np.ceil(max_norm)) + num_steps * (s_i_o + 1) + halo
+
+
+def lagrangian_dot_lagrangian_roi(vf_left_lag, vf_right_lag,
+                                  roi,
+                                  s_i_o=2,
+                                  mode='constant',
+                                  cval=0.0,
+                                  prefilter=True,
+                                  add_right=True,
+                                  output=None):
+    """
+    Composition of two fields in Lagrangian coordinates evaluated only at the voxels of the region of interest.
+    The sampling coordinates are sparse index arrays of the size of the region, instead of full grids.
+    :param roi: boolean mask with shape omega, or tuple of index arrays as returned by numpy.nonzero.
+    :param output: optional field where the composition is written at the voxels of the region, other voxels
+    are left untouched. If None, the composition is zero outside the region.
+    :return: vf_left o vf_right in the region of interest.
+    """
+    omega = qr.get_omega(vf_right_lag)
+    d = len(omega)
+
+    idx = roi_to_indices(roi)
+    pad = (0, ) * (4 - d)
+
+    if output is None:
+        output = np.zeros_like(vf_left_lag)
+
+    right = [vf_right_lag[idx + pad + (i, )] for i in range(d)]
+    coord = np.array([idx[i] + right[i] for i in range(d)])
+
+    # the prefilter is computed only on the bounding box of the sampled points, plus its halo. Modes handling
+    # the boundary away from the border voxels (wrap, reflect, extrapolations) need the whole domain.
+    box = tuple(slice(0, n) for n in omega)
+    if prefilter and s_i_o > 1 and mode in ('constant', 'nearest') and coord.shape[1] > 0:
+        halo = prefilter_halo(s_i_o) + s_i_o + 1
+        starts = [int(np.clip(np.floor(np.min(c)) - halo, 0, n - 1)) for c, n in zip(coord, omega)]
+        stops = [int(np.clip(np.ceil(np.max(c)) + halo + 1, a + 1, n)) for c, a, n in zip(coord, starts, omega)]
+        box = tuple(slice(a, b) for a, b in zip(starts, stops))
+        coord = coord - np.array(starts).reshape((d, 1))
+
+    for i in range(d):
+        values = displacement_at_coordinates(vf_left_lag[..., i].reshape(omega, order='F')[box],
+                                             coord,
+                                             s_i_o=s_i_o,
+                                             mode=mode,
+                                             cval=cval,
+                                             prefilter=prefilter)
+        if add_right:
+            values += right[i]
+        output[idx + pad + (i, )] = values
+
+    return output
+
+
+# ---- Sparse operators ---- #
+
+
+def _sparse_operator_stamp(vf_right_eul, s_i_o, mode):
+    """
+    Parameters identifying a sparse operator, stored with it in the cache.
+    :param vf_right_eul: vector field in Eulerian coordinates.
+    :param s_i_o: spline interpolation order.
+    :param mode: boundary mode.
+    :return: dictionary of shape of the field, interpolation order, mode and hash of the field values.
+    """
+    field = np.ascontiguousarray(vf_right_eul, dtype=np.float64)
+    return {'field_shape': np.array(field.shape), 's_i_o': np.array(s_i_o), 'mode': np.array(mode),
+            'field_hash': np.array(hashlib.sha1(field.tobytes()).hexdigest())}
+
+
+def _load_sparse_operator(pfi_cache, stamp):
+    """
+    Load a sparse operator cached by eulerian_to_sparse_operator, checking that it was built for the same field,
+    interpolation order and mode.
+    :param pfi_cache: path to the .npz file.
+    :param stamp: parameters of the requested operator, as provided by _sparse_operator_stamp.
+    :return: scipy.sparse.csr_matrix.
+    """
+    with np.load(pfi_cache) as loaded:
+        for key, value in stamp.items():
+            if key not in loaded.files or not np.array_equal(loaded[key], value):
+                raise IOError('Sparse operator cached in {} was built with a different {}.'.format(pfi_cache, key))
+        operator = sparse.csr_matrix((loaded['data'], loaded['indices'], loaded['indptr']),
+                                     shape=tuple(loaded['shape']))
+    num_voxels = int(np.prod(stamp['field_shape'][:-2]))
+    if not operator.shape == (num_voxels, num_voxels):
+        raise IOError('Sparse operator cached in {} of shape {} not compatible with a field of {} voxels.'.format(
+            pfi_cache, operator.shape, num_voxels))
+    return operator
+
+
+def eulerian_to_sparse_operator(vf_right_eul, s_i_o=1, mode='constant', pfi_cache=None):
+    """
+    Warp of a scalar image by the given deformation, as a sparse matrix (CSR) of interpolation weights.
+    Once built, the same warp can be applied to many images as sparse matrix-vector products, with no
+    further computation of coordinates and weights.
+    Rows correspond to the voxels of the output and columns to the voxels of the input, both in C order
+    and with the image convention of scalar_dot_eulerian (in 2d the scalar images are indexed as (y, x)).
+    :param vf_right_eul: vector field in Eulerian coordinates.
+    :param s_i_o: spline interpolation order, 0 (nearest) or 1 (linear). Higher orders need the non-local spline
+    prefilter and can not be represented as sparse matrices.
+    :param mode: 'constant' (with cval=0) or 'nearest', as in scipy.ndimage.map_coordinates.
+    :param pfi_cache: optional path to a .npz file. If it exists the operator is loaded from it, otherwise it is
+    computed and saved there, together with the shape and a hash of the field, the interpolation order and the
+    mode. An IOError is raised if the cached operator was built with different ones.
+    :return: scipy.sparse.csr_matrix.
+    """
+    if pfi_cache is not None:
+        stamp = _sparse_operator_stamp(vf_right_eul, s_i_o, mode)
+        if os.path.exists(pfi_cache):
+            return _load_sparse_operator(pfi_cache, stamp)
+
+    if s_i_o not in [0, 1]:
+        raise IOError('Sparse operators are available only for spline interpolation order 0 or 1.')
+    if mode not in ['constant', 'nearest']:
+        raise IOError("Sparse operators are available only for mode 'constant' or 'nearest'.")
+
+    coord = eulerian_to_coordinates(vf_right_eul)
+    shape = coord[0].shape
+    coord = [c.ravel() for c in coord]
+    num_voxels = int(np.prod(shape))
+
+    valid = np.ones(num_voxels, dtype=bool)
+    if mode == 'constant':
+        for c, n in zip(coord, shape):
+            valid &= (c >= 0) & (c <= n - 1)
+    coord = [np.clip(c, 0, n - 1) for c, n in zip(coord, shape)]
+
+    rows = np.nonzero(valid)[0]
+    coord = [c[valid] for c in coord]
+
+    if s_i_o == 0:
+        corners = [np.minimum(np.floor(c + 0.5).astype(np.int64), n - 1) for c, n in zip(coord, shape)]
+        cols = np.ravel_multi_index(corners, shape)
+        weights = np.ones(len(rows))
+    else:
+        floors = [np.minimum(np.floor(c).astype(np.int64), max(n - 2, 0)) for c, n in zip(coord, shape)]
+        all_rows, all_cols, all_weights = [], [], []
+        for corner in np.ndindex(*[2] * len(shape)):
+            weight = np.ones(len(rows))
+            index = []
+            for k, n in enumerate(shape):
+                index_k = np.minimum(floors[k] + corner[k], n - 1)
+                weight *= np.clip(1 - np.abs(coord[k] - index_k), 0, 1)
+                index.append(index_k)
+            all_rows.append(rows)
+            all_cols.append(np.ravel_multi_index(index, shape))
+            all_weights.append(weight)
+        rows, cols, weights = np.concatenate(all_rows), np.concatenate(all_cols), np.concatenate(all_weights)
+        non_zero = weights > 0
+        rows, cols, weights = rows[non_zero], cols[non_zero], weights[non_zero]
+
+    operator = sparse.csr_matrix((weights, (rows, cols)), shape=(num_voxels, num_voxels))
+
+    if pfi_cache is not None:
+        # same keys of scipy.sparse.save_npz, so that the cache can be read by scipy.sparse.load_npz as well.
+        np.savez(pfi_cache, data=operator.data, indices=operator.indices, indptr=operator.indptr,
+                 format=np.array('csr'), shape=np.array(operator.shape), **stamp)
+
+    return operator
+
+
+def lagrangian_to_sparse_operator(vf_right_lag, s_i_o=1, mode='constant', pfi_cache=None):
+    """
+    As eulerian_to_sparse_operator, for a vector field in Lagrangian coordinates.
+    """
+    vf_right_eul = cs.lagrangian_to_eulerian(vf_right_lag)
+
+    return eulerian_to_sparse_operator(vf_right_eul, s_i_o=s_i_o, mode=mode, pfi_cache=pfi_cache)
+
+
+def image_dot_sparse_operator(im_left, operator, adjoint=False):
+    """
+    Apply a warp stored as sparse operator to a scalar or multi-channel image.
+    All the channels are warped together in a single sparse matrix - dense matrix product.
+    :param im_left: image whose first d axis are spatial and the following are channels.
+    :param operator: sparse operator as provided by eulerian_to_sparse_operator.
+    :param adjoint: if True the transposed operator is applied (adjoint warp, or push-forward of the image).
+    :return: warped image, with the same shape of the input.
+    """
+    num_voxels = operator.shape[1]
+    spatial_size = 1
+    d = 0
+    while spatial_size < num_voxels and d < im_left.ndim:
+        spatial_size *= im_left.shape[d]
+        d += 1
+    if not spatial_size == num_voxels:
+        raise IOError('Image of shape {} not compatible with the operator of shape {}.'.format(im_left.shape,
+                                                                                             operator.shape))
+
+    im_matrix = im_left.reshape(num_voxels, -1)
+    if adjoint:
+        result = operator.T.dot(im_matrix)
+    else:
+        result = operator.dot(im_matrix)
+
+    return result.reshape(im_left.shape)
+
+
+# ---- Multi-channel methods ---- #
+
+
+def channel_dot_coordinates(channel, coord, s_i_o=3, mode='constant', cval=0.0, prefilter=False,
+                            interpolation='spline', output=None):
+    """
+    Resample a single channel at the given coordinates.
+    :param channel: scalar image.
+    :param coord: coordinates as provided by eulerian_to_coordinates.
+    :param s_i_o: spline interpolation order, used only by interpolation='spline'.
+    :param mode: see scipy.ndimage.map_coordinates.
+    :param cval: see scipy.ndimage.map_coordinates.
+    :param prefilter: see scipy.ndimage.map_coordinates.
+    :param interpolation: 'spline' for intensity images, 'nearest' or 'majority' for label images.
+    'majority' interpolates linearly the indicator function of each label and keeps, at each voxel, the label
+    with the highest weight.
+    :param output: optional array where to store the result, with the shape of the coordinates.
+    :return: resampled channel.
+    """
+    if output is None:
+        output = np.zeros(coord[0].shape, dtype=channel.dtype)
+
+    if interpolation == 'spline':
+        ndimage.map_coordinates(channel, coord, output=output, order=s_i_o, mode=mode, cval=cval,
+                                prefilter=prefilter)
+    elif interpolation == 'nearest':
+        ndimage.map_coordinates(channel, coord, output=output, order=0, mode=mode, cval=cval)
+    elif interpolation == 'majority':
+        best_weight = np.zeros(coord[0].shape, dtype=np.float64)
+        weight = np.zeros_like(best_weight)
+        output[...] = cval
+        for label in np.unique(channel):
+            ndimage.map_coordinates((channel == label).astype(np.float64), coord, output=weight, order=1,
+                                    mode=mode, cval=0.0)
+            wins = weight > best_weight
+            output[wins] = label
+            best_weight[wins] = weight[wins]
+    else:
+        raise IOError("interpolation can be only 'spline', 'nearest' or 'majority'.")
+
+    return output
+
+
+def iterate_multichannel_dot_eulerian(im_left,
+                                      vf_right_eul,
+                                      affine_left_right=None,
+                                      s_i_o=3,
+                                      mode='constant',
+                                      cval=0.0,
+                                      prefilter=False,
+                                      interpolation='spline'):
+    """
+    Generator version of multichannel_dot_eulerian: the sampling coordinates are computed once and
+    each channel is resampled and yielded only when requested, so that long 4d series can be streamed.
+    :return: yields couples (channel index, resampled channel).
+    """
+    d = len(qr.get_omega(vf_right_eul))
+    coord = eulerian_to_coordinates(vf_right_eul, affine_left_right=affine_left_right)
+
+    if not tuple(im_left.shape[:d]) == coord[0].shape:
+        raise IOError('Shape inconsistency between image {} and vector field {}.'.format(im_left.shape,
+                                                                                       vf_right_eul.shape))
+
+    for channel_index in np.ndindex(*im_left.shape[d:]):
+        yield channel_index, channel_dot_coordinates(im_left[(Ellipsis, ) + channel_index], coord,
+                                                     s_i_o=s_i_o, mode=mode, cval=cval, prefilter=prefilter,
+                                                     interpolation=interpolation)
+
+
+def multichannel_dot_eulerian(im_left,
+                              vf_right_eul,
+                              affine_left_right=None,
+                              s_i_o=3,
+                              mode='constant',
+                              cval=0.0,
+                              prefilter=False,
+                              interpolation='spline',
+                              output=None):
+    """
+    Resample a multi-channel image (e.g. 4d time series, DTI or a stack of probability maps)
+    with the same deformation. The sampling coordinates are computed only once for all the channels.
+    :param im_left: image whose first d axis are spatial (same convention of scalar_dot_eulerian) and
+    the following axis are channels.
+    :param vf_right_eul: vector field in Eulerian coordinates.
+    :param interpolation: 'spline', 'nearest' or 'majority' (see channel_dot_coordinates).
+    :param output: optional pre-allocated output (e.g. a numpy.memmap), with the same shape of im_left.
+    :return: resampled image.
+    """
+    if output is None:
+        output = np.zeros_like(im_left)
+
+    for channel_index, resampled_channel in iterate_multichannel_dot_eulerian(im_left, vf_right_eul,
+                                                                              affine_left_right=affine_left_right,
+                                                                              s_i_o=s_i_o,
+                                                                              mode=mode,
+                                                                              cval=cval,
+                                                                              prefilter=prefilter,
+                                                                              interpolation=interpolation):
+        output[(Ellipsis, ) + channel_index] = resampled_channel
+
+    return output
+
+
+def multichannel_dot_lagrangian(im_left,
+                                vf_right_lag,
+                                affine_left_right=None,
+                                s_i_o=2,
+                                mode='constant',
+                                cval=0.0,
+                                prefilter=True,
+                                interpolation='spline',
+                                output=None):
+
+    vf_right_eul = cs.lagrangian_to_eulerian(vf_right_lag)
+
+    return multichannel_dot_eulerian(im_left, vf_right_eul,
+                                     affine_left_right=affine_left_right,
+                                     s_i_o=s_i_o,
+                                     mode=mode,
+                                     cval=cval,
+                                     prefilter=prefilter,
+                                     interpolation=interpolation,
+                                     output=output)
+
 #
 # if __name__ == '__main__':
 #
@@ -0,0 +1,173 @@
+"""
+Out-of-core resampling of nifti images.
+The input image and the displacement field are accessed through the nibabel (memory mapped) array proxy,
+the output is written block by block in a nifti file memory mapped on disk. Only the bounding box of the source
+voxels needed by each output block is loaded in memory.
+"""
+import os
+
+import nibabel as nib
+import numpy as np
+
+from calie.fields import queries as qr
+from calie.fields import compose as cp
+
+
+def _load_image(input_obj):
+    """
+    :param input_obj: path to a nifti image, nibabel image or numpy array (possibly a numpy.memmap).
+    :return: nibabel image loaded with memory mapping, or the input numpy array.
+    """
+    if isinstance(input_obj, str):
+        if not os.path.exists(input_obj):
+            raise IOError('Input path {} does not exist.'.format(input_obj))
+        return nib.load(input_obj, mmap=True)
+    return input_obj
+
+
+def _proxy(input_obj):
+    """
+    :return: object that can be sliced without loading the whole data in memory.
+    """
+    if isinstance(input_obj, np.ndarray):
+        return input_obj
+    if isinstance(input_obj, qr.VectorField):
+        return input_obj.array
+    return input_obj.dataobj
+
+
+# modes whose boundary handling depends only on the voxels at the border of the domain, so that resampling a
+# bounding box clipped to the domain is the same as resampling the whole image. With 'wrap', 'reflect' or 'mirror'
+# the coordinates outside the domain would be folded back against the box instead of the image.
+out_of_core_modes = ('constant', 'nearest')
+
+
+def _header_like(pfi_output, input_im_header, shape, dtype):
+    if not pfi_output.endswith('.nii'):
+        raise IOError('Output {} must be an uncompressed nifti (.nii) to be written incrementally.'.format(pfi_output))
+
+    hdr = input_im_header.copy()
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(dtype)
+    hdr.set_slope_inter(1, 0)
+    return hdr
+
+
+def open_nifti_memmap(pfi_output, header):
+    """
+    Write the header of a single file nifti image on disk and return its data as a numpy.memmap,
+    so that the image can be filled incrementally.
+    :param pfi_output: path to the output .nii image.
+    :param header: nibabel nifti header with the shape and data type of the output.
+    :return: numpy.memmap of the data of the output nifti image.
+    """
+    # header, extension flag and extensions, as nibabel writes them.
+    offset = header.sizeof_hdr + 4 + sum(ext.get_sizeondisk() for ext in header.extensions)
+    header.set_data_offset(offset)
+    header['magic'] = header.single_magic
+
+    with open(pfi_output, 'wb') as f:
+        header.write_to(f)
+
+    return np.memmap(pfi_output, dtype=header.get_data_dtype(), mode='r+', offset=offset,
+                     shape=header.get_data_shape(), order='F')
+
+
+def block_bounding_box(coord, omega, margin):
+    """
+    :param coord: list of d arrays with the coordinates where the source image is sampled.
+    :param omega: shape of the source image.
+    :param margin: additional voxels on each side (for the support of the interpolating splines).
+    :return: list of d slices of the source image containing all the coordinates plus margin, clipped to the domain.
+    The slices are never empty, so that coordinates all outside the domain are still resampled according to the mode.
+    """
+    box = []
+    for c, n in zip(coord, omega):
+        lo = min(max(int(np.floor(np.min(c))) - margin, 0), n - 1)
+        hi = max(min(int(np.ceil(np.max(c))) + margin + 1, n), lo + 1)
+        box.append(slice(lo, hi))
+    return box
+
+
+def scalar_dot_lagrangian_out_of_core(input_image,
+                                      vf_right_lag,
+                                      pfi_output,
+                                      block_size=(64, 64, 64),
+                                      s_i_o=1,
+                                      mode='constant',
+                                      cval=0.0,
+                                      prefilter=True,
+                                      interpolation='spline',
+                                      margin=None,
+                                      output_dtype=None):
+    """
+    Resample a 3d (possibly multi-channel) nifti image with a displacement field, in bounded memory.
+    :param input_image: path to a nifti image, or nibabel image. Additional axis after the third are channels.
+    :param vf_right_lag: displacement field in Lagrangian coordinates, with shape (x, y, z, 1, 3): path to a nifti
+    image, nibabel image or numpy array (possibly a numpy.memmap).
+    :param pfi_output: path to the output uncompressed nifti image (.nii).
+    :param block_size: size of the output blocks resampled at each step.
+    :param s_i_o: spline interpolation order.
+    :param mode: one of out_of_core_modes, see scipy.ndimage.map_coordinates.
+    :param cval: see scipy.ndimage.map_coordinates.
+    :param prefilter: see scipy.ndimage.map_coordinates.
+    :param interpolation: 'spline', 'nearest' or 'majority' (see compose.channel_dot_coordinates).
+    :param margin: voxels added around the bounding box of each block. If None is s_i_o + 3.
+    For s_i_o <= 1 the result is identical to compose.scalar_dot_lagrangian, for higher orders the
+    prefilter is computed on the bounding box and the result is equal up to the decay of the spline coefficients.
+    :param output_dtype: data type of the output. If None it is the floating type of the values of the input image
+    after its scaling, at least float32. For integer types the resampled values are rounded and
+    clipped to the range of the type. The output has no scaling (slope 1, intercept 0).
+    :return: numpy.memmap of the output image data.
+    """
+    if mode not in out_of_core_modes:
+        raise IOError('Mode {} not in {}: the boundary would be handled on the blocks and not on the '
+                      'image.'.format(mode, out_of_core_modes))
+
+    input_image = _load_image(input_image)
+    im_proxy = _proxy(input_image)
+    vf_proxy = _proxy(_load_image(vf_right_lag))
+
+    omega = tuple(im_proxy.shape[:3])
+    if not tuple(vf_proxy.shape) == omega + (1, 3):
+        raise IOError('Displacement field of shape {} not compatible with the image of shape {}.'.format(
+            vf_proxy.shape, im_proxy.shape))
+
+    if margin is None:
+        margin = s_i_o + 3
+    if output_dtype is None:
+        # type of the values read through the proxy, after the scaling of the input.
+        output_dtype = np.promote_types(np.asarray(im_proxy[(0, ) * len(im_proxy.shape)]).dtype, np.float32)
+    output_dtype = np.dtype(output_dtype)
+
+    hdr = _header_like(pfi_output, input_image.header, im_proxy.shape, output_dtype)
+    output = open_nifti_memmap(pfi_output, hdr)
+
+    for x0 in range(0, omega[0], block_size[0]):
+        for y0 in range(0, omega[1], block_size[1]):
+            for z0 in range(0, omega[2], block_size[2]):
+                block = (slice(x0, min(x0 + block_size[0], omega[0])),
+                         slice(y0, min(y0 + block_size[1], omega[1])),
+                         slice(z0, min(z0 + block_size[2], omega[2])))
+
+                disp_block = np.asarray(vf_proxy[block + (0, )], dtype=np.float64)
+                grid = np.ogrid[block]
+                coord = [disp_block[..., i] + grid[i] for i in range(3)]
+
+                box = block_bounding_box(coord, omega, margin)
+                for i in range(3):
+                    coord[i] -= box[i].start
+
+                source = np.asarray(im_proxy[tuple(box)], dtype=np.float64)
+                for channel_index in np.ndindex(*source.shape[3:]):
+                    values = cp.channel_dot_coordinates(
+                        source[(Ellipsis, ) + channel_index], coord, s_i_o=s_i_o, mode=mode, cval=cval,
+                        prefilter=prefilter, interpolation=interpolation)
+                    if np.issubdtype(output_dtype, np.integer):
+                        info = np.iinfo(output_dtype)
+                        values = np.clip(np.rint(values), info.min, info.max)
+                    output[block + channel_index] = values
+
+        output.flush()
+
+    return output
@@ -1,25 +1,47 @@
 import numpy as np
 
 from calie.fields import generate_identities as gen_id
+from calie.fields import queries as qr
 
 
-def affine_to_homogeneous(input_vf):
+def homogeneous_buffer(shape, dtype=np.float64):
+    """
+    Preallocated array for the homogeneous coordinates of vector fields of the given shape, with the last channel
+    already filled with ones. Reused with affine_to_homogeneous(input_vf, out=buffer), only the first d channels
+    are copied at each call.
+    :param shape: shape of the vector field in affine coordinates, with d components in the last axis.
+    :param dtype: data type of the buffer.
+    :return: array of shape shape[:-1] + (d + 1, ).
+    """
+    shape = tuple(shape)
+    buffer = np.empty(shape[:-1] + (shape[-1] + 1, ), dtype=dtype)
+    buffer[..., -1] = 1
+    return buffer
+
+
+def affine_to_homogeneous(input_vf, out=None):
     """
     Adds the homogeneous coordinates to the given vector field.
     input_v(x,y,z,0,:) = (vx, vy, vz)
     output_v(x,y,z,0,:) = (vx, vy, vz, 1)
     :param input_vf: input vector field
+    :param out: optional buffer created by homogeneous_buffer, where the field is written. Its last channel is
+    assumed to be already filled with ones and it is not written again.
+    :return: vector field in homogeneous coordinates.
     """
-    slice_shape = list(input_vf.shape)
-    slice_shape[4] = 1
+    if out is None:
+        out = homogeneous_buffer(input_vf.shape, dtype=np.result_type(input_vf, np.float64))
+    elif not out.shape == input_vf.shape[:-1] + (input_vf.shape[-1] + 1, ):
+        raise IOError('Buffer of shape {} for a field of shape {}.'.format(out.shape, input_vf.shape))
 
-    return np.append(input_vf, np.ones(slice_shape), axis=4)
+    out[..., :-1] = input_vf
+    return out
 
 
 def homogeneous_to_affine(input_vf):
     """
     Removes the homogeneous coordinates to the given homogeneous field.
-    It changes the provided data structure instead of creating a new one.
+    No data is copied: the result is a view of the input, sharing its memory.
     :param input_vf:
     :return: field in affine coordinates.
 
@@ -29,10 +51,67 @@ def homogeneous_to_affine(input_vf):
     return input_vf[..., :-1]
 
 
-def eulerian_to_lagrangian(input_vf_eul):
-    return input_vf_eul - gen_id.id_eulerian_like(input_vf_eul)
+def _add_identity(input_vf, sign, identity, out):
+    """
+    :param input_vf: vector field.
+    :param sign: 1 to add the identity, -1 to subtract it.
+    :param identity: identity in Eulerian coordinates, as a field or as the list of its components
+    (see generate_identities.id_eulerian_grid). If None the broadcast views of id_eulerian_grid_like are used.
+    :param out: array where the result is written, possibly input_vf itself. If None a new array is created.
+    :return: input_vf plus or minus the identity, without materialising the identity field. If input_vf is a
+    queries.VectorField modified in place, the container itself, with the new coordinates convention.
+    """
+    if identity is None:
+        identity = gen_id.id_eulerian_grid_like(input_vf)
+    elif not isinstance(identity, list):
+        identity = [identity[..., k] for k in range(identity.shape[-1])]
+
+    field = qr.as_array(input_vf)
+    if out is None:
+        result = np.array(field, dtype=np.result_type(field, np.float64))
+    elif not out.shape == field.shape:
+        raise IOError('Output of shape {} for a field of shape {}.'.format(out.shape, field.shape))
+    else:
+        result = qr.as_array(out)
+        if result is not field:
+            result[...] = field
+    for k, coordinate in enumerate(identity):
+        if sign > 0:
+            result[..., k] += coordinate
+        else:
+            result[..., k] -= coordinate
+
+    if isinstance(out, qr.VectorField):
+        out.invalidate()
+        out.is_lagrangian = sign < 0
+        return out
+    return result
+
 
+def eulerian_to_lagrangian(input_vf_eul, identity=None, out=None, inplace=False):
+    """
+    :param input_vf_eul: vector field in Eulerian coordinates (deformation).
+    :param identity: optional identity in Eulerian coordinates, field or list of components, e.g. the read-only
+    views of generate_identities.id_eulerian_grid reused across calls.
+    :param out: optional array with the shape of the field where the result is written, e.g. a buffer reused
+    across calls.
+    :param inplace: if True the input field (of floating type) is overwritten with the result, as out=input_vf_eul.
+    :return: vector field in Lagrangian coordinates (displacement).
+    """
+    if inplace:
+        out = input_vf_eul
+    return _add_identity(input_vf_eul, -1, identity, out)
 
-def lagrangian_to_eulerian(input_vf_lag):
-    return input_vf_lag + gen_id.id_eulerian_like(input_vf_lag)
+
+def lagrangian_to_eulerian(input_vf_lag, identity=None, out=None, inplace=False):
+    """
+    :param input_vf_lag: vector field in Lagrangian coordinates (displacement).
+    :param identity: optional identity in Eulerian coordinates, see eulerian_to_lagrangian.
+    :param out: optional array with the shape of the field where the result is written.
+    :param inplace: if True the input field (of floating type) is overwritten with the result, as out=input_vf_lag.
+    :return: vector field in Eulerian coordinates (deformation).
+    """
+    if inplace:
+        out = input_vf_lag
+    return _add_identity(input_vf_lag, 1, identity, out)
 
@@ -1,10 +1,9 @@
 import numpy as np
 import scipy.ndimage.filters as fil
+from scipy import fft
 
 from calie.fields import queries as qr
 from calie.fields import coordinate as cs
-from calie.fields import generate_identities as gen_id
-from calie.fields import coordinate as coord
 
 
 def generate_random(omega, t=1, parameters=(5, 2)):
@@ -29,11 +28,127 @@ def generate_random(omega, t=1, parameters=(5, 2)):
     return vf
 
 
+random_spectra = ('gaussian', 'matern')
+
+
+def _spectral_filter(omega, spectrum, length, nu=1.5):
+    """
+    Transfer function of the smoothing on the half spectrum of scipy.fft.rfftn over the spatial axes.
+    'gaussian': exp(-2 pi^2 length^2 |f|^2), gaussian filter with standard deviation length (in voxels).
+    'matern': (1 + (2 pi length |f|)^2)^(-(nu + d / 2) / 2), square root of the Matern spectral density with
+    correlation length length and smoothness nu.
+    Both are 1 at the frequency zero, as the gaussian filter of generate_random.
+    :param omega: domain of the field.
+    :param spectrum: one of random_spectra.
+    :param length: length scale of the spectrum, in voxels.
+    :param nu: smoothness of the Matern spectrum.
+    :return: array of shape omega[:-1] + (omega[-1] // 2 + 1, ).
+    """
+    d = len(omega)
+    frequencies = [fft.fftfreq(n) for n in omega[:-1]] + [fft.rfftfreq(omega[-1])]
+    squared_norm = sum(f.reshape([-1 if k == i else 1 for k in range(d)]) ** 2 for i, f in enumerate(frequencies))
+
+    if spectrum == 'gaussian':
+        return np.exp(-2 * np.pi ** 2 * length ** 2 * squared_norm)
+    elif spectrum == 'matern':
+        return (1 + 4 * np.pi ** 2 * length ** 2 * squared_norm) ** (-(nu + d / 2.) / 2.)
+    else:
+        raise IOError('Spectrum {} not in {}.'.format(spectrum, random_spectra))
+
+
+def generate_random_spectral(omega, t=1, parameters=(5, 2), spectrum='gaussian', nu=1.5, batch=None, seed=None,
+                             first_sample=0, dtype=np.float64):
+    """
+    Random smooth vector field v in Lagrangian coordinates, drawn in the frequency domain: complex white noise
+    on the half spectrum is multiplied by the transfer function of the spectrum and transformed back with one
+    inverse real FFT for all the time points and components. The field is periodic on the domain: with the
+    gaussian spectrum it has the distribution of white noise smoothed by a gaussian filter with mode 'wrap'.
+    generate_random smooths with the default mode 'reflect' of scipy, so the two distributions agree only at
+    a few length scales from the boundary.
+    Each sample has its own random generator, seeded by the child of numpy.random.SeedSequence(seed) with
+    spawn key (sample index, ), so each sample can be regenerated alone, lazily, in any order or in parallel.
+    :param omega: domain of the vector field.
+    :param t: number of time points, each an independent field.
+    :param parameters: (sigma initial randomness, length scale of the spectrum), as in generate_random.
+    :param spectrum: 'gaussian' or 'matern', see random_spectra.
+    :param nu: smoothness of the Matern spectrum.
+    :param batch: None for a single vector field, or number of samples of a batch stacked along a leading axis.
+    :param seed: entropy of the SeedSequence. If None fresh entropy is used and the samples are not reproducible.
+    :param first_sample: index of the first sample (of the only sample if batch is None).
+    :param dtype: numpy.float64 or numpy.float32. In single precision the noise, the FFT and the output are
+    float32: the same seed gives different samples in the two precisions.
+    :return: vector field, or batch of vector fields.
+    """
+    d = qr.check_omega(omega)
+    omega = tuple(omega)
+    sigma_init, length = parameters
+    dtype = np.dtype(dtype)
+    complex_dtype = np.result_type(dtype, np.complex64)
+
+    # white noise of variance sigma_init^2 has a transform with E|W|^2 = N sigma_init^2. Real and imaginary parts
+    # are drawn independently, and irfftn keeps the hermitian part of the planes k_last = 0 and k_last = Nyquist,
+    # halving their variance: it is restored on those planes.
+    transfer = sigma_init * np.sqrt(np.prod(omega) / 2.) * _spectral_filter(omega, spectrum, length, nu=nu)
+    transfer[..., 0] *= np.sqrt(2)
+    if omega[-1] % 2 == 0:
+        transfer[..., -1] *= np.sqrt(2)
+    transfer = transfer.reshape(transfer.shape + (1, 1)).astype(dtype)
+
+    half_shape = transfer.shape[:-2] + (t, d)
+    v_shape = qr.shape_from_omega_and_timepoints(omega, t)
+
+    num_samples = 1 if batch is None else batch
+    vf = np.empty([num_samples] + v_shape, dtype=dtype)
+
+    entropy = np.random.SeedSequence(seed).entropy
+    for s in range(num_samples):
+        rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(first_sample + s, )))
+        noise = np.empty(half_shape, dtype=complex_dtype)
+        noise.real = rng.standard_normal(half_shape, dtype=dtype)
+        noise.imag = rng.standard_normal(half_shape, dtype=dtype)
+        noise *= transfer
+        vf[s] = fft.irfftn(noise, s=omega, axes=tuple(range(d)), overwrite_x=True).reshape(v_shape)
+
+    if batch is None:
+        return vf[0]
+    return vf
+
+
+def _homogeneous_grid(omega):
+    """
+    Homogeneous coordinates (x, y, [z,] 1) of the points of the grid omega, filled from an open grid in a
+    coordinate.homogeneous_buffer (no identity field is created and then copied).
+    :param omega: shape of the grid, with n axes.
+    :return: array of shape omega + (n + 1, ).
+    """
+    n = len(omega)
+    grid = np.ogrid[tuple(slice(0, w) for w in omega)]
+    points = cs.homogeneous_buffer(tuple(omega) + (n, ))
+    for k in range(n):
+        points[..., k] = grid[k]
+    return points
+
+
+def _matrix_on_grid(points, input_matrix):
+    """
+    Matrices applied to each point of a grid of homogeneous coordinates, with a single broadcast matrix product.
+    :param points: homogeneous coordinates of the grid, array of shape omega + (n + 1, ), see _homogeneous_grid.
+    :param input_matrix: m x (n + 1) matrix, or stack of matrices with shape (..., m, n + 1).
+    :return: array of shape stack + omega + (m, ).
+    """
+    n = len(points.shape) - 1
+    stack = input_matrix.shape[:-2]
+    # each matrix of the stack is broadcast over the grid
+    matrices = input_matrix.reshape(stack + (1, ) * n + input_matrix.shape[-2:])
+    return np.matmul(matrices, points[..., np.newaxis])[..., 0]
+
+
 def generate_from_matrix(omega, input_matrix, t=1, structure='algebra'):
     """
     :param omega: domain of the vector field.
     :param input_matrix: matrix generating the transformation of the vector field representing elements form groups
-    SE(3), SE(2) or algebras so(3) and so(2).
+    SE(3), SE(2) or algebras so(3) and so(2). A stack of matrices with shape (b, n, n) generates a batch of b
+    vector fields, stacked along a leading axis.
     :param t: timepoints.
     :param structure: can be 'algebra' or 'group'.
     :return: vector field with the given input parameters.
@@ -42,59 +157,39 @@ def generate_from_matrix(omega, input_matrix, t=1, structure='algebra'):
         raise IndexError('Random generator not defined (yet) for multiple time points')
 
     d = qr.check_omega(omega)
-    v_shape = qr.shape_from_omega_and_timepoints(omega, t)
-    vf = np.zeros(v_shape)
+    input_matrix = np.asarray(input_matrix, dtype=np.float64)
+    stack = input_matrix.shape[:-2]
+    v_shape = list(stack) + qr.shape_from_omega_and_timepoints(omega, t)
 
     if structure == 'algebra':
         pass
     elif structure == 'group':
-        input_matrix = input_matrix - np.eye(input_matrix.shape[0])
+        input_matrix = input_matrix - np.eye(input_matrix.shape[-1])
     else:
         raise IOError
 
     if d == 2:
 
-        if not np.alltrue(input_matrix.shape == (3, 3)):
+        if not input_matrix.shape[-2:] == (3, 3):
             raise IOError('Omega dimension not compatible with the matrix dimension')
 
-        vf = cs.affine_to_homogeneous(gen_id.id_eulerian(omega))
-
-        x_intervals, y_intervals = omega
-        for i in range(x_intervals):
-            for j in range(y_intervals):
-                vf[i, j, 0, 0, :] = input_matrix.dot(vf[i, j, 0, 0, :])
-
-        vf = cs.homogeneous_to_affine(vf)
+        vf = _matrix_on_grid(_homogeneous_grid(omega), input_matrix[..., :2, :]).reshape(v_shape)
 
     elif d == 3:
         # If the matrix provides a 2d rototranslation, we consider the rotation axis perpendicular to the plane z=0.
         # this must be improved for 3d rotations in the space.
-        x_intervals, y_intervals, z_intervals = omega
-
-        if np.alltrue(input_matrix.shape == (3, 3)):
+        if input_matrix.shape[-2:] == (3, 3):
 
-            # Create the slice at the ground of the domain (x,y,z) , z = 0, as a 2d rotation:
-            base_slice = cs.affine_to_homogeneous(gen_id.id_eulerian(list(omega[:2])))
-
-            for i in range(x_intervals):
-                for j in range(y_intervals):
-                    base_slice[i, j, 0, 0, :] = input_matrix.dot(base_slice[i, j, 0, 0, :])
-
-            # Copy the slice at the ground on all the others:
-            for k in range(z_intervals):
-                vf[..., k, 0, :2] = base_slice[..., 0, 0, :2]
+            # The slice at the ground of the domain (x,y,z) , z = 0, as a 2d rotation, is broadcast to the others:
+            base_slice = _matrix_on_grid(_homogeneous_grid(omega[:2]), input_matrix[..., :2, :])
+            vf = np.zeros(v_shape)
+            vf[..., :2] = base_slice[..., np.newaxis, np.newaxis, :]
 
         # If the matrix is 3d the rotation axis is perpendicular to the plane z=0.
-        elif np.alltrue(input_matrix.shape == (4, 4)):
+        elif input_matrix.shape[-2:] == (4, 4):
 
-            vf = cs.affine_to_homogeneous(gen_id.id_eulerian(omega))
+            vf = _matrix_on_grid(_homogeneous_grid(omega), input_matrix[..., :3, :]).reshape(v_shape)
 
-            for i in range(x_intervals):
-                for j in range(y_intervals):
-                    for k in range(z_intervals):
-                        vf[i, j, k, 0, :] = input_matrix.dot(vf[i, j, k, 0, :])
-
-            vf = cs.homogeneous_to_affine(vf)
         else:
             raise IOError('Wrong input matrix shape. Must be 3x3 or 4x4.')
 
@@ -103,9 +198,12 @@ def generate_from_matrix(omega, input_matrix, t=1, structure='algebra'):
 
 def generate_from_projective_matrix(omega, input_h, t=1, structure='algebra'):
     """
-
+    Vector field generated by a homography, evaluated on the whole grid at once.
+    'algebra': v(x) = h[:d] p - x h[d] p, with p = (x, 1) in homogeneous coordinates.
+    'group': displacement h[:d] p / (h[d] p) - x, set to zero where the denominator is below 1e-5 in absolute value.
     :param omega: domain of the vector field.
-    :param input_h: matrix representing an element form the homography group.
+    :param input_h: matrix representing an element form the homography group, or stack of matrices with shape
+    (b, d + 1, d + 1) generating a batch of b vector fields, stacked along a leading axis.
     :param t: number of timepoints.
     :param structure: can be 'algebra' or 'group'.
     :return: vector field with the given input parameters.
@@ -115,72 +213,24 @@ def generate_from_projective_matrix(omega, input_h, t=1, structure='algebra'):
         raise IndexError('Random generator not defined (yet) for multiple time points')
 
     d = qr.check_omega(omega)
+    input_h = np.asarray(input_h, dtype=np.float64)
+    v_shape = list(input_h.shape[:-2]) + qr.shape_from_omega_and_timepoints(omega, t)
 
-    if structure == 'algebra':
-
-        if d == 2:
-
-            idd = gen_id.id_eulerian(omega)
-            vf = gen_id.id_lagrangian(omega)
-
-            idd = coord.affine_to_homogeneous(idd)
-
-            x_intervals, y_intervals = omega
-            for i in range(x_intervals):
-                for j in range(y_intervals):
-                    vf[i, j, 0, 0, 0] = input_h[0, :].dot(idd[i, j, 0, 0, :]) - i * input_h[2, :].dot(idd[i, j, 0, 0, :])
-                    vf[i, j, 0, 0, 1] = input_h[1, :].dot(idd[i, j, 0, 0, :]) - j * input_h[2, :].dot(idd[i, j, 0, 0, :])
-
-            return vf
-
-        elif d == 3:
-
-            idd = gen_id.id_eulerian(omega)
-            vf = gen_id.id_lagrangian(omega)
-
-            idd = coord.affine_to_homogeneous(idd)
-
-            x_intervals, y_intervals, z_intervals = omega
-            for i in range(x_intervals):
-                for j in range(y_intervals):
-                    for k in range(z_intervals):
-                        vf[i, j, k, 0, 0] = input_h[0, :].dot(idd[i, j, k, 0, :]) - i * input_h[3, :].dot(idd[i, j, k, 0, :])
-                        vf[i, j, k, 0, 1] = input_h[1, :].dot(idd[i, j, k, 0, :]) - j * input_h[3, :].dot(idd[i, j, k, 0, :])
-                        vf[i, j, k, 0, 2] = input_h[2, :].dot(idd[i, j, k, 0, :]) - k * input_h[3, :].dot(idd[i, j, k, 0, :])
-
-            return vf
-
-    elif structure == 'group':
-
-        if d == 2:
-
-            vf = gen_id.id_lagrangian(omega)
-
-            x_intervals, y_intervals = omega
-            for i in range(x_intervals):
-                for j in range(y_intervals):
-
-                    s = input_h.dot(np.array([i, j, 1]))[:]
-                    if abs(s[2]) > 1e-5:
-                        # subtract the id to have the result in displacement coordinates
-                        vf[i, j, 0, 0, :] = (s[0:2] / float(s[2])) - np.array([i, j])
-
-            return vf
-
-        elif d == 3:
-
-            vf = gen_id.id_lagrangian(omega)
-
-            x_intervals, y_intervals, z_intervals = omega
-            for i in range(x_intervals):
-                for j in range(y_intervals):
-                    for k in range(z_intervals):
+    if structure not in ['algebra', 'group']:
+        raise IOError("structure can be only 'algebra' or 'group' corresponding to the algebraic structure.")
 
-                        s = input_h.dot(np.array([i, j, k, 1]))[:]
-                        if abs(s[3]) > 1e-5:
-                            vf[i, j, k, 0, :] = (s[0:3] / float(s[3])) - np.array([i, j, k])
+    points = _homogeneous_grid(omega)
+    s = _matrix_on_grid(points, input_h)
+    numerator, denominator = s[..., :d], s[..., d:]
 
-            return vf
+    if structure == 'algebra':
+        vf = numerator - points[..., :d] * denominator
 
     else:
-        raise IOError("structure can be only 'algebra' or 'group' corresponding to the algebraic structure.")
+        # subtract the id to have the result in displacement coordinates, where the denominator is not too small.
+        mask = np.abs(denominator) > 1e-5
+        vf = np.zeros(numerator.shape)
+        np.divide(numerator, denominator, out=vf, where=mask)
+        np.subtract(vf, points[..., :d], out=vf, where=mask)
+
+    return vf.reshape(v_shape)
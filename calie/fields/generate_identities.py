@@ -22,35 +22,36 @@ def id_lagrangian(omega, t=1):
     return np.zeros(vf_shape)
 
 
-def id_eulerian(omega, t=1):
+def id_eulerian_grid(omega, t=1):
     """
+    Identity in Eulerian coordinates as d read-only views, one per component, with the shape of the vector field
+    without the last axis. Each view is a coordinate broadcast over the other axes (numpy.broadcast_to), so the
+    memory is the size of the axes, not of the field. Meant to be added to, or subtracted from, the components
+    of a field.
     :param omega: discretized domain of the vector field
     :param t: number of timepoints
-    :return: identity vector field of given domain and timepoints, in Eulerian coordinates.
+    :return: list of d read-only arrays, the k-th equal to the k-th coordinate of the grid.
     """
     d = qr.check_omega(omega)
-    omega = list(omega)
-    v_shape = qr.shape_from_omega_and_timepoints(omega, t=t)
-    id_vf = np.zeros(v_shape)
-
-    if d == 2:
-        x = range(v_shape[0])
-        y = range(v_shape[1])
-        gx, gy = np.meshgrid(x, y, indexing='ij')
-
-        id_vf[..., 0, :, 0] = np.repeat(gx, t).reshape(omega + [t])
-        id_vf[..., 0, :, 1] = np.repeat(gy, t).reshape(omega + [t])
+    v_shape = qr.shape_from_omega_and_timepoints(omega, t=t)[:-1]
+    grid = []
+    for k in range(d):
+        axis_shape = [1] * len(v_shape)
+        axis_shape[k] = v_shape[k]
+        grid.append(np.broadcast_to(np.arange(v_shape[k], dtype=np.float64).reshape(axis_shape), v_shape))
+    return grid
 
-    elif d == 3:
-        x = range(v_shape[0])
-        y = range(v_shape[1])
-        z = range(v_shape[2])
-        gx, gy, gz = np.meshgrid(x, y, z, indexing='ij')
-
-        id_vf[..., :, 0] = np.repeat(gx, t).reshape(omega + [t])
-        id_vf[..., :, 1] = np.repeat(gy, t).reshape(omega + [t])
-        id_vf[..., :, 2] = np.repeat(gz, t).reshape(omega + [t])
 
+def id_eulerian(omega, t=1):
+    """
+    :param omega: discretized domain of the vector field
+    :param t: number of timepoints
+    :return: identity vector field of given domain and timepoints, in Eulerian coordinates.
+    """
+    v_shape = qr.shape_from_omega_and_timepoints(omega, t=t)
+    id_vf = np.empty(v_shape)
+    for k, coordinate in enumerate(id_eulerian_grid(omega, t=t)):
+        id_vf[..., k] = coordinate
     return id_vf
 
 
@@ -60,7 +61,7 @@ def id_lagrangian_like(input_vf):
     :return: corresponding identity grid position in Eulerian coordinates
     """
     qr.check_is_vf(input_vf)
-    return np.zeros_like(input_vf)
+    return np.zeros_like(qr.as_array(input_vf))
 
 
 def id_eulerian_like(input_vf):
@@ -73,18 +74,34 @@ def id_eulerian_like(input_vf):
     return id_eulerian(qr.get_omega(input_vf), t=input_vf.shape[3])
 
 
-def id_matrices(omega, t=1):
+def id_eulerian_grid_like(input_vf):
+    """
+    :param input_vf: input vector field.
+    :return: identity in Eulerian coordinates in the grid of input_vf, as read-only views, see id_eulerian_grid.
+    If input_vf is a queries.VectorField the views are computed once and kept in it.
+    """
+    omega = qr.get_omega(input_vf)
+    if isinstance(input_vf, qr.VectorField):
+        return input_vf.identity_grid(lambda: id_eulerian_grid(omega, t=input_vf.shape[3]))
+    return id_eulerian_grid(omega, t=input_vf.shape[3])
+
+
+def id_matrices(omega, t=1, broadcast=False):
     """
     From a omega of dimension dim =2,3, it returns the identity field
     that at each point of the omega has the (row mayor) vectorized identity matrix.
     :param omega: a squared or cubed omega
     :param t: timepoint
+    :param broadcast: if True the result is a read-only view of a single identity matrix (numpy.broadcast_to),
+    with the memory of d ** 2 values, to be used where the identity field is only read (e.g. added to a field).
     :return: vector field with a vectorised identity matrix at each point.
     """
     d = qr.check_omega(omega)
 
     shape = list(omega) + [1] * (4 - d) + [d**2]
     shape[3] = t
+    if broadcast:
+        return np.broadcast_to(np.eye(d).reshape(d**2), shape)
     flat_id = np.eye(d).reshape(1, d**2)
     return np.repeat(flat_id, np.prod(list(omega) + [t])).reshape(shape, order='F')
 
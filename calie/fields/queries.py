@@ -22,6 +22,9 @@ def check_is_vf(input_obj):
     :param input_obj:
     :return: Raise error if input does not satisfy the definition of vector field.
     """
+    # a VectorField container is checked once, at its creation
+    if isinstance(input_obj, VectorField):
+        return input_obj.dimension
     # check if is a numpy.ndarray
     if not isinstance(input_obj, np.ndarray):
         raise IOError('Input numpy array is not a vector field.')
@@ -42,14 +45,114 @@ def check_is_vf(input_obj):
 
 def get_omega(input_vf):
 
-    if check_is_vf(input_vf):
+    if isinstance(input_vf, VectorField):
+        return list(input_vf.omega)
 
-        vf_shape = input_vf.shape
-        if vf_shape[2] == 1:
-            omega = list(vf_shape[:2])
-        else:
-            omega = list(vf_shape[:3])
-        return omega
+    d = check_is_vf(input_vf)
+    return list(input_vf.shape[:d])
+
+
+class VectorField:
+    """
+    Optional container of a vector field, with the metadata checked once and the derived data (identity grid,
+    spline coefficients, jacobian...) computed at the first request and kept until the field is modified.
+    The functions of calie.fields and calie.operations accept it in place of the array: the array is used as is,
+    with no copy, and the cached data are used where available.
+    The field has to be modified through the container (item assignment or new array), or invalidate() has to be
+    called after writing in the array directly.
+    """
+    __slots__ = ('_array', 'dimension', 'omega', 'affine', 'is_lagrangian', '_identity_grid', '_cache')
+
+    def __init__(self, input_vf, affine=np.eye(4), is_lagrangian=True):
+        """
+        :param input_vf: vector field, array of shape shape_from_omega_and_timepoints(omega, t).
+        :param affine: affine transformation of the grid (voxel to world coordinates).
+        :param is_lagrangian: True if the field is in Lagrangian coordinates (displacement), False if in Eulerian
+        coordinates (deformation).
+        """
+        self._array = None
+        self.affine = affine
+        self.is_lagrangian = is_lagrangian
+        self.array = input_vf
+
+    @property
+    def array(self):
+        return self._array
+
+    @array.setter
+    def array(self, input_vf):
+        self.dimension = check_is_vf(input_vf)
+        self.omega = tuple(get_omega(input_vf))
+        if self._array is None or not self._array.shape == input_vf.shape:
+            self._identity_grid = None
+        self._array = input_vf
+        self._cache = {}
+
+    @property
+    def shape(self):
+        return self._array.shape
+
+    @property
+    def spacing(self):
+        """ Size of the voxels, norm of the columns of the affine transformation. """
+        return np.linalg.norm(self.affine[:self.dimension, :self.dimension], axis=0)
+
+    def __getitem__(self, item):
+        return self._array[item]
+
+    def __setitem__(self, item, value):
+        self._array[item] = value
+        self.invalidate()
+
+    def __array__(self, dtype=None):
+        if dtype is None:
+            return self._array
+        return self._array.astype(dtype, copy=False)
+
+    def invalidate(self):
+        """ Forget the data derived from the values of the field, to be called after it is modified. """
+        self._cache = {}
+
+    def identity_grid(self, compute):
+        """
+        Identity in Eulerian coordinates, depending only on the grid and kept as long as the shape does not change.
+        :param compute: function with no arguments computing it, if not available.
+        """
+        if self._identity_grid is None:
+            self._identity_grid = compute()
+        return self._identity_grid
+
+    def cached(self, key, compute):
+        """
+        Data derived from the values of the field, computed at the first request and then stored read only.
+        :param key: hashable identifier of the data, including the parameters of the computation.
+        :param compute: function with no arguments computing the data, an array or a (nested) list of arrays.
+        :return: the stored data.
+        """
+        if key not in self._cache:
+            data = compute()
+            _set_read_only(data)
+            self._cache[key] = data
+        return self._cache[key]
+
+
+def _set_read_only(data):
+    """ Arrays of data, possibly nested in lists. """
+    if isinstance(data, list):
+        for element in data:
+            _set_read_only(element)
+    else:
+        data.flags.writeable = False
+
+
+def as_array(input_vf):
+    """
+    :param input_vf: vector field, as array or as VectorField.
+    :return: the array of the vector field, not copied.
+    """
+    if isinstance(input_vf, VectorField):
+        return input_vf.array
+    return input_vf
 
 
 def shape_from_omega_and_timepoints(omega, t=0):
@@ -59,7 +162,7 @@ def shape_from_omega_and_timepoints(omega, t=0):
     return v_shape
 
 
-def norm(input_vf, passe_partout_size=1, normalized=False):
+def norm(input_vf, passe_partout_size=1, normalized=False, reference_vf=None):
     """
     Returns the L2-norm of the discretised vector field.
     The computation makes sense only with svf.
@@ -84,31 +187,101 @@ def norm(input_vf, passe_partout_size=1, normalized=False):
     :param input_vf: input vector field.
     :param passe_partout_size: size of the passe partout (rectangular mask, with constant offset on each side).
     :param normalized: if the result is divided by the normalization constant.
+    :param reference_vf: optional vector field with the shape of input_vf. If given, the norm of the difference
+    input_vf - reference_vf is returned, without computing the difference of the whole fields.
+    The sum is accumulated slab by slab, see norm_summary.
     """
     d = check_is_vf(input_vf)
-    if passe_partout_size > 0:
-        if d == 2:
-            masked_field = input_vf[passe_partout_size:-passe_partout_size,
-                                    passe_partout_size:-passe_partout_size, ...]
-        else:
-            masked_field = input_vf[passe_partout_size:-passe_partout_size,
-                                    passe_partout_size:-passe_partout_size,
-                                    passe_partout_size:-passe_partout_size, ...]
-    else:
-        masked_field = input_vf
+    omega = get_omega(input_vf)
 
-    if d == 2:
-        num = np.sum(np.sqrt(masked_field[..., 0] ** 2 + masked_field[..., 1] ** 2))
-    else:
-        num = np.sum(np.sqrt(masked_field[..., 0] ** 2 + masked_field[..., 1] ** 2 + masked_field[..., 2] ** 2))
+    num = norm_summary(input_vf, passe_partout_size=passe_partout_size, reference_vf=reference_vf)['sum']
 
     if normalized:
-        den = np.prod(masked_field.shape[:3])
+        den = np.prod([w - 2 * passe_partout_size for w in omega[:d]])
     else:
         den = 1
     return num / float(den)
 
 
+def norm_summary(input_vf, passe_partout_size=0, mask=None, reference_vf=None, percentiles=None, chunk_size=16):
+    """
+    Summary of the pointwise euclidean norm |v(x)| of a vector field, computed in a single pass over slabs along
+    the first spatial axis (of each field, for a batch): only the slab being read and the norms of its points are
+    held in memory, so that the field can be a numpy.memmap (e.g. of a SVFDataset) read from disk once. Each time
+    point counts as a point.
+    :param input_vf: vector field, or batch of vector fields stacked along a leading axis (the summary is over the
+    whole batch).
+    :param passe_partout_size: size of the passe partout, see norm, applied to the spatial axes.
+    :param mask: optional boolean mask with shape omega, only the points in the mask are considered.
+    :param reference_vf: optional field with the shape of input_vf. If given, the norms of the difference
+    input_vf - reference_vf are summarised, computed slab by slab.
+    :param percentiles: optional list of percentiles in [0, 100]. They need the norms of all the points, which are
+    stored in an array of one scalar per point (1 / d of the size of the field).
+    :param chunk_size: thickness of the slabs along the first spatial axis.
+    :return: dictionary with 'sum', 'mean', 'rms' (root mean square) and 'max' of the norms, 'num_points' and,
+    if required, 'percentiles' with the values of the given percentiles.
+    """
+    input_vf = as_array(input_vf)
+    if isinstance(input_vf, np.ndarray) and len(input_vf.shape) == 6:
+        d, offset = check_is_vf(input_vf[0]), 1
+    else:
+        d, offset = check_is_vf(input_vf), 0
+    omega = get_omega(input_vf[0] if offset else input_vf)
+
+    if reference_vf is not None:
+        reference_vf = as_array(reference_vf)
+        if not reference_vf.shape == input_vf.shape:
+            raise IOError('Reference field of shape {} for a field of shape {}.'.format(reference_vf.shape,
+                                                                                       input_vf.shape))
+
+    p = passe_partout_size
+    crop = tuple(slice(p, w - p) for w in omega)
+    if mask is not None:
+        if not mask.shape == tuple(omega):
+            raise IOError('Mask of shape {} for a field with domain {}.'.format(mask.shape, omega))
+        # cropped and with the (singleton) spatial and time axes of the field
+        mask = mask[crop].astype(bool)
+        mask = mask.reshape(mask.shape + (1, ) * (4 - d))
+
+    values = None
+    if percentiles is not None:
+        num_points = input_vf.shape[-2] * (input_vf.shape[0] if offset else 1)
+        num_points *= np.prod([c.stop - c.start for c in crop]) if mask is None else np.count_nonzero(mask)
+        values = np.empty(num_points, dtype=np.float64)
+
+    total, total_of_squares, maximum, num_points = 0.0, 0.0, 0.0, 0
+
+    fields = [(b, ) for b in range(input_vf.shape[0])] if offset else [()]
+    for field in fields:
+        for x0 in range(p, omega[0] - p, chunk_size):
+            x1 = min(x0 + chunk_size, omega[0] - p)
+            index = field + (slice(x0, x1), ) + crop[1:] + (Ellipsis, slice(0, d))
+
+            slab = input_vf[index]
+            if reference_vf is not None:
+                slab = slab - reference_vf[index]
+            slab_norms = np.einsum('...i,...i->...', slab, slab, dtype=np.float64)
+            if mask is not None:
+                slab_norms = slab_norms[np.broadcast_to(mask[x0 - p:x1 - p], slab_norms.shape)]
+
+            if slab_norms.size == 0:
+                continue
+            total_of_squares += np.sum(slab_norms)
+            np.sqrt(slab_norms, out=slab_norms)
+            total += np.sum(slab_norms)
+            maximum = max(maximum, np.max(slab_norms))
+            if values is not None:
+                values[num_points:num_points + slab_norms.size] = slab_norms.ravel()
+            num_points += slab_norms.size
+
+    summary = {'sum': total, 'max': maximum, 'num_points': num_points,
+               'mean': total / num_points if num_points else np.nan,
+               'rms': np.sqrt(total_of_squares / num_points) if num_points else np.nan}
+    if values is not None:
+        summary['percentiles'] = np.percentile(values, percentiles)
+    return summary
+
+
 def nib_to_omega(input_nib_image):
     """
     :param input_nib_image: nibabel image or path to a nifti image.
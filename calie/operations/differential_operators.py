@@ -0,0 +1,174 @@
+import numpy as np
+
+from calie.operations import jacobians as jac
+
+
+class DerivativeCache:
+    """
+    Jacobian of a vector field (or of a batch of vector fields) computed at the first request and shared by the
+    operators of this module: asking for divergence, curl and strain of the same field triggers a single
+    gradient computation.
+    """
+    def __init__(self, input_vf=None, affine=np.eye(4), operator='central', jacobian=None):
+        """
+        :param input_vf: vector field, or batch of vector fields stacked along a leading axis.
+        :param affine: see jacobians.compute_jacobian.
+        :param operator: derivative operator, see jacobians.partial_derivative.
+        :param jacobian: jacobian of the field, if already available. Only the jacobian is needed by the operators,
+        so input_vf can be None when it is given.
+        """
+        if input_vf is None and jacobian is None:
+            raise IOError('DerivativeCache needs a vector field or its jacobian.')
+        self.vf = input_vf
+        self.affine = affine
+        self.operator = operator
+
+        self._jacobian = jacobian
+        self._strain = None
+
+    @property
+    def jacobian(self):
+        if self._jacobian is None:
+            self._jacobian = jac.compute_jacobian(self.vf, affine=self.affine, operator=self.operator)
+        return self._jacobian
+
+    @property
+    def dimension(self):
+        return int(np.round(np.sqrt(self.jacobian.shape[-1])))
+
+    @property
+    def strain(self):
+        """ Symmetric part of the jacobian, (J + J^T) / 2, stored row major as the jacobian. """
+        if self._strain is None:
+            d = self.dimension
+            j = self.jacobian.reshape(self.jacobian.shape[:-1] + (d, d))
+            self._strain = (0.5 * (j + np.swapaxes(j, -1, -2))).reshape(self.jacobian.shape)
+        return self._strain
+
+    def derivative(self, i, j):
+        """
+        :return: derivative of the i-th component of the field along the j-th axis, view of the jacobian.
+        """
+        return self.jacobian[..., i * self.dimension + j]
+
+
+def _as_cache(input_vf, affine, operator):
+    if isinstance(input_vf, DerivativeCache):
+        return input_vf
+    return DerivativeCache(input_vf, affine=affine, operator=operator)
+
+
+def divergence(input_vf, affine=np.eye(4), operator='central'):
+    """
+    Divergence of a vector field, sum_i d_i v_i.
+    :param input_vf: vector field, batch of vector fields or DerivativeCache of the field.
+    :param affine: see jacobians.compute_jacobian. Ignored if input_vf is a DerivativeCache.
+    :param operator: derivative operator. Ignored if input_vf is a DerivativeCache.
+    :return: scalar field, with the shape of the field without the last axis.
+    """
+    cache = _as_cache(input_vf, affine, operator)
+
+    div = np.copy(cache.derivative(0, 0))
+    for i in range(1, cache.dimension):
+        div += cache.derivative(i, i)
+    return div
+
+
+def curl(input_vf, affine=np.eye(4), operator='central'):
+    """
+    Curl of a vector field. In 2d the scalar vorticity d_0 v_1 - d_1 v_0, in 3d the vector field
+    (d_1 v_2 - d_2 v_1, d_2 v_0 - d_0 v_2, d_0 v_1 - d_1 v_0).
+    :param input_vf: vector field, batch of vector fields or DerivativeCache of the field.
+    :param affine: see jacobians.compute_jacobian. Ignored if input_vf is a DerivativeCache.
+    :param operator: derivative operator. Ignored if input_vf is a DerivativeCache.
+    :return: field with the shape of the field and last axis of length 1 in 2d and 3 in 3d.
+    """
+    cache = _as_cache(input_vf, affine, operator)
+    dv = cache.derivative
+
+    if cache.dimension == 2:
+        return (dv(1, 0) - dv(0, 1))[..., np.newaxis]
+    return np.stack([dv(2, 1) - dv(1, 2), dv(0, 2) - dv(2, 0), dv(1, 0) - dv(0, 1)], axis=-1)
+
+
+def strain_tensor(input_vf, affine=np.eye(4), operator='central'):
+    """
+    Infinitesimal strain tensor, symmetric part of the jacobian (J + J^T) / 2.
+    :param input_vf: vector field, batch of vector fields or DerivativeCache of the field.
+    :param affine: see jacobians.compute_jacobian. Ignored if input_vf is a DerivativeCache.
+    :param operator: derivative operator. Ignored if input_vf is a DerivativeCache.
+    :return: tensor field with d ** 2 components in the last axis, row major.
+    """
+    return _as_cache(input_vf, affine, operator).strain
+
+
+def strain_energy(input_vf, mu=1.0, lam=0.0, affine=np.eye(4), operator='central'):
+    """
+    Linear elastic energy density of a vector field, mu tr(e^2) + lam / 2 tr(e)^2, with e the strain tensor.
+    With the default Lame parameters it is the squared Frobenius norm of the strain.
+    :param input_vf: vector field, batch of vector fields or DerivativeCache of the field.
+    :param mu: second Lame parameter (shear modulus).
+    :param lam: first Lame parameter.
+    :param affine: see jacobians.compute_jacobian. Ignored if input_vf is a DerivativeCache.
+    :param operator: derivative operator. Ignored if input_vf is a DerivativeCache.
+    :return: scalar field, with the shape of the field without the last axis.
+    """
+    cache = _as_cache(input_vf, affine, operator)
+
+    energy = np.sum(cache.strain ** 2, axis=-1)
+    energy *= mu
+    if lam != 0:
+        energy += 0.5 * lam * divergence(cache) ** 2
+    return energy
+
+
+differential_quantities = ('divergence', 'curl', 'strain_energy')
+
+
+def differential_summary(input_vf, quantities=differential_quantities, mu=1.0, lam=0.0, affine=np.eye(4),
+                         chunk_size=16, operator='central'):
+    """
+    Summary statistics of divergence, curl magnitude and strain energy density, for quality control and
+    regularisation terms. The jacobian is computed slab by slab along the first axis, once per slab for all the
+    quantities, and the statistics are accumulated without keeping any field of the size of the input.
+    :param input_vf: vector field, or batch of vector fields (the statistics are over the whole batch).
+    :param quantities: subset of differential_quantities.
+    :param mu: see strain_energy.
+    :param lam: see strain_energy.
+    :param affine: see jacobians.compute_jacobian.
+    :param chunk_size: thickness of the slabs.
+    :param operator: derivative operator, see jacobians.partial_derivative.
+    :return: dictionary with a dictionary for each quantity, with 'min', 'max', 'mean', 'sum' and 'norm'
+    (root mean square) of the pointwise values. The magnitude of the curl is used in 3d.
+    """
+    quantities = list(quantities)
+    for q in quantities:
+        if q not in differential_quantities:
+            raise IOError('Quantity {} not in {}.'.format(q, differential_quantities))
+
+    stats = {q: {'min': np.inf, 'max': -np.inf, 'sum': 0.0, 'sum_of_squares': 0.0} for q in quantities}
+    num_voxels = 0
+
+    for _, _, jacobian_slab in jac.iterate_jacobian(input_vf, affine=affine, chunk_size=chunk_size,
+                                                    operator=operator):
+        cache = DerivativeCache(jacobian=jacobian_slab)
+        for q in quantities:
+            if q == 'divergence':
+                values = divergence(cache)
+            elif q == 'curl':
+                values = np.linalg.norm(curl(cache), axis=-1)
+            else:
+                values = strain_energy(cache, mu=mu, lam=lam)
+
+            stats[q]['min'] = min(stats[q]['min'], np.min(values))
+            stats[q]['max'] = max(stats[q]['max'], np.max(values))
+            stats[q]['sum'] += np.sum(values)
+            stats[q]['sum_of_squares'] += np.sum(values ** 2)
+        num_voxels += jacobian_slab[..., 0].size
+
+    summary = {}
+    for q in quantities:
+        summary[q] = {'min': stats[q]['min'], 'max': stats[q]['max'], 'sum': stats[q]['sum'],
+                      'mean': stats[q]['sum'] / num_voxels,
+                      'norm': np.sqrt(stats[q]['sum_of_squares'] / num_voxels)}
+    return summary
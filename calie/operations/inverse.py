@@ -0,0 +1,99 @@
+import numpy as np
+from scipy import ndimage
+
+from calie.operations import jacobians as jac
+from calie.fields import queries as qr
+from calie.fields import compose as cp
+
+
+def invert_displacement(input_disp,
+                        method='fixed_point',
+                        max_iterations=50,
+                        tolerance=1e-4,
+                        warm_start=None,
+                        s_i_o=2,
+                        mode='constant',
+                        return_convergence=False):
+    """
+    Inverse of a displacement field (Lagrangian coordinates), also when it is not the exponential of a known svf
+    (e.g. NiftyReg -def outputs).
+    The inverse w must satisfy w(x) + u(x + w(x)) = 0, that is the residual r = u o w is zero.
+    'fixed_point': w <- w - r = - u(x + w(x))
+    'newton': w <- w - (I + J_u(x + w(x)))^(-1) r, with the Jacobian of u computed once and resampled.
+    Voxels whose residual is below the tolerance are considered converged and are not updated anymore:
+    at each iteration only the voxels still active are resampled.
+    :param input_disp: displacement field in Lagrangian coordinates.
+    :param method: 'fixed_point' or 'newton'.
+    :param max_iterations: maximal number of iterations.
+    :param tolerance: threshold for the norm of the residual at each voxel.
+    :param warm_start: initial guess for the inverse, e.g. the inverse of a previous (close) displacement.
+    If None the initial guess is -input_disp.
+    :param s_i_o: spline interpolation order.
+    :param mode: boundary mode, see compose.displacement_at_coordinates.
+    :param return_convergence: if True the boolean mask of the converged voxels and the number of iterations
+    are returned as well.
+    :return: inverse displacement field in Lagrangian coordinates.
+    """
+    d = qr.check_is_vf(input_disp)
+    omega = qr.get_omega(input_disp)
+    pad = (0, ) * (4 - d)
+    input_disp = qr.as_array(input_disp)
+
+    if method not in ['fixed_point', 'newton']:
+        raise IOError("method can be only 'fixed_point' or 'newton'.")
+
+    if warm_start is None:
+        inverse = -1 * input_disp
+    else:
+        if not warm_start.shape == input_disp.shape:
+            raise IOError('Warm start of shape {} not compatible with input of shape {}.'.format(warm_start.shape,
+                                                                                               input_disp.shape))
+        inverse = np.copy(warm_start)
+
+    if method == 'newton':
+        jacobian_disp = jac.compute_jacobian(input_disp)
+
+    # the spline coefficients of input_disp are computed once, and the active voxels are resampled without
+    # prefilter. Modes padded by scipy before the prefilter are left to it.
+    coefficients, prefilter = input_disp, True
+    if s_i_o > 1 and mode not in ('nearest', 'grid-constant') + cp.extrapolation_modes:
+        coefficients, prefilter = np.empty(input_disp.shape, dtype=np.float64), False
+        for i in range(d):
+            coefficients[..., i] = ndimage.spline_filter(input_disp[..., i].reshape(omega), order=s_i_o,
+                                                         output=np.float64,
+                                                         mode=mode).reshape(input_disp.shape[:-1])
+
+    converged = np.zeros(omega, dtype=bool)
+    idx = np.nonzero(~converged)
+    residual = np.zeros_like(input_disp)
+    iterations = 0
+
+    while iterations < max_iterations and len(idx[0]) > 0:
+        cp.lagrangian_dot_lagrangian_roi(coefficients, inverse, idx, s_i_o=s_i_o, mode=mode, prefilter=prefilter,
+                                         output=residual)
+        r = np.stack([residual[idx + pad + (i, )] for i in range(d)], axis=-1)
+
+        if method == 'fixed_point':
+            step = r
+        else:
+            points = np.array([idx[i] + inverse[idx + pad + (i, )] for i in range(d)])
+            j_at_points = np.stack([ndimage.map_coordinates(jacobian_disp[..., k].reshape(omega, order='F'),
+                                                            points, order=1, mode='nearest')
+                                    for k in range(d ** 2)], axis=-1).reshape(-1, d, d)
+            j_at_points += np.eye(d)
+            step = np.linalg.solve(j_at_points, r[..., np.newaxis])[..., 0]
+
+        for i in range(d):
+            inverse[idx + pad + (i, )] -= step[:, i]
+
+        iterations += 1
+
+        # voxels whose residual (before the update) is below the tolerance leave the active set.
+        just_converged = np.sqrt(np.sum(r ** 2, axis=-1)) < tolerance
+        converged[tuple(c[just_converged] for c in idx)] = True
+        idx = tuple(c[~just_converged] for c in idx)
+
+    if return_convergence:
+        return inverse, converged, iterations
+    else:
+        return inverse
@@ -14,96 +14,553 @@ def initialise_jacobian(input_vf):
     return np.zeros(sh, dtype=np.float64)
 
 
-def compute_jacobian(input_vf, affine=np.eye(4), is_lagrangian=False):
+def _central_difference(f, axis, out):
     """
-    :param input_vf: input vecgor field
-    :param affine: The affine transformation optionally associated to the field.
+    First derivative along the given axis with unit spacing, written into out.
+    Central differences in the interior and one-sided differences at the boundary, as numpy.gradient with
+    edge_order=1. Zero along axis of length 1.
+    :param f: input array.
+    :param axis: axis of the derivative.
+    :param out: output array with the same shape of f.
+    :return: out.
+    """
+    n = f.shape[axis]
+    if n < 2:
+        out[...] = 0
+        return out
+
+    def sl(start, stop):
+        s = [slice(None)] * f.ndim
+        s[axis] = slice(start, stop)
+        return tuple(s)
+
+    np.subtract(f[sl(2, None)], f[sl(None, -2)], out=out[sl(1, -1)])
+    out[sl(1, -1)] *= 0.5
+    np.subtract(f[sl(1, 2)], f[sl(0, 1)], out=out[sl(0, 1)])
+    np.subtract(f[sl(n - 1, None)], f[sl(n - 2, n - 1)], out=out[sl(n - 1, None)])
+    return out
+
+
+def _explicit_stencil_difference(f, axis, out, accuracy):
+    """
+    First derivative along the given axis with unit spacing, with explicit central stencils of order of
+    accuracy 4 or 6 in the interior. Closer to the boundary the order of accuracy is progressively reduced,
+    down to the one-sided difference on the boundary.
+    :param f: input array.
+    :param axis: axis of the derivative.
+    :param out: output array with the same shape of f.
+    :param accuracy: 4 or 6.
+    :return: out.
+    """
+    _central_difference(f, axis, out)
+    n = f.shape[axis]
+
+    def sl(start, stop):
+        s = [slice(None)] * f.ndim
+        s[axis] = slice(start, stop)
+        return tuple(s)
+
+    # radius: coefficients of f[i + k] - f[i - k], k = 1, ..., radius
+    for radius, coefficients in [(2, (8. / 12, -1. / 12)), (3, (45. / 60, -9. / 60, 1. / 60))]:
+        if radius > accuracy // 2 or n <= 2 * radius:
+            break
+        interior = out[sl(radius, n - radius)]
+        interior[...] = 0
+        for k, c in enumerate(coefficients, start=1):
+            interior += c * (f[sl(radius + k, n - radius + k)] - f[sl(radius - k, n - radius - k)])
+    return out
+
+
+def _spectral_difference(f, axis, out):
+    """
+    First derivative along the given axis with unit spacing, computed in the Fourier domain.
+    The field is assumed periodic (or smooth and vanishing at the boundary) along the axis, otherwise
+    the boundary discontinuity produces Gibbs oscillations.
+    :param f: input array.
+    :param axis: axis of the derivative.
+    :param out: output array with the same shape of f.
+    :return: out.
+    """
+    n = f.shape[axis]
+    if n < 2:
+        out[...] = 0
+        return out
+
+    wave_numbers = 2j * np.pi * np.fft.rfftfreq(n)
+    if n % 2 == 0:
+        # the Nyquist mode has no odd part and its derivative is set to zero
+        wave_numbers[-1] = 0
+    shape = [1] * f.ndim
+    shape[axis] = len(wave_numbers)
+
+    out[...] = np.fft.irfft(np.fft.rfft(f, axis=axis) * wave_numbers.reshape(shape), n=n, axis=axis)
+    return out
+
+
+derivative_operators = ('central', 'central_4', 'central_6', 'spectral')
+
+
+def partial_derivative(f, axis, out=None, operator='central'):
+    """
+    First derivative of the array f along the given axis, with unit spacing.
+    :param f: input array.
+    :param axis: axis of the derivative.
+    :param out: optional output array with the same shape of f.
+    :param operator: derivative operator, one of derivative_operators:
+    'central' second order central differences (as numpy.gradient), 'central_4' and 'central_6' explicit
+    central stencils of order 4 and 6, 'spectral' derivative in the Fourier domain (periodic fields).
+    :return: out.
+    """
+    if out is None:
+        out = np.empty(f.shape, dtype=np.float64)
+
+    if operator == 'central':
+        return _central_difference(f, axis, out)
+    elif operator == 'central_4':
+        return _explicit_stencil_difference(f, axis, out, 4)
+    elif operator == 'central_6':
+        return _explicit_stencil_difference(f, axis, out, 6)
+    elif operator == 'spectral':
+        return _spectral_difference(f, axis, out)
+    else:
+        raise IOError('Derivative operator {} not in {}.'.format(operator, derivative_operators))
+
+
+def _halo(operator, n):
+    """
+    :return: number of slices needed on each side of a slab to compute the derivative in the slab.
+    """
+    if operator == 'spectral':
+        return n
+    return {'central': 1, 'central_4': 2, 'central_6': 3}[operator]
+
+
+def _check_is_vf_or_batch(input_vf):
+    """
+    Accepts a vector field or a batch of vector fields with the same shape, stacked along a leading axis
+    (6-dimensional array). Time points are on the fourth axis of each vector field.
+    :return: dimension of the domain and offset of the spatial axes, 0 for a vector field and 1 for a batch.
+    """
+    if isinstance(input_vf, np.ndarray) and len(input_vf.shape) == 6:
+        return qr.check_is_vf(input_vf[0]), 1
+    return qr.check_is_vf(input_vf), 0
+
+
+def _slab_halo(operator, n, offset):
+    """
+    :return: halo of the slabs along the first axis: no halo is needed when the first axis is a batch axis.
+    """
+    return 0 if offset else _halo(operator, n)
+
+
+def _affine_of(input_vf, affine):
+    """
+    :return: the given affine or, if None, the affine of input_vf if it is a queries.VectorField, else the identity.
+    """
+    if affine is not None:
+        return affine
+    if isinstance(input_vf, qr.VectorField):
+        return input_vf.affine
+    return np.eye(4)
+
+
+def compute_jacobian(input_vf, affine=None, is_lagrangian=False, components=None, chunk_size=None,
+                     output=None, operator='central'):
+    """
+    :param input_vf: input vecgor field, with any number of time points, or batch of vector fields stacked
+    along a leading axis. The derivatives are taken along the spatial axes only.
+    :param affine: The affine transformation optionally associated to the field. If None, the affine of input_vf
+    if it is a queries.VectorField, otherwise the identity.
+    Only its linear part (spacing and orientation) is considered: the jacobian with respect to the physical
+    coordinates is the jacobian with respect to the voxel coordinates times the inverse of affine[:d, :d].
     :param is_lagrangian: if the identity matrix should be added to each jacobian matrix
+    :param components: list of the indexes (i * d + j, row major) of the components of the jacobian to be
+    computed, in the order they are stored in the output. If None all the d ** 2 components are computed.
+    :param chunk_size: if not None the jacobian is computed in slabs of this thickness along the first axis
+    (the batch axis for a batch), so that the temporary arrays have the size of a slab.
+    :param output: optional preallocated output (possibly a numpy.memmap) with the shape of the result.
+    :param operator: derivative operator, see partial_derivative.
     See itk documentation:
     http://www.itk.org/Doxygen/html/classitk_1_1DisplacementFieldJacobianDeterminantFilter.html
 
     On the diagonal it possess the sample distances for each dimension.
     Jacobian matrix at each point of the grid is stored in a vector of size 9 in row major order.
+    With the default operator derivatives are central differences, one-sided at the boundary (as numpy.gradient).
+    If input_vf is a queries.VectorField, the whole jacobian is computed once for each set of parameters and kept
+    in it: the array returned is shared by the following calls and read only, to be copied before any in place
+    modification.
     """
-    # TODO It works only for svf (1 time point) - provisional - do with multiple time point
-    d = qr.check_is_vf(input_vf)
-
-    jacobian = initialise_jacobian(input_vf)
+    affine = _affine_of(input_vf, affine)
+    if isinstance(input_vf, qr.VectorField) and components is None and output is None:
+        key = ('jacobian', np.asarray(affine, dtype=np.float64).tobytes(), is_lagrangian, operator)
+        return input_vf.cached(key, lambda: compute_jacobian(input_vf.array, affine=affine,
+                                                             is_lagrangian=is_lagrangian, chunk_size=chunk_size,
+                                                             operator=operator))
+    input_vf = qr.as_array(input_vf)
+    d, offset = _check_is_vf_or_batch(input_vf)
+
+    if operator not in derivative_operators:
+        raise IOError('Derivative operator {} not in {}.'.format(operator, derivative_operators))
+
+    if components is None:
+        components = range(d ** 2)
+    components = list(components)
+    if not all(0 <= k < d ** 2 for k in components):
+        raise IOError('Components {} not in the range of a {}d jacobian.'.format(components, d))
+
+    sh = list(input_vf.shape[:-1]) + [len(components)]
+    if output is None:
+        jacobian = np.zeros(sh, dtype=np.float64)
+    else:
+        if not list(output.shape) == sh:
+            raise IOError('Output of shape {} while expected shape is {}.'.format(output.shape, sh))
+        jacobian = output
+
+    spacing = np.asarray(affine, dtype=np.float64)[:d, :d]
+    is_diagonal = np.count_nonzero(spacing - np.diag(np.diag(spacing))) == 0
+    inv_spacing = np.linalg.inv(spacing)
+
+    # components grouped by row, as (position in the output, column)
+    rows = {}
+    for position, k in enumerate(components):
+        rows.setdefault(k // d, []).append((position, k % d))
+
+    n = input_vf.shape[0]
+    if chunk_size is None:
+        chunk_size = n
+
+    for x0 in range(0, n, chunk_size):
+        x1 = min(x0 + chunk_size, n)
+        # halo on each side for the derivatives along the first axis
+        lo, hi = max(x0 - _slab_halo(operator, n, offset), 0), min(x1 + _slab_halo(operator, n, offset), n)
+        slab = jacobian[x0:x1]
+
+        for i, row in rows.items():
+            f = input_vf[x0:x1, ..., i]
+
+            if is_diagonal:
+                for position, j in row:
+                    if j == 0 and (lo, hi) != (x0, x1):
+                        f_halo = input_vf[lo:hi, ..., i]
+                        derivative_halo = partial_derivative(f_halo, 0, operator=operator)
+                        slab[..., position] = derivative_halo[x0 - lo:x1 - lo]
+                    else:
+                        partial_derivative(f, j + offset, out=slab[..., position], operator=operator)
+                    slab[..., position] *= inv_spacing[j, j]
+            else:
+                f_halo = input_vf[lo:hi, ..., i]
+                grad = np.empty((d, ) + f_halo.shape, dtype=np.float64)
+                for m in range(d):
+                    partial_derivative(f_halo, m + offset, out=grad[m], operator=operator)
+                grad = grad[:, x0 - lo:x1 - lo]
+                for position, j in row:
+                    np.multiply(grad[0], inv_spacing[0, j], out=slab[..., position])
+                    for m in range(1, d):
+                        slab[..., position] += inv_spacing[m, j] * grad[m]
+
+            if is_lagrangian:
+                for position, j in row:
+                    if i == j:
+                        slab[..., position] += 1
 
-    dims = []
+    return jacobian
 
-    for i in range(d):
-        dims.append(affine[i, i])
 
-    output_data = jacobian.squeeze()
+def _determinant_from_jacobian(jacobian, d, out):
+    """
+    Closed form (cofactor expansion) of the determinant of the 2x2 or 3x3 matrices stored row major
+    in the last axis of jacobian.
+    :param jacobian: array with d ** 2 components in the last axis.
+    :param d: dimension.
+    :param out: output with the shape of jacobian without the last axis.
+    :return: out.
+    """
+    j = [jacobian[..., k] for k in range(d ** 2)]
+    if d == 2:
+        np.multiply(j[0], j[3], out=out)
+        out -= j[1] * j[2]
+    else:
+        tmp = np.empty_like(out)
+        np.multiply(j[4], j[8], out=out)
+        out -= j[5] * j[7]
+        out *= j[0]
+        np.multiply(j[3], j[8], out=tmp)
+        tmp -= j[5] * j[6]
+        tmp *= j[1]
+        out -= tmp
+        np.multiply(j[3], j[7], out=tmp)
+        tmp -= j[4] * j[6]
+        tmp *= j[2]
+        out += tmp
+    return out
+
+
+def iterate_jacobian(input_vf, is_lagrangian=False, affine=None, chunk_size=16, operator='central'):
+    """
+    Jacobian computed slab by slab along the first axis, without materialising the jacobian of the whole field.
+    :param input_vf: input vector field, or batch of vector fields, see compute_jacobian.
+    :param is_lagrangian: if the identity matrix should be added to each jacobian matrix.
+    :param affine: see compute_jacobian.
+    :param chunk_size: thickness of the slabs.
+    :param operator: derivative operator, see partial_derivative.
+    :return: generator of (x0, x1, jacobian of the slab input_vf[x0:x1]).
+    """
+    affine = _affine_of(input_vf, affine)
+    input_vf = qr.as_array(input_vf)
+    _, offset = _check_is_vf_or_batch(input_vf)
+    n = input_vf.shape[0]
 
-    for i in range(d):
-        grad = np.gradient(np.squeeze(input_vf[..., i]), *dims)
+    for x0 in range(0, n, chunk_size):
+        x1 = min(x0 + chunk_size, n)
+        lo, hi = max(x0 - _slab_halo(operator, n, offset), 0), min(x1 + _slab_halo(operator, n, offset), n)
+        jacobian_slab = compute_jacobian(input_vf[lo:hi], affine=affine, is_lagrangian=is_lagrangian,
+                                         operator=operator)
+        yield x0, x1, jacobian_slab[x0 - lo:x1 - lo]
 
-        for j in range(d):
-            output_data[..., i * d + j] = grad[j].squeeze()
 
-    if is_lagrangian:
-        jacobian += matrices.id_matrix_field(input_vf.shape[:d])
+def iterate_jacobian_determinant(input_vf, is_lagrangian=False, affine=None, chunk_size=16,
+                                 operator='central'):
+    """
+    Jacobian determinant computed slab by slab along the first axis, without materialising the jacobian
+    (nor the determinant) of the whole field.
+    :param input_vf: input vector field, or batch of vector fields, see compute_jacobian.
+    :param is_lagrangian: add the identity to the jacobian matrix before the computation of the determinant.
+    :param affine: see compute_jacobian.
+    :param chunk_size: thickness of the slabs.
+    :param operator: derivative operator, see partial_derivative.
+    :return: generator of (x0, x1, determinant of the slab input_vf[x0:x1]).
+    """
+    d, _ = _check_is_vf_or_batch(input_vf)
 
-    return jacobian
+    for x0, x1, jacobian_slab in iterate_jacobian(input_vf, is_lagrangian=is_lagrangian, affine=affine,
+                                                  chunk_size=chunk_size, operator=operator):
+        yield x0, x1, _determinant_from_jacobian(jacobian_slab, d, np.empty(jacobian_slab.shape[:-1]))
 
 
-def compute_jacobian_determinant(input_vf, is_lagrangian=False):
+def compute_jacobian_determinant(input_vf, is_lagrangian=False, affine=None, chunk_size=16, output=None,
+                                 operator='central'):
     """
-    :param input_vf: The Field or children whose jacobian we need to compute.
+    :param input_vf: The Field or children whose jacobian we need to compute, or batch of vector fields
+    stacked along a leading axis.
     :param is_lagrangian: add the identity to the jacobian matrix before the computation of the
     jacobian determinant.
+    :param affine: see compute_jacobian.
+    :param chunk_size: thickness of the slabs along the first axis in which the determinant is computed, so that
+    the jacobian is never stored for the whole field. If None the whole field is a single slab.
+    :param output: optional preallocated output (possibly a numpy.memmap) with shape input_vf.shape[:-1].
+    :param operator: derivative operator, see partial_derivative.
     If it is none, it is allocated.
     Jacobian matrix at each point of the grid is stored in a vector of size 9 in row major order.
-    !! It works only for 1 time point - provisional !!
+    The determinant is the cofactor expansion of the finite differences.
     """
-    d = qr.check_is_vf(input_vf)
+    affine = _affine_of(input_vf, affine)
+    input_vf = qr.as_array(input_vf)
+    if output is None:
+        output = np.empty(input_vf.shape[:-1], dtype=np.float64)
+    elif not output.shape == input_vf.shape[:-1]:
+        raise IOError('Output of shape {} while expected shape is {}.'.format(output.shape, input_vf.shape[:-1]))
 
-    vf_jacobian = compute_jacobian(input_vf, is_lagrangian=is_lagrangian)
+    if chunk_size is None:
+        chunk_size = input_vf.shape[0]
+
+    for x0, x1, det_slab in iterate_jacobian_determinant(input_vf, is_lagrangian=is_lagrangian, affine=affine,
+                                                         chunk_size=chunk_size, operator=operator):
+        output[x0:x1] = det_slab
+
+    return output
 
-    sh = list(input_vf.shape)
-    while len(sh) < 5:
-        sh.extend([1])
-    sh = sh[:-1]
 
-    sh.extend([d, d])
+def jacobian_determinant_summary(input_vf, is_lagrangian=False, affine=None, chunk_size=16,
+                                 bins=np.linspace(-1, 3, 41), operator='central'):
+    """
+    Summary statistics of the jacobian determinant for quality control, computed slab by slab without
+    keeping the determinant of the whole field in memory.
+    :param input_vf: input vector field, or batch of vector fields (the statistics are over the whole batch).
+    :param is_lagrangian: add the identity to the jacobian matrix before the computation of the determinant.
+    Set to True when input_vf is a displacement field.
+    :param affine: see compute_jacobian.
+    :param chunk_size: thickness of the slabs.
+    :param bins: edges of the bins of the histogram. Values outside the edges are not counted in the histogram.
+    :param operator: derivative operator, see partial_derivative.
+    :return: dictionary with 'min', 'max', 'mean', 'folds' (number of voxels with non positive determinant)
+    and 'histogram' (counts, bins).
+    """
+    counts = np.zeros(len(bins) - 1, dtype=np.int64)
+    minimum, maximum, total, folds, num_voxels = np.inf, -np.inf, 0.0, 0, 0
+
+    for _, _, det_slab in iterate_jacobian_determinant(input_vf, is_lagrangian=is_lagrangian, affine=affine,
+                                                      chunk_size=chunk_size, operator=operator):
+        minimum = min(minimum, np.min(det_slab))
+        maximum = max(maximum, np.max(det_slab))
+        total += np.sum(det_slab)
+        folds += np.count_nonzero(det_slab <= 0)
+        num_voxels += det_slab.size
+        counts += np.histogram(det_slab, bins=bins)[0]
 
-    v = vf_jacobian.reshape(sh)
-    return np.linalg.det(v)
+    return {'min': minimum, 'max': maximum, 'mean': total / num_voxels, 'folds': folds,
+            'histogram': (counts, bins)}
 
 
-def jacobian_product(vf_left, vf_right):
+def jacobian_vector_product(input_vf, direction_vf, operator='central', chunk_size=None, output=None):
+    """
+    Directional derivative J_v w of the vector field v along the vector field w, (J_v w)_i = sum_j w_j d_j v_i,
+    computed without storing the jacobian: one derivative of all the components of v per direction j,
+    accumulated in the output. The temporary memory is one field (or slab) instead of d fields.
+    :param input_vf: vector field v, or batch of vector fields stacked along a leading axis.
+    :param direction_vf: vector field w, with the same shape of v. Should not share memory with output.
+    :param operator: derivative operator, see partial_derivative.
+    :param chunk_size: if not None the product is computed in slabs of this thickness along the first axis.
+    :param output: optional preallocated output with the shape of input_vf.
+    :return: J_v w, vector field with the shape of input_vf.
+    """
+    input_vf, direction_vf = qr.as_array(input_vf), qr.as_array(direction_vf)
+    d, offset = _check_is_vf_or_batch(input_vf)
+    if not input_vf.shape == direction_vf.shape:
+        raise IOError('Vector field of shape {} can not be derived along a direction of shape {}.'.format(
+            input_vf.shape, direction_vf.shape))
+    if operator not in derivative_operators:
+        raise IOError('Derivative operator {} not in {}.'.format(operator, derivative_operators))
+    if output is None:
+        output = np.empty(input_vf.shape, dtype=np.float64)
+
+    n = input_vf.shape[0]
+    if chunk_size is None:
+        chunk_size = n
+
+    for x0 in range(0, n, chunk_size):
+        x1 = min(x0 + chunk_size, n)
+        lo, hi = max(x0 - _slab_halo(operator, n, offset), 0), min(x1 + _slab_halo(operator, n, offset), n)
+        slab = output[x0:x1]
+        derivative = np.empty(slab.shape, dtype=np.float64)
+
+        for j in range(d):
+            if j == 0 and (lo, hi) != (x0, x1):
+                derivative[...] = partial_derivative(input_vf[lo:hi], 0, operator=operator)[x0 - lo:x1 - lo]
+            else:
+                partial_derivative(input_vf[x0:x1], j + offset, out=derivative, operator=operator)
+            derivative *= direction_vf[x0:x1, ..., j:j + 1]
+            if j == 0:
+                slab[...] = derivative
+            else:
+                slab += derivative
+
+    return output
+
+
+def jacobian_product(vf_left, vf_right, operator='central'):
     """
     Compute the jacobian product between two 2d or 3d SVF self and right: J_{self}(right)
     the results is a second SVF.
     :param vf_left : svf
     :param vf_right: svf
+    :param operator: derivative operator, see partial_derivative.
     :return: J_{right}(left) : jacobian product between 2 svfs
     """
-    left  = np.copy(vf_left)
-    right = np.copy(vf_right)
-
-    result_array = matrices.matrix_vector_field_product(compute_jacobian(right), left)
+    return jacobian_vector_product(vf_right, vf_left, operator=operator)
 
-    return result_array
 
-
-def iterative_jacobian_product(vf, n):
+def iterative_jacobian_product(vf, n, operator='central', jacobian=None):
     """
-    :param vf: input SVF
+    :param vf: input SVF, or batch of SVF stacked along a leading axis.
     :param n: number of iterations
+    :param operator: derivative operator, see partial_derivative.
+    :param jacobian: jacobian of vf, if already available (e.g. when called for several n).
     :return: a new SVF defined by the jacobian product J_v^(n-1) v
     """
-    jv_field = compute_jacobian(vf)[...]
-    v_field = vf[...]
+    d, _ = _check_is_vf_or_batch(vf)
+    if jacobian is None:
+        jacobian = compute_jacobian(vf, operator=operator)
+    vf = qr.as_array(vf)
 
-    jv_n_prod_v = matrices.matrix_vector_field_product(matrices.matrix_fields_product_iterative(jv_field, n-1), v_field)
+    jv_n = matrices.matrix_fields_power(jacobian, n - 1)
+    jv_n_prod_v = np.einsum('...kl,...l->...k', jv_n.reshape(jv_n.shape[:-1] + (d, d)), vf)
 
     return jv_n_prod_v
 
 
-def lie_bracket(vf_left, vf_right):
+def fused_lie_bracket(vf_left, vf_right, jacobian_left=None, jacobian_right=None, operator='central',
+                      chunk_size=None, output=None):
+    """
+    Lie bracket of two velocity fields [left, right] = Jac(left) * right - Jac(right) * left.
+    The jacobians given in input are used for the products, the ones not given are never stored: the
+    products are computed with jacobian_vector_product. The inputs are never copied and the two
+    jacobian-vector products are evaluated slab by slab along the first axis.
+    :param vf_left: left velocity field, or batch of velocity fields stacked along a leading axis.
+    :param vf_right: right velocity field, with the same shape of vf_left.
+    :param jacobian_left: jacobian of vf_left, if already available.
+    :param jacobian_right: jacobian of vf_right, if already available.
+    :param operator: derivative operator, see partial_derivative.
+    :param chunk_size: if not None the bracket is computed in slabs of this thickness along the first axis.
+    :param output: optional preallocated output with the shape of vf_left.
+    :return: the Lie bracket, velocity field with the shape of vf_left.
+    """
+    vf_left, vf_right = qr.as_array(vf_left), qr.as_array(vf_right)
+    d, offset = _check_is_vf_or_batch(vf_left)
+    if not vf_left.shape == vf_right.shape:
+        raise IOError('Velocity fields of shape {} and {} can not be bracketed.'.format(vf_left.shape,
+                                                                                      vf_right.shape))
+    if output is None:
+        output = np.empty(vf_left.shape, dtype=np.float64)
+
+    n = vf_left.shape[0]
+    if chunk_size is None:
+        chunk_size = n
+
+    def product_slab(vf, jacobian, direction, x0, x1):
+        if jacobian is None:
+            lo, hi = max(x0 - _slab_halo(operator, n, offset), 0), min(x1 + _slab_halo(operator, n, offset), n)
+            return jacobian_vector_product(vf[lo:hi], direction[lo:hi], operator=operator)[x0 - lo:x1 - lo]
+        jacobian = jacobian[x0:x1]
+        return np.einsum('...kl,...l->...k', jacobian.reshape(jacobian.shape[:-1] + (d, d)), direction[x0:x1])
+
+    for x0 in range(0, n, chunk_size):
+        x1 = min(x0 + chunk_size, n)
+        slab = output[x0:x1]
+        slab[...] = product_slab(vf_left, jacobian_left, vf_right, x0, x1)
+        slab -= product_slab(vf_right, jacobian_right, vf_left, x0, x1)
+
+    return output
+
+
+def bch_lie_brackets(vf_left, vf_right, depth=2, jacobian_left=None, jacobian_right=None, operator='central'):
+    """
+    Nested Lie brackets of two velocity fields u = vf_left, v = vf_right appearing in the BCH formula
+    log(exp(u)exp(v)) = u + v + 1/2 [u,v] + 1/12 ([u,[u,v]] - [v,[u,v]]) - 1/24 [v,[u,[u,v]]] + ...
+    with the convention of fused_lie_bracket. The jacobians of u and v are computed once, and the jacobian
+    of each nested bracket is computed once and reused by all the brackets of the following level.
+    :param vf_left: left velocity field u.
+    :param vf_right: right velocity field v.
+    :param depth: 1 for [u,v], 2 adds [u,[u,v]] and [v,[u,v]], 3 adds [v,[u,[u,v]]].
+    :param jacobian_left: jacobian of vf_left, if already available.
+    :param jacobian_right: jacobian of vf_right, if already available.
+    :param operator: derivative operator, see partial_derivative.
+    :return: dictionary with keys 'uv', 'uuv', 'vuv', 'vuuv' (up to the given depth) and the
+    corresponding brackets.
+    """
+    if depth not in [1, 2, 3]:
+        raise IOError('Depth of the nested brackets can be 1, 2 or 3.')
+
+    if jacobian_left is None:
+        jacobian_left = compute_jacobian(vf_left, operator=operator)
+    if jacobian_right is None:
+        jacobian_right = compute_jacobian(vf_right, operator=operator)
+
+    brackets = {'uv': fused_lie_bracket(vf_left, vf_right, jacobian_left=jacobian_left,
+                                        jacobian_right=jacobian_right)}
+    if depth > 1:
+        jacobian_uv = compute_jacobian(brackets['uv'], operator=operator)
+        brackets['uuv'] = fused_lie_bracket(vf_left, brackets['uv'], jacobian_left=jacobian_left,
+                                            jacobian_right=jacobian_uv)
+        brackets['vuv'] = fused_lie_bracket(vf_right, brackets['uv'], jacobian_left=jacobian_right,
+                                            jacobian_right=jacobian_uv)
+    if depth > 2:
+        brackets['vuuv'] = fused_lie_bracket(vf_right, brackets['uuv'], jacobian_left=jacobian_right,
+                                             operator=operator)
+
+    return brackets
+
+
+def lie_bracket(vf_left, vf_right, operator='central'):
     """
     Compute the Lie bracket of two velocity fields.
 
@@ -111,8 +568,8 @@ def lie_bracket(vf_left, vf_right):
     -----------
     :param vf_left: Left velocity field.
     :param vf_right: Right velocity field.
-    Order of Lie bracket: [left,right] = Jac(left)*right - Jac(right)*left
+    :param operator: derivative operator, see partial_derivative.
+    Order of Lie bracket: [left,right] = Jac(right)*left - Jac(left)*right, i.e. fused_lie_bracket(right, left).
     :return Return the resulting velocity field
     """
-
-    return jacobian_product(vf_left, vf_right) - jacobian_product(vf_right, vf_left)
+    return fused_lie_bracket(vf_right, vf_left, operator=operator)
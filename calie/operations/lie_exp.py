@@ -2,6 +2,7 @@ import copy
 
 import numpy as np
 from scipy import integrate
+from scipy import ndimage
 from scipy.linalg import expm
 from scipy.misc import factorial as fact
 
@@ -14,6 +15,8 @@ from calie.fields import compose as cp
 class LieExp:
     def __init__(self):
         self.s_i_o = 3
+        # derivative operator for the jacobians, see jacobians.partial_derivative
+        self.derivative_operator = 'central'
 
         self.dimension = None
         self.omega = None
@@ -23,11 +26,14 @@ class LieExp:
         self.num_steps = None
 
     def initialise_input(self, input_vf):
-        """ Initialise class variable given an input vf """
+        """
+        Initialise class variable given an input vf, array or queries.VectorField.
+        The input is not copied: the methods never modify self.vf in place.
+        """
         self.dimension = qr.check_is_vf(input_vf)
         self.omega = qr.get_omega(input_vf)
 
-        self.vf = copy.deepcopy(input_vf)
+        self.vf = qr.as_array(input_vf)
         self.phi = np.zeros_like(self.vf)
 
     def initialise_number_of_steps(self, input_num_steps=None, input_pix_dims=None):
@@ -76,8 +82,65 @@ class LieExp:
         self.phi = self.vf / float(init)
 
         # (2)
+        eulerian_buffer = np.empty_like(self.phi)
         for _ in range(0, self.num_steps):
-            self.phi = cp.lagrangian_dot_lagrangian(self.phi, self.phi, s_i_o=self.s_i_o)
+            self.phi = cp.lagrangian_dot_lagrangian(self.phi, self.phi, s_i_o=self.s_i_o,
+                                                    eulerian_buffer=eulerian_buffer)
+
+        return self.phi
+
+    def scaling_and_squaring_roi(self, input_vf, roi_mask, margin=None, input_num_steps=None, input_pix_dims=None):
+        """
+        Scaling and squaring computed only in a region of interest.
+        The region is dilated by a margin covering the displacements, so that the values sampled by each squaring
+        are available. Only the bounding box of the dilated region is stored, and only its voxels are resampled.
+        :param input_vf: input svf.
+        :param roi_mask: boolean mask with shape omega.
+        The spline coefficients of each squared field are computed once on the bounding box, and sampled without
+        further prefiltering.
+        :param margin: dilation margin in voxels. If None, compose.roi_margin of the input field over the number
+        of squaring steps is used, covering the displacements and the spline supports accumulated by the steps,
+        and the prefilter halo.
+        :return: exponential of the svf in the region of interest, zero outside.
+        """
+        # (0)
+        self.initialise_input(input_vf)
+        self.initialise_number_of_steps(input_num_steps=input_num_steps, input_pix_dims=input_pix_dims)
+
+        if margin is None:
+            margin = cp.roi_margin(self.vf, s_i_o=self.s_i_o, num_steps=self.num_steps)
+
+        roi_mask = np.asarray(roi_mask, dtype=bool).reshape(self.omega)
+        dilated_roi = cp.dilate_roi(roi_mask, margin)
+        if not np.any(dilated_roi):
+            return self.phi
+
+        # bounding box of the dilated roi:
+        box = tuple(slice(np.min(c), np.max(c) + 1) for c in np.nonzero(dilated_roi))
+        box_vf = box + (slice(None), ) * (5 - self.dimension)
+        idx = np.nonzero(dilated_roi[box])
+
+        # (1)
+        init = 1 << self.num_steps
+        phi_box = self.vf[box_vf] / float(init)
+
+        # (2) voxels out of the dilated roi are never written, so the two buffers can be swapped.
+        phi_box_next = np.copy(phi_box)
+        coefficients = np.empty_like(phi_box)
+        box_omega = phi_box.shape[:self.dimension]
+        for _ in range(0, self.num_steps):
+            left = phi_box
+            if self.s_i_o > 1:
+                for i in range(self.dimension):
+                    coefficients[..., i] = ndimage.spline_filter(phi_box[..., i].reshape(box_omega), self.s_i_o,
+                                                                 mode='constant').reshape(phi_box.shape[:-1])
+                left = coefficients
+            cp.lagrangian_dot_lagrangian_roi(left, phi_box, idx, s_i_o=self.s_i_o, prefilter=False,
+                                             output=phi_box_next)
+            phi_box, phi_box_next = phi_box_next, phi_box
+
+        self.phi[box_vf] = phi_box
+        self.phi[~roi_mask] = 0
 
         return self.phi
 
@@ -92,7 +155,7 @@ class LieExp:
         self.phi = self.vf / init
 
         # (1.5)
-        jv = jac.compute_jacobian(self.phi)
+        jv = jac.compute_jacobian(self.phi, operator=self.derivative_operator)
 
         if self.dimension == 2:
 
@@ -141,7 +204,7 @@ class LieExp:
         self.phi = self.vf / init
 
         # (1.5)
-        jv = jac.compute_jacobian(self.phi)
+        jv = jac.compute_jacobian(self.phi, operator=self.derivative_operator)
 
         if self.dimension == 2:
 
@@ -176,16 +239,13 @@ class LieExp:
 
         # (1)
         if self.num_steps == 0:
-            self.phi = self.vf
+            self.phi = np.copy(self.vf)
         else:
             init = 1 << self.num_steps
             self.phi = self.vf / init
 
         # (1.5)  phi = 1 + v + 0.5jac*v
-        jv = np.squeeze(jac.compute_jacobian(self.phi))
-        v_sq = np.squeeze(self.phi)
-        new_shape = list(self.omega) + [1] * (4 - self.dimension) + [self.dimension]
-        jv_prod_v = matrices.matrix_vector_field_product(jv, v_sq).reshape(new_shape)
+        jv_prod_v = jac.jacobian_vector_product(self.phi, self.phi, operator=self.derivative_operator)
 
         self.phi += 0.5 * jv_prod_v
 
@@ -220,8 +280,13 @@ class LieExp:
 
         self.phi = np.copy(self.vf)  # phi is initialised to vf not to zero.
 
+        jv = jac.compute_jacobian(self.vf, operator=self.derivative_operator)
+
+        # the power J_v^(k-1) is updated with one product per term.
+        power = None
         for k in range(2, self.num_steps):
-            jac_v = jac.iterative_jacobian_product(self.vf, k)
+            power = jv if power is None else matrices.matrix_fields_product(power, jv)
+            jac_v = matrices.matrix_vector_field_product(power, self.vf)
             self.phi = self.phi[...] + jac_v[...] / fact(k)
 
         return self.phi
@@ -235,8 +300,10 @@ class LieExp:
         jac_v = copy.deepcopy(self.vf)
         self.phi = np.copy(self.vf)  # phi is initialised to vf not to zero.
 
+        jv = jac.compute_jacobian(self.vf, operator=self.derivative_operator)
+
         for k in range(1, input_num_steps):
-            jac_v = jac.jacobian_product(jac_v, self.vf)
+            jac_v = matrices.matrix_vector_field_product(jv, jac_v)
             self.phi = self.phi[...] + jac_v[...] / fact(k)
 
         return self.phi
@@ -265,10 +332,7 @@ class LieExp:
 
         self.vf = self.vf / self.num_steps
 
-        jv = np.squeeze(jac.compute_jacobian(self.vf))
-        v_sq = np.squeeze(self.vf)
-        new_shape = list(self.omega) + [1] * (4 - self.dimension) + [self.dimension]
-        jv_prod_v = matrices.matrix_vector_field_product(jv, v_sq).reshape(new_shape)
+        jv_prod_v = jac.jacobian_vector_product(self.vf, self.vf, operator=self.derivative_operator)
 
         self.vf += 0.5 * jv_prod_v
 
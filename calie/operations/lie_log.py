@@ -1,5 +1,233 @@
+import numpy as np
 
+from calie.operations import jacobians as jac
+from calie.operations import lie_exp
+from calie.fields import queries as qr
+from calie.fields import compose as cp
 
-def lie_logarithm():
-    # TODO
-    pass
\ No newline at end of file
+
+def displacement_square_root(input_disp,
+                             max_iterations=20,
+                             tolerance=1e-3,
+                             warm_start=None,
+                             s_i_o=2,
+                             mode='nearest',
+                             output=None,
+                             return_convergence=False):
+    """
+    Square root of a deformation given as displacement field (Lagrangian coordinates): the displacement w such that
+    (id + w) o (id + w) = id + u, that is w + w o (id + w) = u.
+    Fixed point iteration w <- w + 1/2 (u - w - w o (id + w)), whose contraction factor is 1/2 for small fields.
+    Voxels whose residual is below the tolerance are considered converged and are not updated anymore:
+    at each iteration only the voxels still active are resampled.
+    :param input_disp: displacement field u in Lagrangian coordinates.
+    :param max_iterations: maximal number of iterations.
+    :param tolerance: threshold for the norm of the residual at each voxel.
+    :param warm_start: initial guess for the square root. If None the initial guess is input_disp / 2.
+    :param s_i_o: spline interpolation order.
+    :param mode: boundary mode, see compose.displacement_at_coordinates.
+    :param output: optional preallocated array with the shape of the input, where the square root is computed.
+    :param return_convergence: if True the boolean mask of the converged voxels and the number of iterations
+    are returned as well.
+    :return: square root displacement field in Lagrangian coordinates.
+    """
+    d = qr.check_is_vf(input_disp)
+    omega = qr.get_omega(input_disp)
+    pad = (0, ) * (4 - d)
+    input_disp = qr.as_array(input_disp)
+
+    if output is None:
+        output = np.empty_like(input_disp, dtype=np.float64)
+    if warm_start is None:
+        np.multiply(input_disp, 0.5, out=output)
+    else:
+        if not warm_start.shape == input_disp.shape:
+            raise IOError('Warm start of shape {} not compatible with input of shape {}.'.format(warm_start.shape,
+                                                                                               input_disp.shape))
+        output[...] = warm_start
+
+    converged = np.zeros(omega, dtype=bool)
+    idx = np.nonzero(~converged)
+    composition = np.zeros_like(output)
+    iterations = 0
+
+    while iterations < max_iterations and len(idx[0]) > 0:
+        cp.lagrangian_dot_lagrangian_roi(output, output, idx, s_i_o=s_i_o, mode=mode, output=composition)
+        r = np.stack([input_disp[idx + pad + (i, )] - composition[idx + pad + (i, )] for i in range(d)], axis=-1)
+
+        for i in range(d):
+            output[idx + pad + (i, )] += 0.5 * r[:, i]
+
+        iterations += 1
+
+        just_converged = np.sqrt(np.sum(r ** 2, axis=-1)) < tolerance
+        converged[tuple(c[just_converged] for c in idx)] = True
+        idx = tuple(c[~just_converged] for c in idx)
+
+    if return_convergence:
+        return output, converged, iterations
+    else:
+        return output
+
+
+def inverse_scaling_and_squaring(input_disp,
+                                 num_steps=None,
+                                 max_iterations=20,
+                                 tolerance=1e-3,
+                                 warm_start=None,
+                                 s_i_o=2,
+                                 mode='nearest',
+                                 return_convergence=False):
+    """
+    Lie logarithm by inverse scaling and squaring (Arsigny 2006, Bossa 2007): the square root of the deformation is
+    taken num_steps times, then the logarithm of the resulting small deformation id + w is approximated at the
+    second order as w - 1/2 J_w w and multiplied by 2^num_steps.
+    Only two buffers of the size of the input are used for the chain of square roots.
+    :param input_disp: displacement field in Lagrangian coordinates.
+    :param num_steps: number of square roots. If None it is chosen so that the last root has norm below 0.5.
+    :param max_iterations: maximal number of iterations of each square root.
+    :param tolerance: tolerance of each square root, see displacement_square_root.
+    :param warm_start: initial guess v for the logarithm (e.g. the logarithm of a close deformation), used to
+    initialise the first square root with exp(v / 2), computed by scaling and squaring. The following roots are
+    initialised with the second order square root of the previous one.
+    :param s_i_o: spline interpolation order.
+    :param mode: boundary mode, see compose.displacement_at_coordinates.
+    :param return_convergence: if True a boolean (all the square roots converged everywhere) and the total number
+    of iterations are returned as well.
+    :return: stationary velocity field, logarithm of the input deformation.
+    """
+    qr.check_is_vf(input_disp)
+    input_disp = qr.as_array(input_disp)
+
+    if num_steps is None:
+        max_norm = np.max(np.linalg.norm(input_disp, axis=-1))
+        num_steps = max([0, np.ceil(np.log2(max_norm / 0.5)).astype('int')]) + 2 if max_norm > 0 else 0
+
+    buffers = [np.empty_like(input_disp, dtype=np.float64), np.empty_like(input_disp, dtype=np.float64)]
+    root = input_disp
+    all_converged, total_iterations = True, 0
+
+    # initial guess of the first root exp(warm_start / 2), by num_steps - 1 squarings of the second order
+    # expansion of exp(warm_start / 2^num_steps). The guesses of the following roots are the second order square
+    # roots u / 2 - 1/8 J_u u of the previous root u, so that the cost is linear in num_steps.
+    guess = None
+    if warm_start is not None and num_steps > 0:
+        scaled = warm_start / float(1 << num_steps)
+        guess = scaled + 0.5 * jac.jacobian_product(scaled, scaled)
+        for _ in range(num_steps - 1):
+            guess = cp.lagrangian_dot_lagrangian(guess, guess, s_i_o=s_i_o, mode=mode)
+
+    for k in range(1, num_steps + 1):
+        if warm_start is not None and k > 1:
+            guess = 0.5 * root - 0.125 * jac.jacobian_product(root, root)
+        root, converged, iterations = displacement_square_root(root, max_iterations=max_iterations,
+                                                               tolerance=tolerance, warm_start=guess, s_i_o=s_i_o,
+                                                               mode=mode, output=buffers[k % 2],
+                                                               return_convergence=True)
+        all_converged = all_converged and bool(np.all(converged))
+        total_iterations += iterations
+
+    log = root - 0.5 * jac.jacobian_product(root, root)
+    log *= float(1 << num_steps)
+
+    if return_convergence:
+        return log, all_converged, total_iterations
+    else:
+        return log
+
+
+def iterative_bch(input_disp,
+                  max_iterations=10,
+                  tolerance=1e-3,
+                  warm_start=None,
+                  s_i_o=2,
+                  exp_num_steps=None,
+                  mode='nearest',
+                  band=None,
+                  return_convergence=False):
+    """
+    Lie logarithm by iterative BCH (Bossa 2007, Vercauteren 2008): with v the current estimate, the residual
+    deformation exp(-v) o (id + u) = exp(delta) is approximated at the first order as delta = its displacement,
+    and the estimate is updated with the first terms of the BCH formula v <- v + delta + 1/2 [v, delta].
+    The residual is not reliable where the composition samples outside the domain, so it is set to zero on a
+    boundary band, where the estimate is left to the initial guess.
+    The iterations stop when the maximal norm of the residual is below the tolerance, or when it stops
+    decreasing (the accuracy of the numerical exponential is reached), returning the best estimate.
+    :param input_disp: displacement field in Lagrangian coordinates.
+    :param max_iterations: maximal number of iterations.
+    :param tolerance: threshold on the maximal norm of the residual displacement delta.
+    :param warm_start: initial guess for the logarithm. If None the initial guess is u - 1/2 J_u u.
+    :param s_i_o: spline interpolation order.
+    :param exp_num_steps: number of steps of the scaling and squaring used for exp(-v). None is automatic.
+    :param mode: boundary mode of the composition, see compose.displacement_at_coordinates.
+    :param band: width of the boundary band where the residual is set to zero.
+    If None it is compose.roi_margin(input_disp, s_i_o, prefilter=False).
+    :param return_convergence: if True a boolean (tolerance reached) and the number of iterations
+    are returned as well.
+    :return: stationary velocity field, logarithm of the input deformation.
+    """
+    qr.check_is_vf(input_disp)
+    omega = qr.get_omega(input_disp)
+    input_disp = qr.as_array(input_disp)
+
+    if warm_start is None:
+        log = input_disp - 0.5 * jac.jacobian_product(input_disp, input_disp)
+    else:
+        if not warm_start.shape == input_disp.shape:
+            raise IOError('Warm start of shape {} not compatible with input of shape {}.'.format(warm_start.shape,
+                                                                                               input_disp.shape))
+        log = np.copy(warm_start).astype(np.float64)
+
+    if band is None:
+        band = cp.roi_margin(input_disp, s_i_o=s_i_o, prefilter=False)
+    band = cp.boundary_band(omega, band) if band > 0 else np.zeros(omega, dtype=bool)
+
+    l_exp = lie_exp.LieExp()
+    l_exp.s_i_o = s_i_o
+    bracket = np.empty_like(log)
+    previous_log = np.empty_like(log)
+    best_residual = np.inf
+    converged, iterations = False, 0
+
+    while iterations < max_iterations:
+        exp_minus_log = l_exp.scaling_and_squaring(-1 * log, input_num_steps=exp_num_steps)
+        delta = cp.lagrangian_dot_lagrangian(exp_minus_log, input_disp, s_i_o=s_i_o, mode=mode)
+        delta[band] = 0
+
+        residual = np.max(np.linalg.norm(delta, axis=-1))
+        if residual >= best_residual:
+            # the last update did not improve the estimate.
+            log[...] = previous_log
+            break
+        best_residual = residual
+        if residual < tolerance:
+            converged = True
+            break
+
+        previous_log[...] = log
+        jac.fused_lie_bracket(log, delta, output=bracket)
+        log += delta
+        log += 0.5 * bracket
+        iterations += 1
+
+    if return_convergence:
+        return log, converged, iterations
+    else:
+        return log
+
+
+def lie_logarithm(input_disp, method='iss', **kwargs):
+    """
+    Lie logarithm of a deformation given as displacement field, e.g. a NiftyReg -def output converted to
+    displacement: the stationary velocity field v such that exp(v) = id + input_disp.
+    :param input_disp: displacement field in Lagrangian coordinates.
+    :param method: 'iss' for inverse_scaling_and_squaring, 'bch' for iterative_bch.
+    :param kwargs: parameters of the chosen method (convergence control, warm start...).
+    :return: stationary velocity field.
+    """
+    if method == 'iss':
+        return inverse_scaling_and_squaring(input_disp, **kwargs)
+    elif method == 'bch':
+        return iterative_bch(input_disp, **kwargs)
+    else:
+        raise IOError("method can be only 'iss' or 'bch'.")
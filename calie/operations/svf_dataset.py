@@ -0,0 +1,159 @@
+import json
+import os
+from os.path import join as jph
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from calie.operations import lie_exp
+from calie.fields import queries as qr
+
+
+class SVFDataset:
+    """
+    Synthetic dataset of stationary velocity fields and of their ground truth flows, generated lazily, sample by
+    sample, and cached on disk in a single store per dataset:
+    <name>-algebra.npy and <name>-group.npy, arrays of shape (num_samples, ) + shape of a field, and
+    <name>-status.npy, boolean array with the samples already generated, and
+    <name>-parameters.json, parameters of the generation, checked when the store is reopened.
+    The arrays are memory mapped, so that getting a sample is a slice of the store and not a file open. When all the
+    samples are generated the store is reopened read only, with mmap_mode='r'.
+    """
+    def __init__(self, pfo_store, name, num_samples, omega, svf_generator, flow_generator=None, t=1,
+                 ground_method='rk4', ground_num_steps=7, s_i_o=3, dtype=np.float64, parameters=None,
+                 overwrite=False):
+        """
+        :param pfo_store: path to the folder of the store. Created if it does not exist.
+        :param name: name of the dataset, prefix of the files of the store.
+        :param num_samples: number of samples.
+        :param omega: domain of the fields.
+        :param svf_generator: function of the index of the sample returning the svf, e.g. built on
+        generate.generate_random_spectral with first_sample=index, so that each sample is reproducible alone.
+        :param flow_generator: function of the index of the sample and of its svf returning the ground truth flow
+        (displacement), e.g. computed in closed form from the matrices of the sample. If None the flow is the
+        exponential of the svf computed by LieExp with ground_method and ground_num_steps.
+        :param t: number of time points of the fields.
+        :param ground_method: name of the method of LieExp computing the ground truth.
+        :param ground_num_steps: number of steps of the ground truth method.
+        :param s_i_o: spline interpolation order of LieExp.
+        :param dtype: data type of the store.
+        :param parameters: dictionary of the parameters of the generation (e.g. kind of generator, sigmas, seed,
+        ground truth method), JSON serialisable. They are stored with the samples: reopening a store generated
+        with different ones raises an IOError, instead of returning stale samples.
+        :param overwrite: if True an existing store is discarded, and its samples are generated again.
+        """
+        self.pfo_store = pfo_store
+        self.name = name
+        self.num_samples = num_samples
+        self.shape = tuple(qr.shape_from_omega_and_timepoints(omega, t))
+        self.svf_generator = svf_generator
+        self.dtype = np.dtype(dtype)
+
+        if flow_generator is None:
+            l_exp = lie_exp.LieExp()
+            l_exp.s_i_o = s_i_o
+            ground = getattr(l_exp, ground_method)
+
+            def flow_generator(index, svf):
+                return ground(svf, input_num_steps=ground_num_steps)
+
+        self.flow_generator = flow_generator
+
+        # as read back from the json file, e.g. tuples as lists.
+        self.parameters = json.loads(json.dumps(parameters, sort_keys=True))
+
+        self.pfi_algebra = jph(pfo_store, '{}-algebra.npy'.format(name))
+        self.pfi_group = jph(pfo_store, '{}-group.npy'.format(name))
+        self.pfi_status = jph(pfo_store, '{}-status.npy'.format(name))
+        self.pfi_parameters = jph(pfo_store, '{}-parameters.json'.format(name))
+
+        self.svfs = None
+        self.flows = None
+        self.status = None
+        self.open_store(overwrite=overwrite)
+
+    def open_store(self, overwrite=False):
+        """
+        Open the store, creating it if it does not exist. Read only if all the samples are generated.
+        :param overwrite: if True the store is created again, with no sample generated.
+        """
+        shape = (self.num_samples, ) + self.shape
+
+        if overwrite or not os.path.exists(self.pfi_status):
+            if not os.path.exists(self.pfo_store):
+                os.makedirs(self.pfo_store)
+            open_memmap(self.pfi_algebra, mode='w+', dtype=self.dtype, shape=shape)
+            open_memmap(self.pfi_group, mode='w+', dtype=self.dtype, shape=shape)
+            np.save(self.pfi_status, np.zeros(self.num_samples, dtype=bool))
+            with open(self.pfi_parameters, 'w') as f:
+                json.dump(self.parameters, f, sort_keys=True)
+
+        stored_parameters = None
+        if os.path.exists(self.pfi_parameters):
+            with open(self.pfi_parameters, 'r') as f:
+                stored_parameters = json.load(f)
+        if not stored_parameters == self.parameters:
+            raise IOError('Store {} generated with parameters {}, while {} are required.'.format(
+                self.pfi_parameters, stored_parameters, self.parameters))
+
+        status = np.load(self.pfi_status, mmap_mode='r')
+        if not status.shape == (self.num_samples, ):
+            raise IOError('Store {} with {} samples while {} are required.'.format(self.pfi_status,
+                                                                               status.shape[0], self.num_samples))
+        mode = 'r' if np.all(status) else 'r+'
+
+        self.status = np.load(self.pfi_status, mmap_mode=mode)
+        self.svfs = np.load(self.pfi_algebra, mmap_mode=mode)
+        self.flows = np.load(self.pfi_group, mmap_mode=mode)
+
+        for arr in [self.svfs, self.flows]:
+            if not (arr.shape == shape and arr.dtype == self.dtype):
+                raise IOError('Store of {} has shape {} and type {}, while {} of type {} is required.'.format(
+                    self.name, arr.shape, arr.dtype, shape, self.dtype))
+
+    def is_generated(self, index):
+        return bool(self.status[index])
+
+    def generate(self, indexes=None):
+        """
+        Generate and store the samples not generated yet.
+        :param indexes: indexes of the samples. If None all the samples.
+        """
+        if indexes is None:
+            indexes = range(self.num_samples)
+        missing = [s for s in indexes if not self.status[s]]
+        if len(missing) == 0:
+            return
+
+        for s in missing:
+            svf = self.svf_generator(s)
+            if not svf.shape == self.shape:
+                raise IOError('Generated svf of shape {} while {} is required.'.format(svf.shape, self.shape))
+            self.svfs[s] = svf
+            self.flows[s] = self.flow_generator(s, svf)
+            self.svfs.flush()
+            self.flows.flush()
+            # the status is updated only when the sample is on disk
+            self.status[s] = True
+            self.status.flush()
+
+        if np.all(self.status):
+            self.open_store()
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        """
+        :param index: index of the sample.
+        :return: svf and ground truth flow of the sample, read only slices of the store.
+        """
+        if not -self.num_samples <= index < self.num_samples:
+            raise IndexError('Sample {} out of a dataset of {} samples.'.format(index, self.num_samples))
+        index %= self.num_samples
+        self.generate([index])
+
+        svf, flow = self.svfs[index], self.flows[index]
+        svf.flags.writeable = False
+        flow.flags.writeable = False
+        return svf, flow
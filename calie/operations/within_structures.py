@@ -1,8 +1,98 @@
+from calie.aux import matrices
+from calie.operations import jacobians as jac
+from calie.operations import lie_exp
+from calie.operations import lie_log
+from calie.fields import queries as qr
+from calie.fields import compose as cp
+
+
+def lie_log_composition(svf_left,
+                        svf_right,
+                        kind='bch1',
+                        answer='svf',
+                        jacobian_left=None,
+                        jacobian_right=None,
+                        s_i_o=3,
+                        operator='central'):
+    """
+    From two stationary velocity fields u = svf_left, v = svf_right in the tangent space it returns an approximation
+    of their composition in the Lie group log(exp(u) o exp(v)), avoiding the round trip exponential - composition -
+    logarithm.
+    :param svf_left: stationary velocity field u.
+    :param svf_right: stationary velocity field v.
+    :param kind:
+        'bch0' u + v
+        'bch1' u + v + 1/2 [u,v]
+        'bch1.5' u + v + 1/2 [u,v] + 1/12 [u,[u,v]]
+        'bch2' u + v + 1/2 [u,v] + 1/12 ([u,[u,v]] + [v,[v,u]])
+        'pt' u + exp(u/2) o exp(v) o exp(-u/2), with the displacement of the conjugation as velocity field.
+        'pt_warp' u + Ad_{exp(u/2)} v, parallel transport of v computed by warping:
+            (Jac(exp(u/2)) v) o exp(-u/2).
+        'ground' the round trip log(exp(u) o exp(v)), with lie_log.lie_logarithm.
+    Brackets follow the convention of jacobians.fused_lie_bracket, for which
+    exp(u) o exp(v) = exp(u + v + 1/2 [u,v] + ...).
+    :param answer: 'svf' returns the approximation of log(exp(u) o exp(v)),
+        'disp' returns its exponential, approximation of exp(u) o exp(v).
+    :param jacobian_left: jacobian of u, if already available (e.g. when u is fixed in a loop).
+    :param jacobian_right: jacobian of v, if already available.
+    :param s_i_o: spline interpolation order of the compositions and exponentials.
+    :param operator: derivative operator of the jacobians, see jacobians.partial_derivative.
+    :return: log(exp(u) o exp(v)) or exp(u) o exp(v) according to the parameter answer.
+    """
+    if answer not in ['svf', 'disp']:
+        raise IOError("answer can be only 'svf' or 'disp'.")
+
+    # VectorField inputs are kept for the brackets, that use the jacobians cached in them.
+    vf_left, vf_right = svf_left, svf_right
+    svf_left, svf_right = qr.as_array(svf_left), qr.as_array(svf_right)
+
+    l_exp = lie_exp.LieExp()
+    l_exp.s_i_o = s_i_o
+    l_exp.derivative_operator = operator
+
+    if kind == 'ground':
+        disp_ground = cp.lagrangian_dot_lagrangian(l_exp.scaling_and_squaring(svf_left),
+                                                   l_exp.scaling_and_squaring(svf_right), s_i_o=s_i_o)
+        if answer == 'disp':
+            return disp_ground
+        return lie_log.lie_logarithm(disp_ground, s_i_o=s_i_o)
+
+    if kind in ['bch0', 'bch1', 'bch1.5', 'bch2']:
+        svf_result = svf_left + svf_right
+
+        if kind != 'bch0':
+            depth = {'bch1': 1, 'bch1.5': 2, 'bch2': 2}[kind]
+            brackets = jac.bch_lie_brackets(vf_left, vf_right, depth=depth, jacobian_left=jacobian_left,
+                                            jacobian_right=jacobian_right, operator=operator)
+            svf_result += 0.5 * brackets['uv']
+            if kind == 'bch1.5':
+                svf_result += (1 / 12.0) * brackets['uuv']
+            elif kind == 'bch2':
+                # [v,[v,u]] = - [v,[u,v]]
+                svf_result += (1 / 12.0) * (brackets['uuv'] - brackets['vuv'])
 
+    elif kind in ['pt', 'pt_warp']:
+        def_half = l_exp.scaling_and_squaring(0.5 * svf_left)
+        def_minus_half = l_exp.scaling_and_squaring(-0.5 * svf_left)
 
-def lie_log_composition():
-    # TODO
-    pass
+        if kind == 'pt':
+            transported = cp.lagrangian_dot_lagrangian(
+                cp.lagrangian_dot_lagrangian(def_half, l_exp.scaling_and_squaring(svf_right), s_i_o=s_i_o),
+                def_minus_half, s_i_o=s_i_o)
+        else:
+            jacobian_half = jac.compute_jacobian(def_half, is_lagrangian=True, operator=operator)
+            transported = cp.lagrangian_dot_lagrangian(
+                matrices.matrix_vector_field_product(jacobian_half, svf_right), def_minus_half, s_i_o=s_i_o,
+                add_right=False)
+
+        svf_result = svf_left + transported
+
+    else:
+        raise IOError('Kind of log-composition {} not recognised.'.format(kind))
+
+    if answer == 'disp':
+        return l_exp.scaling_and_squaring(svf_result)
+    return svf_result
 
 
 def lie_exp_sum():
@@ -13,129 +103,3 @@ def lie_exp_sum():
 def lie_exp_multiplication():
     # TODO
     pass
-
-
-
-'''
-
-@classmethod
-    def log_composition(cls, svf_im0, svf_im1, kind=('ground',), answer='dom'):
-        """
-        From two stationary velocity fields in the tangent space he returns their composition in the Lie group.
-        No log is computed on the resulting def (deformation field)
-        :param svf_im0:
-        :param svf_im1:
-        :param kind: 'ground'
-            ground truth for the composition, it returns the value \exp(svf_im0)\circ \exp(svf_im1)
-        :param answer:
-        # TODO select if you want the answer in the domain or not!
-
-        kind: 'bch0'
-            composition using the bch 0: it returns
-            \exp(svf_im0)\circ \exp(svf_im1) \simeq \exp(svf_im0) + \exp(svf_im1)
-        kind: 'bch1'
-            composition using the bch 1: it returns
-            \exp(svf_im0)\circ \exp(svf_im1) \simeq \exp(svf_im0) + \exp(svf_im1) + .5 [\exp(svf_im0), \exp(svf_im1)]
-        kind: 'pt'
-            composition using parallel transport: it returns
-            \exp(svf_im0)\circ \exp(svf_im1) \simeq ...
-        kind: 'pt_warp'
-            composition using parallel transport warped: it returns
-            \exp(svf_im0)\circ \exp(svf_im1) \simeq ...
-
-        kind: numerical closed, if len = 2 - [kind_log, kind_exp], uses a numerical method for the
-            log and a numerical method for the exp, in the formula exp(log(svf_im0) o log(svf_im1))
-
-        answer: 'svf' returns approximation of log(exp(svf_im0) o exp(svf_im1))
-             or 'def' returns approximation of exp(svf_im0) o exp(svf_im1), more manageable to compute the ground truth.
-
-        :return: exp(svf_im0) o exp(svf_im1) or log(exp(svf_im0) o exp(svf_im1)) according to the flag answer.
-        It is in the Lie group and not in the Lie algebra, since the computation of the error is in the Lie group.
-        """
-        # TODO: refactor this code within debugging!
-
-        str_error_kind = 'Error: wrong input data for the chosen kind of composition.'
-        str_error_answer = 'Error: wrong input data for the chosen answer of composition.'
-
-        if len(kind) == 1:
-            # Numerical methods BCH based and related
-
-            if kind == 'bch0':
-                svf_bch0 = copy.deepcopy(svf_im0)
-                svf_bch0.field.data += svf_im1.field.data
-                def_result = svf_bch0.exponential()
-
-            elif kind == 'bch1':
-                vel_bch1 = copy.deepcopy(svf_im0)
-                vel_bch1.field.data += svf_im1.field.data
-                vel_bch1.field.data += 0.5 * svf_im0.lie_bracket(svf_im1).field.data
-                def_result = vel_bch1.exponential()
-
-            elif kind == 'bch1.5':
-                vel_bch2 = copy.deepcopy(svf_im0)
-                vel_bch2.field.data += svf_im1.field.data
-                vel_bch2.field.data += 0.5 * cls.lie_bracket(svf_im0, svf_im1).field.data
-                vel_bch2.field.data += (1 / 12.0) * cls.lie_bracket(svf_im0, cls.lie_bracket(svf_im0, svf_im1)).field
-
-                def_result = vel_bch2.exponential()
-
-            elif kind == 'bch2':
-                vel_bch2 = copy.deepcopy(svf_im0)
-                vel_bch2.field.data += svf_im1.field.data
-                vel_bch2.field.data += 0.5 * cls.lie_bracket(svf_im0, svf_im1).field.data
-                vel_bch2.field.data += (1 / 12.0) * (cls.lie_bracket(svf_im0, cls.lie_bracket(svf_im0, svf_im1)).field +
-                                                     cls.lie_bracket(svf_im1,
-                                                                       cls.lie_bracket(svf_im1, svf_im0)).field.data)
-                def_result = vel_bch2.exponential()
-
-            elif kind == 'pt':
-                tmp_vel = copy.deepcopy(svf_im0)
-                tmp_vel.field.data /= 2
-
-                tmp_def_a = tmp_vel.exponential()
-                tmp_vel.field.data = -tmp_vel.field.data
-                tmp_def_b = tmp_vel.exponential()
-                tmp_def_c = SDISP.composition(SDISP.composition(tmp_def_a, svf_im1.exponential()), tmp_def_b)
-
-                vel_pt = copy.deepcopy(svf_im0)
-                vel_pt.field.data += tmp_def_c.data
-                def_result = vel_pt.exponential()
-
-            elif kind == 'pt_alternate':
-
-                tmp_vel = copy.deepcopy(svf_im0)
-                tmp_vel.field.data /= 2
-
-                tmp_def_a = tmp_vel.exponential()
-                tmp_vel.field.data = -tmp_vel.field.data
-                tmp_def_b = tmp_vel.exponentiatial()
-                tmp_def_c = SDISP.composition(SDISP.composition(tmp_def_a, svf_im1.exponential()), tmp_def_b)
-
-                vel_pt = copy.deepcopy(svf_im0)
-                vel_pt.field.data += tmp_def_c.data
-                def_result = vel_pt.exponential()
-
-            else:
-                raise TypeError(str_error_kind)
-
-        elif len(kind) == 2:
-
-            if kind[0] == 'euler' and kind[1] == 'inv_ss':
-                def_im0 = svf_im0.exponential(kind=kind[0])
-                def_im1 = svf_im1.exponential(kind=kind[0])
-                if answer == 'disp':
-                    def_result = SDISP.composition(def_im0, def_im1)
-                elif answer == 'svf':
-                    def_result = SDISP.composition(def_im0, def_im1).logarithm(kind=kind[1])
-                else:
-                    raise TypeError(str_error_answer)
-            else:
-                raise TypeError(str_error_kind)
-
-        else:
-            raise TypeError(str_error_kind)
-
-        return def_result
-
-
-'''
\ No newline at end of file
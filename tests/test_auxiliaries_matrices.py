@@ -354,6 +354,19 @@ def test_matrix_fields_product_iterative_diag_matrix_2d():
     assert_array_almost_equal(ground_m1_pow_n, computed_m1_pow_n)
 
 
+def test_matrix_fields_power_as_sequential_products():
+    np.random.seed(36)
+    m1 = 0.5 * np.random.randn(10, 11, 12, 1, 9)
+
+    ground_m1_pow_n = np.copy(m1)
+    for n in range(2, 14):
+        ground_m1_pow_n = mat.matrix_fields_product(ground_m1_pow_n, m1)
+        assert_array_almost_equal(ground_m1_pow_n, mat.matrix_fields_power(m1, n))
+
+    assert_array_equal(m1, mat.matrix_fields_power(m1, 0))
+    assert_raises(IOError, mat.matrix_fields_power, np.zeros([5, 5, 5]), 2)
+
+
 def test_id_matrix_field_2d_and_3d():
 
     domain_2d = [13, 17]
@@ -393,4 +406,5 @@ if __name__ == '__main__':
 
     test_matrix_fields_product_iterative_2d()
     test_matrix_fields_product_iterative_diag_matrix_2d()
+    test_matrix_fields_power_as_sequential_products()
     test_id_matrix_field_2d_and_3d()
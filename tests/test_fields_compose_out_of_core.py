@@ -0,0 +1,150 @@
+import os
+
+import nibabel as nib
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal, assert_raises
+
+from calie.fields import compose as cp
+from calie.fields import compose_out_of_core as ooc
+from calie.fields import generate as gen
+
+from .decorators_tools import create_and_erase_temporary_folder, pfo_tmp_test
+
+
+''' test block_bounding_box '''
+
+
+def test_block_bounding_box_inside():
+    coord = [np.array([2.3, 4.1]), np.array([0.2, 0.7]), np.array([5.5, 9.9])]
+    box = ooc.block_bounding_box(coord, (20, 20, 20), 1)
+    assert_array_equal([(b.start, b.stop) for b in box], [(1, 7), (0, 3), (4, 12)])
+
+
+def test_block_bounding_box_all_outside_is_not_empty():
+    coord = [np.array([25.0, 30.0]), np.array([-7.0, -3.0]), np.array([5.0, 6.0])]
+    box = ooc.block_bounding_box(coord, (20, 20, 20), 1)
+    assert all(b.stop > b.start for b in box)
+
+
+''' test scalar_dot_lagrangian_out_of_core '''
+
+
+@create_and_erase_temporary_folder
+def test_scalar_dot_lagrangian_out_of_core_linear_as_in_memory():
+    np.random.seed(0)
+    omega = (30, 25, 20)
+    im = np.random.uniform(0, 10, omega)
+    pfi_im = os.path.join(pfo_tmp_test, 'im.nii.gz')
+    pfi_out = os.path.join(pfo_tmp_test, 'im_warped.nii')
+    nib.save(nib.Nifti1Image(im, np.diag([2, 2, 2, 1])), pfi_im)
+
+    disp = 3 * gen.generate_random(omega, parameters=(3, 2))
+
+    ooc.scalar_dot_lagrangian_out_of_core(pfi_im, disp, pfi_out, block_size=(8, 9, 7), s_i_o=1)
+
+    im_warped = nib.load(pfi_out)
+    assert_array_equal(im_warped.affine, np.diag([2, 2, 2, 1]))
+    assert_array_almost_equal(np.asarray(im_warped.dataobj), cp.scalar_dot_lagrangian(im, disp, s_i_o=1))
+
+
+@create_and_erase_temporary_folder
+def test_scalar_dot_lagrangian_out_of_core_cubic_close_to_in_memory():
+    np.random.seed(1)
+    omega = (20, 20, 20)
+    im = np.random.uniform(0, 10, omega)
+    pfi_im = os.path.join(pfo_tmp_test, 'im.nii')
+    pfi_disp = os.path.join(pfo_tmp_test, 'disp.nii')
+    pfi_out = os.path.join(pfo_tmp_test, 'im_warped.nii')
+    disp = 2 * gen.generate_random(omega, parameters=(3, 2))
+    nib.save(nib.Nifti1Image(im, np.eye(4)), pfi_im)
+    nib.save(nib.Nifti1Image(disp, np.eye(4)), pfi_disp)
+
+    im_warped = ooc.scalar_dot_lagrangian_out_of_core(pfi_im, pfi_disp, pfi_out, block_size=(7, 7, 7), s_i_o=3)
+
+    assert_array_almost_equal(im_warped, cp.scalar_dot_lagrangian(im, disp, s_i_o=3), decimal=2)
+
+
+@create_and_erase_temporary_folder
+def test_scalar_dot_lagrangian_out_of_core_multichannel():
+    np.random.seed(2)
+    omega = (15, 16, 17)
+    im = np.random.uniform(0, 10, list(omega) + [3])
+    pfi_im = os.path.join(pfo_tmp_test, 'im.nii.gz')
+    pfi_out = os.path.join(pfo_tmp_test, 'im_warped.nii')
+    nib.save(nib.Nifti1Image(im, np.eye(4)), pfi_im)
+
+    disp = gen.generate_random(omega, parameters=(3, 2))
+
+    im_warped = ooc.scalar_dot_lagrangian_out_of_core(pfi_im, disp, pfi_out, block_size=(6, 6, 6), s_i_o=1)
+
+    assert_array_almost_equal(im_warped, cp.multichannel_dot_lagrangian(im, disp, s_i_o=1))
+
+
+@create_and_erase_temporary_folder
+def test_scalar_dot_lagrangian_out_of_core_modes_as_in_memory():
+    np.random.seed(3)
+    omega = (16, 17, 18)
+    im = np.random.uniform(0, 10, omega)
+    pfi_im = os.path.join(pfo_tmp_test, 'im.nii')
+    nib.save(nib.Nifti1Image(im, np.eye(4)), pfi_im)
+
+    # large displacements, so that many coordinates are outside the domain.
+    disp = 6 * gen.generate_random(omega, parameters=(3, 2))
+
+    for mode in ooc.out_of_core_modes:
+        for s_i_o in [0, 1]:
+            pfi_out = os.path.join(pfo_tmp_test, 'im_warped_{}_{}.nii'.format(mode, s_i_o))
+            im_warped = ooc.scalar_dot_lagrangian_out_of_core(pfi_im, disp, pfi_out, block_size=(5, 6, 7),
+                                                              s_i_o=s_i_o, mode=mode, cval=2.0)
+            assert_array_almost_equal(im_warped, cp.scalar_dot_lagrangian(im, disp, s_i_o=s_i_o, mode=mode,
+                                                                          cval=2.0))
+
+    for mode in ['wrap', 'reflect', 'mirror']:
+        with assert_raises(IOError):
+            ooc.scalar_dot_lagrangian_out_of_core(pfi_im, disp, os.path.join(pfo_tmp_test, 'out.nii'), mode=mode)
+
+
+@create_and_erase_temporary_folder
+def test_scalar_dot_lagrangian_out_of_core_scaled_integer_input():
+    np.random.seed(4)
+    omega = (14, 15, 16)
+    pfi_im = os.path.join(pfo_tmp_test, 'im.nii')
+    im = nib.Nifti1Image(np.random.uniform(-3, 3, omega), np.eye(4))
+    # stored as int16 with a slope and an intercept chosen by nibabel.
+    im.set_data_dtype(np.int16)
+    nib.save(im, pfi_im)
+    im_scaled = nib.load(pfi_im)
+    assert not im_scaled.dataobj.slope == 1
+
+    disp = 2 * gen.generate_random(omega, parameters=(3, 2))
+    expected = cp.scalar_dot_lagrangian(im_scaled.get_fdata(), disp, s_i_o=1)
+
+    im_warped = ooc.scalar_dot_lagrangian_out_of_core(pfi_im, disp, os.path.join(pfo_tmp_test, 'out_float.nii'),
+                                                      block_size=(6, 6, 6), s_i_o=1)
+    assert np.issubdtype(im_warped.dtype, np.floating)
+    assert_array_almost_equal(im_warped, expected)
+
+    # integer output explicitly required: rounded and clipped, not truncated.
+    im_warped = ooc.scalar_dot_lagrangian_out_of_core(pfi_im, 1000 * np.ones(list(omega) + [1, 3]),
+                                                      os.path.join(pfo_tmp_test, 'out_int.nii'), s_i_o=1,
+                                                      cval=1e6, output_dtype=np.int16)
+    assert_array_equal(im_warped, np.iinfo(np.int16).max)
+    im_warped = ooc.scalar_dot_lagrangian_out_of_core(pfi_im, disp, os.path.join(pfo_tmp_test, 'out_int.nii'),
+                                                      s_i_o=1, output_dtype=np.int16)
+    assert_array_equal(im_warped, np.rint(expected))
+
+
+@create_and_erase_temporary_folder
+def test_scalar_dot_lagrangian_out_of_core_wrong_output_format():
+    omega = (10, 10, 10)
+    pfi_im = os.path.join(pfo_tmp_test, 'im.nii.gz')
+    nib.save(nib.Nifti1Image(np.zeros(omega), np.eye(4)), pfi_im)
+    with assert_raises(IOError):
+        ooc.scalar_dot_lagrangian_out_of_core(pfi_im, np.zeros(list(omega) + [1, 3]),
+                                              os.path.join(pfo_tmp_test, 'out.nii.gz'))
+
+
+def test_scalar_dot_lagrangian_out_of_core_wrong_field_shape():
+    nib_im = nib.Nifti1Image(np.zeros((10, 10, 10)), np.eye(4))
+    with assert_raises(IOError):
+        ooc.scalar_dot_lagrangian_out_of_core(nib_im, np.zeros((10, 10, 9, 1, 3)), 'out.nii')
@@ -4,17 +4,23 @@ Test to perform the composition between vector fields.
 Here can be found some hints to compare the error of the composition provided by the resampling.
 This is actually very high, as soon as the field gets complicated.
 """
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
-from numpy.testing import assert_array_almost_equal
+from scipy import sparse
+from numpy.testing import assert_array_almost_equal, assert_array_equal, assert_raises
 
 from calie.operations import lie_exp
 from calie.visualisations.fields import fields_at_the_window
 
 from calie.fields import generate as gen
 from calie.fields import compose as cp
+from calie.fields import queries as qr
 from calie.fields import generate_identities as gen_id
 
+from .decorators_tools import create_and_erase_temporary_folder, pfo_tmp_test
+
 
 # Lagrangian dot lagrangian
 
@@ -379,6 +385,301 @@ def test_controlled_composition_of_two_closed_form_vector_fields_2d_1(get_figure
 def test_compose_vector_field_with_scalar():
     pass
 
+
+def test_multichannel_dot_lagrangian_equals_scalar_dot_lagrangian_per_channel_3d():
+    np.random.seed(0)
+    omega = (12, 13, 14)
+    im = np.random.uniform(0, 10, list(omega) + [4])
+    disp = gen.generate_random(omega, parameters=(2, 2))
+
+    im_warped = cp.multichannel_dot_lagrangian(im, disp)
+
+    assert_array_equal(im_warped.shape, im.shape)
+    for c in range(4):
+        assert_array_almost_equal(im_warped[..., c], cp.scalar_dot_lagrangian(im[..., c], disp))
+
+
+def test_multichannel_dot_lagrangian_equals_scalar_dot_lagrangian_per_channel_2d():
+    np.random.seed(1)
+    omega = (10, 12)
+    im = np.random.uniform(0, 10, [12, 10, 2, 3])
+    disp = gen.generate_random(omega, parameters=(2, 2))
+
+    im_warped = cp.multichannel_dot_lagrangian(im, disp)
+
+    for c in np.ndindex(2, 3):
+        assert_array_almost_equal(im_warped[(Ellipsis, ) + c], cp.scalar_dot_lagrangian(im[(Ellipsis, ) + c], disp))
+
+
+def test_iterate_multichannel_dot_eulerian_streams_all_channels():
+    omega = (8, 8, 8)
+    im = np.random.uniform(0, 1, list(omega) + [5])
+    idd = gen_id.id_eulerian(omega)
+
+    streamed = list(cp.iterate_multichannel_dot_eulerian(im, idd, s_i_o=1))
+
+    assert_array_equal([c for c, _ in streamed], [(k, ) for k in range(5)])
+    for c, channel in streamed:
+        assert_array_almost_equal(channel, im[(Ellipsis, ) + c])
+
+
+def test_multichannel_dot_lagrangian_labels_nearest_and_majority():
+    np.random.seed(2)
+    omega = (15, 15, 15)
+    labels = np.zeros(omega, dtype=np.int32)
+    labels[3:8, ...] = 2
+    labels[8:12, ...] = 7
+    disp = gen.generate_random(omega, parameters=(2, 2))
+
+    for interpolation in ['nearest', 'majority']:
+        labels_warped = cp.multichannel_dot_lagrangian(labels[..., np.newaxis], disp, interpolation=interpolation)
+        assert set(np.unique(labels_warped)) <= {0, 2, 7}
+
+    # translation of a whole voxel moves the labels without changing them
+    disp_translation = gen_id.id_lagrangian(omega)
+    disp_translation[..., 0] = 1
+    labels_warped = cp.multichannel_dot_lagrangian(labels[..., np.newaxis], disp_translation,
+                                                   interpolation='majority')
+    assert_array_equal(labels_warped[:-1, ..., 0], labels[1:, ...])
+
+
+def test_multichannel_dot_eulerian_wrong_interpolation():
+    omega = (8, 8, 8)
+    with assert_raises(IOError):
+        cp.multichannel_dot_eulerian(np.zeros(list(omega) + [2]), gen_id.id_eulerian(omega), interpolation='spam')
+
+
+def test_affine_left_right_to_matrix_from_nifti_affines_2d():
+    a_l = np.diag([2., 2., 1., 1.])
+    a_r = np.eye(4)
+    a_r[:3, 3] = [4, 6, 5]
+    m = cp.affine_left_right_to_matrix((a_l, a_r), 2)
+    assert_array_almost_equal(m, np.array([[.5, 0, 2], [0, .5, 3], [0, 0, 1]]))
+
+
+def test_affine_left_right_to_matrix_wrong_shape():
+    with assert_raises(IOError):
+        cp.affine_left_right_to_matrix((np.eye(3), np.eye(3)), 3)
+
+
+def test_field_coordinates_with_affine_as_homogeneous_product_3d():
+    np.random.seed(3)
+    omega = (9, 10, 11)
+    vf_eul = gen_id.id_eulerian(omega) + gen.generate_random(omega, parameters=(2, 1))
+    a_l = np.eye(4)
+    a_l[:3, :3] = np.random.uniform(-1, 1, [3, 3]) + 3 * np.eye(3)
+    a_l[:3, 3] = [1, -2, 3]
+    a_r = np.diag([1.5, 1.5, 2, 1])
+
+    coord = cp.field_coordinates(vf_eul, affine_left_right=(a_l, a_r))
+
+    m = np.linalg.inv(a_l).dot(a_r)
+    vf_homogeneous = np.concatenate([vf_eul, np.ones(list(omega) + [1, 1])], axis=4)
+    expected = np.einsum('ij,...j->...i', m, vf_homogeneous)
+    for i in range(3):
+        assert_array_almost_equal(coord[i], expected[..., 0, i])
+
+
+def test_lagrangian_dot_lagrangian_with_translation_affine():
+    np.random.seed(4)
+    omega = (20, 20)
+    svf_left = gen.generate_random(omega, parameters=(2, 2))
+    svf_right = gen.generate_random(omega, parameters=(2, 2))
+
+    a_r = np.eye(3)
+    a_r[:2, 2] = [1, 2]
+    svf_right_translated = svf_right + np.array([1, 2])
+
+    assert_array_almost_equal(cp.lagrangian_dot_lagrangian(svf_left, svf_right, affine_left_right=(np.eye(3), a_r)),
+                              cp.lagrangian_dot_lagrangian(svf_left, svf_right_translated))
+    assert_array_almost_equal(cp.lagrangian_dot_lagrangian(svf_left, svf_right, affine_left_right=(a_r, a_r)),
+                              cp.lagrangian_dot_lagrangian(svf_left, svf_right))
+
+
+def test_scalar_dot_lagrangian_with_translation_affine_3d():
+    np.random.seed(5)
+    omega = (12, 12, 12)
+    im = np.random.uniform(0, 1, omega)
+    disp = gen.generate_random(omega, parameters=(2, 2))
+
+    a_r = np.eye(4)
+    a_r[:3, 3] = [1, 0, -1]
+
+    assert_array_almost_equal(cp.scalar_dot_lagrangian(im, disp, affine_left_right=(np.eye(4), a_r)),
+                              cp.scalar_dot_lagrangian(im, disp + np.array([1, 0, -1])))
+
+
+def test_dilate_roi_cube():
+    roi = np.zeros((11, 11, 11), dtype=bool)
+    roi[5, 5, 5] = True
+    dilated = cp.dilate_roi(roi, 2)
+    assert np.sum(dilated) == 5 ** 3
+    assert np.all(dilated[3:8, 3:8, 3:8])
+
+
+def test_roi_margin_covers_max_displacement():
+    vf = gen_id.id_lagrangian((10, 10))
+    vf[2, 3, 0, 0, :] = [3, 4]
+    assert cp.roi_margin(vf, s_i_o=1) == 5 + 1 + 1
+    assert cp.roi_margin(vf, s_i_o=2) == 5 + 2 + 1 + cp.prefilter_halo(2)
+
+
+def test_roi_margin_grows_with_the_number_of_steps():
+    vf = gen_id.id_lagrangian((10, 10))
+    vf[2, 3, 0, 0, :] = [3, 4]
+    assert cp.roi_margin(vf, s_i_o=3, num_steps=4) == 5 + 4 * (3 + 1) + cp.prefilter_halo(3)
+    assert cp.roi_margin(vf, s_i_o=1, num_steps=4) == 5 + 4 * (1 + 1)
+    assert cp.roi_margin(vf, s_i_o=3, num_steps=4, prefilter=False) == 5 + 4 * (3 + 1)
+
+
+def test_lagrangian_dot_lagrangian_roi_as_full_composition_in_the_roi():
+    np.random.seed(6)
+    for omega in [(30, 30), (15, 16, 17)]:
+        svf_left = gen.generate_random(omega, parameters=(3, 2))
+        svf_right = gen.generate_random(omega, parameters=(3, 2))
+        roi = np.zeros(omega, dtype=bool)
+        roi[tuple(slice(4, 10) for _ in omega)] = True
+
+        composition_roi = cp.lagrangian_dot_lagrangian_roi(svf_left, svf_right, roi, s_i_o=3)
+        composition = cp.lagrangian_dot_lagrangian(svf_left, svf_right, s_i_o=3)
+
+        assert_array_almost_equal(composition_roi[roi], composition[roi])
+        assert_array_equal(composition_roi[~roi], 0)
+
+
+def test_lagrangian_dot_lagrangian_roi_from_indices_and_output():
+    np.random.seed(7)
+    omega = (20, 20)
+    svf = gen.generate_random(omega, parameters=(3, 2))
+    idx = (np.array([3, 10, 15]), np.array([4, 10, 2]))
+
+    output = np.ones_like(svf)
+    cp.lagrangian_dot_lagrangian_roi(svf, svf, idx, add_right=False, output=output)
+
+    composition = cp.lagrangian_dot_lagrangian(svf, svf, add_right=False)
+    assert_array_almost_equal(output[idx], composition[idx])
+    assert output[0, 0, 0, 0, 0] == 1
+
+
+def test_boundary_band():
+    band = cp.boundary_band((10, 12), band=2)
+    assert np.sum(~band) == 6 * 8
+    assert np.all(cp.boundary_band((4, 12), band=2))
+
+
+def test_lagrangian_dot_lagrangian_extrapolation_modes_exact_for_affine_fields():
+    omega = (20, 20)
+    m = np.array([[0.05, -0.1, 1.], [0.1, 0.02, -2.], [0, 0, 0]])
+    svf_affine = gen.generate_from_matrix(omega, m, structure='algebra')
+
+    svf_translation = gen_id.id_lagrangian(omega)
+    svf_translation[..., 0] = 3.5
+    svf_translation[..., 1] = -2.2
+
+    idd = gen_id.id_eulerian(omega)
+    expected = np.einsum('ij,...j->...i', m[:2, :2], idd + svf_translation) + m[:2, 2] + svf_translation
+
+    for mode in cp.extrapolation_modes:
+        composition = cp.lagrangian_dot_lagrangian(svf_affine, svf_translation, s_i_o=1, mode=mode)
+        assert_array_almost_equal(composition, expected)
+
+    composition_constant = cp.lagrangian_dot_lagrangian(svf_affine, svf_translation, s_i_o=1, mode='constant')
+    assert np.max(np.abs(composition_constant - expected)) > 1
+
+
+def test_affine_extrapolation_is_local_to_the_boundary():
+    omega = (30, 20)
+    x, y = np.meshgrid(np.arange(30.), np.arange(20.), indexing='ij')
+    # slope 1 near the face x = 0 and slope 2 near the face x = 29, not affine in the middle.
+    g = np.piecewise(x, [x < 8, (x >= 8) & (x <= 20), x > 20],
+                     [lambda t: t, lambda t: t + (t - 8) ** 2 / 24., lambda t: 26 + 2 * (t - 20)])
+    component = g + np.sin(y / 3.) * np.clip((x - 8) * (20 - x), 0, None)
+
+    np.random.seed(30)
+    points_x = np.array([-2.5, -1., -0.3, 29.4, 30.5, 31.2] * 4)
+    points_y = np.random.uniform(0, 19, points_x.size)
+    expected = np.where(points_x < 0, points_x, 26 + 2 * (points_x - 20))
+
+    values = cp.displacement_at_coordinates(component, [points_x, points_y], s_i_o=1, mode='affine_extrapolation')
+    assert_array_almost_equal(values, expected)
+
+    # coefficients computed once and reused.
+    coefficients = cp.affine_extrapolation_coefficients(component)
+    assert_array_almost_equal(cp.displacement_at_coordinates(component, [points_x, points_y], s_i_o=1,
+                                                             mode='affine_extrapolation',
+                                                             extrapolation_coefficients=coefficients), expected)
+
+    vf_left = np.stack([component, component], axis=-1).reshape(omega + (1, 1, 2))
+    vf_right = gen_id.id_lagrangian(omega)
+    vf_right[..., 0] = 2.5
+    vf_left_container = qr.VectorField(vf_left)
+    composition = cp.lagrangian_dot_lagrangian(vf_left_container, vf_right, s_i_o=1, mode='affine_extrapolation')
+    assert_array_equal(composition, cp.lagrangian_dot_lagrangian(vf_left, vf_right, s_i_o=1,
+                                                                 mode='affine_extrapolation'))
+    assert_array_almost_equal(composition[-1, :, 0, 0, 0], 26 + 2 * (31.5 - 20) + 2.5)
+    assert 'affine_extrapolation_coefficients' in vf_left_container._cache
+
+
+def test_lagrangian_dot_lagrangian_roi_extrapolation_3d():
+    omega = (10, 11, 12)
+    svf_affine = gen_id.id_lagrangian(omega)
+    svf_affine[..., 0] = 0.1 * gen_id.id_eulerian(omega)[..., 2] + 1
+
+    svf_translation = gen_id.id_lagrangian(omega)
+    svf_translation[..., 2] = 2.5
+    roi = np.ones(omega, dtype=bool)
+
+    composition = cp.lagrangian_dot_lagrangian_roi(svf_affine, svf_translation, roi, s_i_o=1,
+                                                   mode='linear_extrapolation')
+    assert_array_almost_equal(composition[..., 0], svf_affine[..., 0] + 0.25)
+    assert_array_almost_equal(composition[..., 2], svf_translation[..., 2])
+
+
+def test_sparse_operator_as_scalar_dot_lagrangian():
+    np.random.seed(32)
+    for omega, shape_im in [((20, 25), (25, 20)), ((10, 11, 12), (10, 11, 12))]:
+        svf = 3 * gen.generate_random(omega, parameters=(4, 2))
+        im = np.random.rand(*shape_im)
+        for s_i_o in [0, 1]:
+            for mode in ['constant', 'nearest']:
+                operator = cp.lagrangian_to_sparse_operator(svf, s_i_o=s_i_o, mode=mode)
+                assert_array_almost_equal(cp.image_dot_sparse_operator(im, operator),
+                                          cp.scalar_dot_lagrangian(im, svf, s_i_o=s_i_o, mode=mode))
+
+
+def test_sparse_operator_multichannel_and_adjoint():
+    np.random.seed(33)
+    omega = (10, 11, 12)
+    svf = 3 * gen.generate_random(omega, parameters=(4, 2))
+    im = np.random.rand(*omega + (2, 3))
+    operator = cp.lagrangian_to_sparse_operator(svf)
+
+    warped = cp.image_dot_sparse_operator(im, operator)
+    assert_array_almost_equal(warped, cp.multichannel_dot_lagrangian(im, svf, s_i_o=1))
+
+    x, y = np.random.rand(*omega), np.random.rand(*omega)
+    assert_array_almost_equal(np.sum(cp.image_dot_sparse_operator(x, operator) * y),
+                              np.sum(x * cp.image_dot_sparse_operator(y, operator, adjoint=True)))
+
+
+@create_and_erase_temporary_folder
+def test_sparse_operator_cache_and_wrong_input():
+    svf = gen.generate_random((10, 11, 12), parameters=(4, 2))
+    pfi_cache = os.path.join(pfo_tmp_test, 'sparse_operator.npz')
+    operator = cp.lagrangian_to_sparse_operator(svf, pfi_cache=pfi_cache)
+    assert os.path.exists(pfi_cache)
+    assert (cp.lagrangian_to_sparse_operator(svf, pfi_cache=pfi_cache) != operator).nnz == 0
+    assert (sparse.load_npz(pfi_cache) != operator).nnz == 0
+
+    assert_raises(IOError, cp.lagrangian_to_sparse_operator, svf, s_i_o=0, pfi_cache=pfi_cache)
+    assert_raises(IOError, cp.lagrangian_to_sparse_operator, svf, mode='nearest', pfi_cache=pfi_cache)
+    assert_raises(IOError, cp.lagrangian_to_sparse_operator, 2 * svf, pfi_cache=pfi_cache)
+    assert_raises(IOError, cp.lagrangian_to_sparse_operator, svf[:5], pfi_cache=pfi_cache)
+
+    assert_raises(IOError, cp.lagrangian_to_sparse_operator, svf, s_i_o=3)
+    assert_raises(IOError, cp.image_dot_sparse_operator, np.ones((4, 4)), operator)
+
+
 # def test_controlled_composition_of_two_closed_form_vector_fields_2d_2(get_figures=True):
 #     passe_partout = 3
 #     dec = 2
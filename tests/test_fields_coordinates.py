@@ -0,0 +1,52 @@
+import numpy as np
+from numpy.testing import assert_array_equal, assert_raises
+
+from calie.fields import coordinate as cs
+from calie.fields import compose as cp
+from calie.fields import generate_identities as gen_id
+
+
+def test_conversions_in_place_and_with_output():
+    np.random.seed(48)
+    vf = np.random.randn(10, 11, 1, 1, 2)
+    expected = cs.lagrangian_to_eulerian(vf)
+
+    out = np.empty_like(vf)
+    result = cs.lagrangian_to_eulerian(vf, out=out)
+    assert result is out
+    assert_array_equal(out, expected)
+
+    vf_copy = np.copy(vf)
+    result = cs.lagrangian_to_eulerian(vf_copy, inplace=True)
+    assert result is vf_copy
+    assert_array_equal(vf_copy, expected)
+    cs.eulerian_to_lagrangian(vf_copy, identity=gen_id.id_eulerian_grid_like(vf_copy), out=vf_copy)
+    assert_array_equal(vf_copy, cs.eulerian_to_lagrangian(expected))
+
+    assert_raises(IOError, cs.lagrangian_to_eulerian, vf, out=np.empty((10, 11, 1, 1, 3)))
+
+
+def test_homogeneous_buffer_reused():
+    np.random.seed(48)
+    buffer = cs.homogeneous_buffer((10, 11, 12, 1, 3))
+    for _ in range(2):
+        vf = np.random.randn(10, 11, 12, 1, 3)
+        vf_h = cs.affine_to_homogeneous(vf, out=buffer)
+        assert vf_h is buffer
+        assert_array_equal(vf_h, np.append(vf, np.ones((10, 11, 12, 1, 1)), axis=4))
+        assert_array_equal(cs.homogeneous_to_affine(vf_h), vf)
+        assert np.shares_memory(cs.homogeneous_to_affine(vf_h), buffer)
+
+    assert_array_equal(cs.affine_to_homogeneous(vf), buffer)
+    assert_raises(IOError, cs.affine_to_homogeneous, vf, out=np.empty((10, 11, 12, 1, 3)))
+
+
+def test_composition_with_eulerian_buffer():
+    np.random.seed(48)
+    vf_left = np.random.randn(10, 11, 1, 1, 2)
+    vf_right = np.random.randn(10, 11, 1, 1, 2)
+    buffer = np.empty_like(vf_right)
+
+    expected = cp.lagrangian_dot_lagrangian(vf_left, vf_right)
+    assert_array_equal(cp.lagrangian_dot_lagrangian(vf_left, vf_right, eulerian_buffer=buffer), expected)
+    assert_array_equal(buffer, cs.lagrangian_to_eulerian(vf_right))
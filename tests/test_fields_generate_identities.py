@@ -135,6 +135,21 @@ def test_vf_identity_matrices_test_values():
     assert_array_equal(vf_id[1, 3, 2, 1, :], np.eye(3).flatten())
 
 
+def test_vf_identity_broadcast_views():
+    omega = (5, 4, 3)
+    grid = gen_id.id_eulerian_grid(omega, t=2)
+    id_eulerian = gen_id.id_eulerian(omega, t=2)
+    for k in range(3):
+        assert_array_equal(grid[k], id_eulerian[..., k])
+        assert not grid[k].flags.writeable
+    # memory of the axes only.
+    assert grid[0].base.size == omega[0]
+
+    id_matrices = gen_id.id_matrices(omega, t=2, broadcast=True)
+    assert_array_equal(id_matrices, gen_id.id_matrices(omega, t=2))
+    assert not id_matrices.flags.writeable
+
+
 ''' test vf_identity_lagrangian_like_image '''
 
 
@@ -181,6 +196,7 @@ if __name__ == '__main__':
     test_vf_identity_matrices_wrong_input()
     test_vf_identity_matrices_test_shape()
     test_vf_identity_matrices_test_values()
+    test_vf_identity_broadcast_views()
 
     test_vf_identity_lagrangian_like_image()
 
@@ -1,5 +1,5 @@
 import numpy as np
-from numpy.testing import assert_array_equal, assert_raises
+from numpy.testing import assert_array_equal, assert_array_almost_equal, assert_raises
 
 from calie.fields import generate as gen
 
@@ -27,6 +27,29 @@ def test_generate_random_test_shape_3d():
     assert_array_equal(vf.shape, (10, 11, 9, 1, 3))
 
 
+def test_generate_random_spectral_shape_and_reproducibility():
+    batch = gen.generate_random_spectral((20, 21), t=3, batch=4, seed=45)
+    assert batch.shape == (4, 20, 21, 1, 3, 2)
+    # each sample can be generated alone from its index.
+    assert_array_equal(batch[2], gen.generate_random_spectral((20, 21), t=3, seed=45, first_sample=2))
+    assert_array_equal(batch[1:], gen.generate_random_spectral((20, 21), t=3, batch=3, seed=45, first_sample=1))
+
+    vf = gen.generate_random_spectral((10, 11, 12), spectrum='matern', seed=46, dtype=np.float32)
+    assert vf.shape == (10, 11, 12, 1, 3)
+    assert vf.dtype == np.float32
+
+    with assert_raises(IOError):
+        gen.generate_random_spectral((10, 11), spectrum='spam')
+
+
+def test_generate_random_spectral_statistics_as_filtered_white_noise():
+    sigma_init, sigma_filter = 5, 2
+    batch = gen.generate_random_spectral((32, 30), parameters=(sigma_init, sigma_filter), batch=50, seed=47)
+    # variance of white noise filtered by a gaussian kernel: sigma_init^2 / (4 pi sigma_filter^2) per component.
+    expected_variance = sigma_init ** 2 / (4 * np.pi * sigma_filter ** 2)
+    assert abs(np.var(batch) / expected_variance - 1) < 0.1
+
+
 ''' test generate_from_matrix '''
 
 
@@ -171,6 +194,16 @@ def test_generate_from_matrix_from_group_element_3d_3d_matrix():
     assert_array_equal(vf, vf_expected)
 
 
+def test_generate_from_matrix_stack_of_matrices():
+    np.random.seed(43)
+    for omega, n in [((10, 11), 3), ((10, 11, 5), 3), ((10, 11, 5), 4)]:
+        stack = np.random.randn(4, n, n)
+        vf_batch = gen.generate_from_matrix(omega, stack, t=1, structure='group')
+        assert vf_batch.shape == (4, ) + gen.generate_from_matrix(omega, stack[0]).shape
+        for b in range(4):
+            assert_array_equal(vf_batch[b], gen.generate_from_matrix(omega, stack[b], t=1, structure='group'))
+
+
 ''' test generate_from_projective_matrix '''
 
 
@@ -179,17 +212,42 @@ def test_generate_from_projective_matrix_wrong_timepoints():
         gen.generate_from_projective_matrix((10, 11), np.eye(4), t=2)
 
 
-# def test_generate_from_projective_matrix_wrong_structure():
-#     with assert_raises(IOError):
-#         gen.generate_from_projective_matrix((10, 11), np.eye(4), t=1, structure='spam')
+def test_generate_from_projective_matrix_wrong_structure():
+    with assert_raises(IOError):
+        gen.generate_from_projective_matrix((10, 11), np.eye(4), t=1, structure='spam')
 
 
 def test_generate_from_projective_matrix_with_algebra_element():
-    pass
+    np.random.seed(44)
+    h = np.random.randn(4, 4)
+    vf = gen.generate_from_projective_matrix((10, 11, 5), h, t=1, structure='algebra')
+    vf_expected = np.zeros((10, 11, 5, 1, 3))
+
+    for x in range(10):
+        for y in range(11):
+            for z in range(5):
+                p = np.array([x, y, z, 1])
+                vf_expected[x, y, z, 0, :] = h[:3, :].dot(p) - p[:3] * h[3, :].dot(p)
+
+    assert_array_almost_equal(vf, vf_expected)
 
 
 def test_generate_from_projective_matrix_with_group_element():
-    pass
+    np.random.seed(45)
+    h = np.eye(3) + 0.1 * np.random.randn(3, 3)
+    # the denominator vanishes on the line x = y, where the displacement is set to zero.
+    h[2, :] = [1, -1, 0]
+    stack = np.stack([h, np.eye(3)])
+    vf = gen.generate_from_projective_matrix((10, 11), stack, t=1, structure='group')
+    vf_expected = np.zeros((2, 10, 11, 1, 1, 2))
+
+    for x in range(10):
+        for y in range(11):
+            s = h.dot(np.array([x, y, 1]))
+            if abs(s[2]) > 1e-5:
+                vf_expected[0, x, y, 0, 0, :] = s[:2] / s[2] - np.array([x, y])
+
+    assert_array_almost_equal(vf, vf_expected)
 
 
 if __name__ == '__main__':
@@ -197,6 +255,8 @@ if __name__ == '__main__':
     test_generate_random_wrong_omega()
     test_generate_random_test_shape_2d()
     test_generate_random_test_shape_3d()
+    test_generate_random_spectral_shape_and_reproducibility()
+    test_generate_random_spectral_statistics_as_filtered_white_noise()
 
     test_generate_from_matrix_wrong_structure()
     test_generate_from_matrix_wrong_timepoints()
@@ -208,6 +268,7 @@ if __name__ == '__main__':
     test_generate_from_matrix_from_group_element_3d_2d_matrix()
     test_generate_from_matrix_from_algebra_element_3d_3d_matrix()
     test_generate_from_matrix_from_group_element_3d_3d_matrix()
+    test_generate_from_matrix_stack_of_matrices()
 
     test_generate_from_projective_matrix_wrong_timepoints()
     test_generate_from_projective_matrix_wrong_structure()
@@ -4,8 +4,13 @@ import numpy as np
 from numpy.testing import assert_array_equal, assert_raises, assert_equal, assert_almost_equal
 
 from calie.fields import queries as qr
+from calie.fields import compose as cp
+from calie.fields import coordinate as cs
+from calie.operations import jacobians as jac
+from calie.operations import lie_exp
 
-from .decorators_tools import create_and_erase_temporary_folder_with_a_dummy_nifti_image, pfo_tmp_test
+from .decorators_tools import create_and_erase_temporary_folder_with_a_dummy_nifti_image, \
+    create_and_erase_temporary_folder, pfo_tmp_test
 
 ''' test check_omega '''
 
@@ -118,6 +123,79 @@ def test_vf_norm_ones_normalised():
     assert_almost_equal(qr.norm(vf, passe_partout_size=0, normalized=True), np.sqrt(3))
 
 
+@create_and_erase_temporary_folder
+def test_norm_summary_of_memmap_batch_with_mask():
+    np.random.seed(50)
+    batch = np.lib.format.open_memmap(os.path.join(pfo_tmp_test, 'batch.npy'), mode='w+', dtype=np.float64,
+                                      shape=(3, 10, 11, 12, 1, 3))
+    batch[:] = np.random.randn(3, 10, 11, 12, 1, 3)
+    reference = np.random.randn(3, 10, 11, 12, 1, 3)
+    mask = np.random.rand(10, 11, 12) > 0.5
+
+    summary = qr.norm_summary(batch, passe_partout_size=1, mask=mask, reference_vf=reference,
+                              percentiles=[50, 90], chunk_size=2)
+
+    norms = np.linalg.norm(batch - reference, axis=-1)[:, 1:-1, 1:-1, 1:-1, 0][:, mask[1:-1, 1:-1, 1:-1]]
+    assert_equal(summary['num_points'], norms.size)
+    assert_almost_equal(summary['sum'], np.sum(norms))
+    assert_almost_equal(summary['mean'], np.mean(norms))
+    assert_almost_equal(summary['rms'], np.sqrt(np.mean(norms ** 2)))
+    assert_almost_equal(summary['max'], np.max(norms))
+    assert_almost_equal(summary['percentiles'], np.percentile(norms, [50, 90]))
+
+    # a single field of the batch, chunked along its first spatial axis.
+    assert_almost_equal(qr.norm_summary(batch[1], chunk_size=3)['rms'],
+                        np.sqrt(np.mean(np.sum(batch[1] ** 2, axis=-1))))
+    with assert_raises(IOError):
+        qr.norm_summary(batch, mask=mask[1:])
+
+
+''' test VectorField '''
+
+
+def test_vector_field_metadata_and_cached_data():
+    np.random.seed(49)
+    array = np.random.randn(12, 13, 1, 1, 2)
+    vf = qr.VectorField(array, affine=np.diag([2, 3, 1, 1]))
+    assert vf.array is array
+    assert qr.check_is_vf(vf) == 2
+    assert qr.get_omega(vf) == [12, 13]
+    assert_array_equal(vf.spacing, [2, 3])
+    assert_array_equal(qr.norm(vf), qr.norm(array))
+
+    # cached jacobian and spline coefficients give the same results as the array. The jacobian is computed
+    # with the affine of the container, and is shared read only.
+    jacobian = jac.compute_jacobian(vf)
+    assert jac.compute_jacobian(vf) is jacobian
+    assert_array_equal(jacobian, jac.compute_jacobian(array, affine=np.diag([2, 3, 1, 1])))
+    assert not np.array_equal(jacobian, jac.compute_jacobian(array))
+    assert_array_equal(jac.compute_jacobian(vf, affine=np.eye(4)), jac.compute_jacobian(array))
+    assert_array_equal(jac.compute_jacobian_determinant(vf),
+                       jac.compute_jacobian_determinant(array, affine=np.diag([2, 3, 1, 1])))
+    assert not jacobian.flags.writeable
+    with assert_raises(ValueError):
+        jacobian += 1
+    assert_array_equal(cp.lagrangian_dot_lagrangian(vf, array), cp.lagrangian_dot_lagrangian(array, array))
+
+    # modified through the container, the cached data are recomputed.
+    vf[3, 4, 0, 0, :] = 5
+    assert jac.compute_jacobian(vf) is not jacobian
+    assert_array_equal(jac.compute_jacobian(vf), jac.compute_jacobian(array, affine=np.diag([2, 3, 1, 1])))
+    assert_array_equal(cp.lagrangian_dot_lagrangian(vf, array), cp.lagrangian_dot_lagrangian(array, array))
+
+    l_exp = lie_exp.LieExp()
+    assert_array_equal(l_exp.scaling_and_squaring(vf), l_exp.scaling_and_squaring(array))
+    assert vf.array is array
+
+    expected = cs.lagrangian_to_eulerian(array)
+    assert cs.lagrangian_to_eulerian(vf, inplace=True) is vf
+    assert not vf.is_lagrangian
+    assert_array_equal(vf.array, expected)
+
+    with assert_raises(IOError):
+        qr.VectorField(np.ones([10, 10, 3]))
+
+
 if __name__ == '__main__':
     test_check_omega_type()
     test_check_omega_wrong_dimension4()
@@ -138,3 +216,6 @@ if __name__ == '__main__':
     test_vf_norm_zeros()
     test_vf_norm_ones()
     test_vf_norm_ones_normalised()
+    test_norm_summary_of_memmap_batch_with_mask()
+
+    test_vector_field_metadata_and_cached_data()
@@ -0,0 +1,54 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_almost_equal, assert_raises
+
+from calie.operations import differential_operators as do
+from calie.fields import generate_identities as gen_id
+
+
+def test_differential_operators_of_linear_fields():
+    np.random.seed(42)
+    omega = (10, 11, 12)
+    a = np.random.randn(3, 3)
+    x = gen_id.id_eulerian(omega)
+    v = np.einsum('kl,...l->...k', a, x)
+    cache = do.DerivativeCache(v)
+
+    assert_array_almost_equal(do.divergence(cache), np.trace(a) * np.ones(v.shape[:-1]))
+    expected_curl = np.array([a[2, 1] - a[1, 2], a[0, 2] - a[2, 0], a[1, 0] - a[0, 1]])
+    assert_array_almost_equal(do.curl(cache), expected_curl * np.ones(v.shape))
+    strain = 0.5 * (a + a.T)
+    assert_array_almost_equal(do.strain_tensor(cache), strain.reshape(-1) * np.ones(v.shape[:-1] + (9, )))
+    expected_energy = 2 * np.sum(strain ** 2) + 1.5 * np.trace(a) ** 2
+    assert_array_almost_equal(do.strain_energy(cache, mu=2, lam=3), expected_energy * np.ones(v.shape[:-1]))
+
+    # the jacobian of the field is computed once and shared.
+    jacobian = cache.jacobian
+    do.curl(cache)
+    assert cache.jacobian is jacobian
+    # fields or caches give the same result.
+    assert_array_almost_equal(do.divergence(v), do.divergence(cache))
+
+
+def test_curl_2d_of_rotation():
+    x = gen_id.id_eulerian((15, 16))
+    v = np.stack([-1 * x[..., 1], x[..., 0]], axis=-1)
+    assert_array_almost_equal(do.curl(v), 2 * np.ones(v.shape[:-1] + (1, )))
+    assert_array_almost_equal(do.divergence(v), np.zeros(v.shape[:-1]))
+
+
+def test_differential_summary_as_whole_field():
+    np.random.seed(43)
+    v = np.random.randn(20, 11, 12, 1, 3)
+    summary = do.differential_summary(v, chunk_size=3, lam=0.5)
+
+    cache = do.DerivativeCache(v)
+    for name, values in [('divergence', do.divergence(cache)),
+                         ('curl', np.linalg.norm(do.curl(cache), axis=-1)),
+                         ('strain_energy', do.strain_energy(cache, lam=0.5))]:
+        assert_almost_equal(summary[name]['min'], np.min(values))
+        assert_almost_equal(summary[name]['max'], np.max(values))
+        assert_almost_equal(summary[name]['mean'], np.mean(values))
+        assert_almost_equal(summary[name]['norm'], np.sqrt(np.mean(values ** 2)))
+
+    assert_raises(IOError, do.differential_summary, v, quantities=['laplacian'])
+    assert_raises(IOError, do.DerivativeCache)
@@ -0,0 +1,61 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_raises
+
+from calie.operations import inverse as inv
+from calie.fields import generate as gen
+from calie.fields import compose as cp
+
+
+def _rotation_displacement_and_inverse(omega, theta=np.pi / 12):
+    x_c, y_c = [c / 2. for c in omega]
+    m = np.array([[np.cos(theta), -np.sin(theta), (1 - np.cos(theta)) * x_c + np.sin(theta) * y_c],
+                  [np.sin(theta), np.cos(theta), -np.sin(theta) * x_c + (1 - np.cos(theta)) * y_c],
+                  [0, 0, 1]])
+    disp = gen.generate_from_matrix(omega, m, structure='group')
+    disp_inv = gen.generate_from_matrix(omega, np.linalg.inv(m), structure='group')
+    return disp, disp_inv
+
+
+def test_invert_displacement_wrong_method():
+    with assert_raises(IOError):
+        inv.invert_displacement(np.zeros((10, 10, 1, 1, 2)), method='spam')
+
+
+def test_invert_displacement_wrong_warm_start():
+    with assert_raises(IOError):
+        inv.invert_displacement(np.zeros((10, 10, 1, 1, 2)), warm_start=np.zeros((10, 11, 1, 1, 2)))
+
+
+def test_invert_displacement_zero():
+    disp = np.zeros((10, 10, 1, 1, 2))
+    disp_inv, converged, iterations = inv.invert_displacement(disp, return_convergence=True)
+    assert_array_almost_equal(disp_inv, disp)
+    assert np.all(converged)
+    assert iterations == 1
+
+
+def test_invert_displacement_rotation_fixed_point_and_newton():
+    omega = (40, 40)
+    pp = 10
+    disp, disp_inv_expected = _rotation_displacement_and_inverse(omega)
+
+    for method in ['fixed_point', 'newton']:
+        disp_inv = inv.invert_displacement(disp, method=method, tolerance=1e-6, s_i_o=3, mode='nearest')
+        assert_array_almost_equal(disp_inv[pp:-pp, pp:-pp], disp_inv_expected[pp:-pp, pp:-pp], decimal=3)
+
+        residual = cp.lagrangian_dot_lagrangian(disp, disp_inv, s_i_o=3)
+        assert np.max(np.abs(residual[pp:-pp, pp:-pp])) < 1e-5
+
+
+def test_invert_displacement_newton_and_warm_start_converge_faster():
+    omega = (40, 40)
+    disp, disp_inv_expected = _rotation_displacement_and_inverse(omega, theta=np.pi / 8)
+    params = {'max_iterations': 4, 'tolerance': 1e-5, 's_i_o': 3, 'mode': 'nearest', 'return_convergence': True}
+
+    _, converged_fixed_point, _ = inv.invert_displacement(disp, method='fixed_point', **params)
+    _, converged_newton, _ = inv.invert_displacement(disp, method='newton', **params)
+    _, converged_warm, _ = inv.invert_displacement(disp, method='fixed_point',
+                                                   warm_start=disp_inv_expected, **params)
+
+    assert np.sum(converged_newton) > np.sum(converged_fixed_point)
+    assert np.sum(converged_warm) > np.sum(converged_fixed_point)
@@ -1,8 +1,9 @@
 import numpy as np
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_raises
 from sympy.core.cache import clear_cache
 
 from calie.operations import jacobians as jac
+from calie.operations import lie_bracket
 from calie.fields import generate_identities as gen_id
 
 
@@ -259,6 +260,182 @@ def test_jacobian_toy_field_3_2(open_fig=False):
     # assert_array_almost_equal(jac_f_ground[square_size, square_size, 0, 0, :],
     #                           jac_f_numeric[square_size, square_size, 0, 0, :])
 
+
+def test_jacobian_as_numpy_gradient_with_chunks_and_spacing():
+    np.random.seed(33)
+    for omega in [(20, 25), (10, 11, 12)]:
+        d = len(omega)
+        svf_f = np.random.randn(*list(omega) + [1] * (3 - d) + [1, d])
+        affine = np.diag([0.5, 2.0, 3.0, 1.0])
+
+        jac_f_ground = jac.initialise_jacobian(svf_f)
+        for i in range(d):
+            grad = np.gradient(np.squeeze(svf_f[..., i]), *np.diag(affine)[:d])
+            for j in range(d):
+                jac_f_ground[..., i * d + j] = grad[j].reshape(jac_f_ground.shape[:-1])
+
+        for chunk_size in [None, 1, 3]:
+            jac_f_numeric = jac.compute_jacobian(svf_f, affine=affine, chunk_size=chunk_size)
+            assert_array_almost_equal(jac_f_ground, jac_f_numeric)
+
+
+def test_jacobian_full_affine_and_components():
+    np.random.seed(34)
+    omega = (10, 11, 12)
+    svf_f = np.random.randn(*omega + (1, 3))
+
+    theta = np.pi / 6
+    affine = np.eye(4)
+    affine[:2, :2] = 2 * np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+
+    jac_f_voxel = jac.compute_jacobian(svf_f).reshape(omega + (1, 3, 3))
+    jac_f_ground = np.einsum('...ij,jk->...ik', jac_f_voxel, np.linalg.inv(affine[:3, :3]))
+
+    jac_f_numeric = jac.compute_jacobian(svf_f, affine=affine, chunk_size=4)
+    assert_array_almost_equal(jac_f_ground.reshape(omega + (1, 9)), jac_f_numeric)
+
+    jac_f_diagonal = jac.compute_jacobian(svf_f, is_lagrangian=True, components=[0, 4, 8])
+    assert_array_almost_equal(jac_f_diagonal,
+                              jac.compute_jacobian(svf_f, is_lagrangian=True)[..., [0, 4, 8]])
+
+
+def test_jacobian_determinant_closed_form_as_linalg_det():
+    np.random.seed(35)
+    for shape in [(20, 25, 1, 1, 2), (10, 11, 12, 1, 3), (10, 11, 12, 3, 3)]:
+        d = shape[-1]
+        svf_f = np.random.randn(*shape)
+        jac_f = jac.compute_jacobian(svf_f, is_lagrangian=True).reshape(shape[:-1] + (d, d))
+
+        for chunk_size in [None, 1, 4]:
+            assert_array_almost_equal(np.linalg.det(jac_f),
+                                      jac.compute_jacobian_determinant(svf_f, is_lagrangian=True,
+                                                                       chunk_size=chunk_size))
+
+
+def test_jacobian_determinant_default_is_chunked():
+    np.random.seed(34)
+    for shape in [(40, 37, 1, 1, 2), (35, 11, 12, 1, 3)]:
+        svf_f = np.random.randn(*shape)
+        for operator in ['central', 'central_6']:
+            assert_array_almost_equal(jac.compute_jacobian_determinant(svf_f, operator=operator),
+                                      jac.compute_jacobian_determinant(svf_f, chunk_size=None, operator=operator))
+            assert_array_almost_equal(jac.compute_jacobian_determinant(svf_f, operator=operator),
+                                      jac.compute_jacobian_determinant(svf_f, chunk_size=7, operator=operator))
+
+
+def test_jacobian_determinant_summary():
+    np.random.seed(36)
+    svf_f = 0.5 * np.random.randn(10, 11, 12, 1, 3)
+    det_f = jac.compute_jacobian_determinant(svf_f, is_lagrangian=True)
+
+    summary = jac.jacobian_determinant_summary(svf_f, is_lagrangian=True, chunk_size=3)
+    counts, bins = summary['histogram']
+
+    assert_array_almost_equal(summary['min'], np.min(det_f))
+    assert_array_almost_equal(summary['max'], np.max(det_f))
+    assert_array_almost_equal(summary['mean'], np.mean(det_f))
+    assert summary['folds'] == np.count_nonzero(det_f <= 0)
+    assert np.all(counts == np.histogram(det_f, bins=bins)[0])
+
+    det_f_4 = jac.compute_jacobian_determinant(svf_f, is_lagrangian=True, operator='central_4')
+    summary_4 = jac.jacobian_determinant_summary(svf_f, is_lagrangian=True, chunk_size=3, operator='central_4')
+    assert_array_almost_equal(summary_4['min'], np.min(det_f_4))
+    assert_array_almost_equal(summary_4['mean'], np.mean(det_f_4))
+
+
+def test_derivative_operators_order_of_accuracy():
+    n = 64
+    x = np.arange(n)
+    f = np.sin(6 * np.pi * x / n)[:, np.newaxis] * np.ones([1, 5])
+    df = (6 * np.pi / n) * np.cos(6 * np.pi * x / n)[:, np.newaxis] * np.ones([1, 5])
+
+    errors = [np.max(np.abs(jac.partial_derivative(f, 0, operator=op) - df)[3:-3])
+              for op in ['central', 'central_4', 'central_6']]
+    assert errors[0] > 10 * errors[1] > 100 * errors[2]
+
+    # periodic field: spectral derivative exact up to round-off, also on the boundary.
+    assert_array_almost_equal(jac.partial_derivative(f, 0, operator='spectral'), df, decimal=12)
+    # polynomials of degree 2 are differentiated exactly in the interior by all the stencils.
+    assert_array_almost_equal(jac.partial_derivative(x ** 2., 0, operator='central_6')[1:-1], 2 * x[1:-1])
+
+
+def test_jacobian_derivative_operators_with_chunks():
+    np.random.seed(37)
+    svf_f = np.random.randn(20, 11, 12, 1, 3)
+    affine = np.eye(4)
+    affine[0, 1] = 0.3
+    for operator in jac.derivative_operators:
+        for aff in [np.eye(4), affine]:
+            assert_array_almost_equal(jac.compute_jacobian(svf_f, affine=aff, operator=operator),
+                                      jac.compute_jacobian(svf_f, affine=aff, operator=operator, chunk_size=3))
+
+
+def test_jacobian_wrong_operator():
+    assert_raises(IOError, jac.compute_jacobian, np.zeros([5, 5, 1, 1, 2]), operator='fancy')
+
+
+def test_fused_lie_bracket_of_linear_fields_as_commutator():
+    np.random.seed(38)
+    omega = (10, 11, 12)
+    a, b = np.random.randn(3, 3), np.random.randn(3, 3)
+    x = gen_id.id_eulerian(omega)
+    u = np.einsum('kl,...l->...k', a, x)
+    v = np.einsum('kl,...l->...k', b, x)
+
+    expected = np.einsum('kl,...l->...k', a.dot(b) - b.dot(a), x)
+    for chunk_size in [None, 4]:
+        assert_array_almost_equal(jac.fused_lie_bracket(u, v, chunk_size=chunk_size), expected)
+    # conventions of the previous implementations are preserved.
+    assert_array_almost_equal(lie_bracket.lie_bracket(u, v), expected)
+    assert_array_almost_equal(jac.lie_bracket(u, v), -1 * expected)
+
+
+def test_bch_lie_brackets_as_nested_brackets():
+    np.random.seed(39)
+    u = np.random.randn(10, 11, 12, 1, 3)
+    v = np.random.randn(10, 11, 12, 1, 3)
+    brackets = jac.bch_lie_brackets(u, v, depth=3, jacobian_left=jac.compute_jacobian(u))
+
+    uv = jac.fused_lie_bracket(u, v)
+    assert_array_almost_equal(brackets['uv'], uv)
+    assert_array_almost_equal(brackets['uuv'], jac.fused_lie_bracket(u, uv))
+    assert_array_almost_equal(brackets['vuv'], jac.fused_lie_bracket(v, uv))
+    assert_array_almost_equal(brackets['vuuv'], jac.fused_lie_bracket(v, jac.fused_lie_bracket(u, uv)))
+    assert_raises(IOError, jac.fused_lie_bracket, u, v[:5])
+
+
+def test_jacobian_vector_product_as_jacobian_times_vector():
+    np.random.seed(40)
+    v = np.random.randn(14, 11, 12, 1, 3)
+    w = np.random.randn(14, 11, 12, 1, 3)
+    for operator in jac.derivative_operators:
+        jacobian = jac.compute_jacobian(v, operator=operator).reshape(v.shape[:-1] + (3, 3))
+        expected = np.einsum('...kl,...l->...k', jacobian, w)
+        for chunk_size in [None, 4]:
+            assert_array_almost_equal(jac.jacobian_vector_product(v, w, operator=operator, chunk_size=chunk_size),
+                                      expected)
+    assert_raises(IOError, jac.jacobian_vector_product, v, w[:5])
+
+
+def test_jacobian_determinant_and_bracket_of_batches_with_time_points():
+    np.random.seed(41)
+    batch_v = np.random.randn(3, 12, 11, 1, 4, 2)
+    batch_w = np.random.randn(3, 12, 11, 1, 4, 2)
+    jacobians = jac.compute_jacobian(batch_v, chunk_size=2)
+    determinants = jac.compute_jacobian_determinant(batch_v, is_lagrangian=True)
+    brackets = jac.fused_lie_bracket(batch_v, batch_w)
+    assert jacobians.shape == (3, 12, 11, 1, 4, 4)
+    assert determinants.shape == (3, 12, 11, 1, 4)
+
+    for b in range(3):
+        for t in range(4):
+            v, w = batch_v[b, ..., t:t + 1, :], batch_w[b, ..., t:t + 1, :]
+            assert_array_almost_equal(jacobians[b, ..., t:t + 1, :], jac.compute_jacobian(v))
+            assert_array_almost_equal(determinants[b, ..., t:t + 1],
+                                      jac.compute_jacobian_determinant(v, is_lagrangian=True))
+            assert_array_almost_equal(brackets[b, ..., t:t + 1, :], jac.fused_lie_bracket(v, w))
+
+
 if __name__ == '__main__':
     test_jacobian_toy_field_1()
     test_jacobian_toy_field_2()
@@ -8,6 +8,7 @@ from calie.visualisations.fields import fields_comparisons
 
 from calie.fields import generate as gen
 from calie.fields import queries as qr
+from calie.fields import compose as cp
 
 
 def test_visual_assessment_method_one_se2(show=False):
@@ -134,5 +135,65 @@ def test_visual_assessment_method_one_se2(show=False):
 
         plt.show()
 
+
+def test_scaling_and_squaring_roi_as_scaling_and_squaring_in_the_roi():
+    np.random.seed(0)
+    for omega in [(50, 50), (25, 25, 25)]:
+        svf_0 = gen.generate_random(omega, parameters=(5, 3))
+        roi = np.zeros(omega, dtype=bool)
+        roi[tuple(slice(8, 16) for _ in omega)] = True
+
+        l_exp = lie_exp.LieExp()
+        l_exp.s_i_o = 3
+        sdisp = l_exp.scaling_and_squaring(svf_0, input_num_steps=5)
+        sdisp_roi = l_exp.scaling_and_squaring_roi(svf_0, roi, input_num_steps=5)
+
+        assert np.max(np.abs(sdisp_roi[roi] - sdisp[roi])) < 1e-3
+        assert np.all(sdisp_roi[~roi] == 0)
+
+
+def test_scaling_and_squaring_roi_with_large_displacements():
+    np.random.seed(1)
+    omega = (160, 160)
+    svf_0 = 6 * gen.generate_random(omega, parameters=(12, 6))
+    assert np.max(np.linalg.norm(svf_0, axis=-1)) > 15
+    roi = np.zeros(omega, dtype=bool)
+    roi[75:85, 75:85] = True
+
+    l_exp = lie_exp.LieExp()
+    l_exp.s_i_o = 3
+    sdisp = l_exp.scaling_and_squaring(svf_0, input_num_steps=6)
+    sdisp_roi = l_exp.scaling_and_squaring_roi(svf_0, roi, input_num_steps=6)
+
+    assert np.max(np.abs(sdisp_roi[roi] - sdisp[roi])) < 1e-8
+
+
+def test_scaling_and_squaring_roi_resamples_only_the_dilated_roi(monkeypatch):
+    np.random.seed(2)
+    omega = (120, 120)
+    svf_0 = gen.generate_random(omega, parameters=(5, 3))
+    roi = np.zeros(omega, dtype=bool)
+    roi[55:65, 55:65] = True
+
+    resampled = []
+
+    def counting_composition(vf_left_lag, vf_right_lag, roi_indices, **kwargs):
+        resampled.append(len(roi_indices[0]))
+        return lagrangian_dot_lagrangian_roi(vf_left_lag, vf_right_lag, roi_indices, **kwargs)
+
+    lagrangian_dot_lagrangian_roi = cp.lagrangian_dot_lagrangian_roi
+    monkeypatch.setattr(cp, 'lagrangian_dot_lagrangian_roi', counting_composition)
+
+    l_exp = lie_exp.LieExp()
+    l_exp.s_i_o = 3
+    sdisp_roi = l_exp.scaling_and_squaring_roi(svf_0, roi)
+    sdisp = l_exp.scaling_and_squaring(svf_0)
+
+    num_dilated = np.sum(cp.dilate_roi(roi, cp.roi_margin(svf_0, s_i_o=3, num_steps=l_exp.num_steps)))
+    assert num_dilated < 0.8 * np.prod(omega)
+    assert resampled == [num_dilated] * l_exp.num_steps
+    assert np.max(np.abs(sdisp_roi[roi] - sdisp[roi])) < 1e-8
+
+
 if __name__ == '__main__':
     test_visual_assessment_method_one_se2(True)
@@ -0,0 +1,61 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_raises
+from scipy.linalg import logm
+
+from calie.operations import lie_log
+from calie.operations import jacobians as jac
+from calie.fields import generate as gen
+from calie.fields import compose as cp
+
+
+def _rotation_svf_and_displacement(omega, theta=np.pi / 8):
+    x_c, y_c = [c / 2. for c in omega]
+    m = np.array([[np.cos(theta), -np.sin(theta), (1 - np.cos(theta)) * x_c + np.sin(theta) * y_c],
+                  [np.sin(theta), np.cos(theta), -np.sin(theta) * x_c + (1 - np.cos(theta)) * y_c],
+                  [0, 0, 1]])
+    svf = gen.generate_from_matrix(omega, np.real(logm(m)), structure='algebra')
+    disp = gen.generate_from_matrix(omega, m, structure='group')
+    return svf, disp
+
+
+def test_lie_logarithm_wrong_method():
+    with assert_raises(IOError):
+        lie_log.lie_logarithm(np.zeros((10, 10, 1, 1, 2)), method='spam')
+
+
+def test_displacement_square_root_of_a_rotation():
+    omega = (40, 40)
+    pp = 14
+    _, disp = _rotation_svf_and_displacement(omega, theta=np.pi / 16)
+
+    root = lie_log.displacement_square_root(disp, tolerance=1e-6, s_i_o=3)
+    assert_array_almost_equal(cp.lagrangian_dot_lagrangian(root, root, s_i_o=3)[pp:-pp, pp:-pp],
+                              disp[pp:-pp, pp:-pp], decimal=5)
+
+
+def test_lie_logarithm_of_a_rotation_iss_and_bch():
+    omega = (40, 40)
+    pp = 12
+    svf, disp = _rotation_svf_and_displacement(omega, theta=np.pi / 16)
+
+    for method in ['iss', 'bch']:
+        svf_log = lie_log.lie_logarithm(disp, method=method, s_i_o=3)
+        assert_array_almost_equal(svf_log[pp:-pp, pp:-pp], svf[pp:-pp, pp:-pp], decimal=2)
+
+
+def test_lie_logarithm_warm_start():
+    omega = (40, 40)
+    svf, disp = _rotation_svf_and_displacement(omega, theta=np.pi / 16)
+
+    # a root initialised close to exp(svf / 2) converges in fewer iterations than the default initialisation.
+    root_guess = svf / 2. + jac.jacobian_product(svf, svf) / 8.
+    _, converged, _ = lie_log.displacement_square_root(disp, max_iterations=2, s_i_o=3, return_convergence=True)
+    _, converged_warm, _ = lie_log.displacement_square_root(disp, max_iterations=2, s_i_o=3, warm_start=root_guess,
+                                                            return_convergence=True)
+    assert np.sum(converged_warm) > np.sum(converged)
+
+    svf_log = lie_log.lie_logarithm(disp, method='iss', s_i_o=3, max_iterations=2, warm_start=svf)
+    assert_array_almost_equal(svf_log[12:-12, 12:-12], svf[12:-12, 12:-12], decimal=3)
+
+    with assert_raises(IOError):
+        lie_log.lie_logarithm(disp, method='bch', warm_start=np.zeros((10, 11, 1, 1, 2)))
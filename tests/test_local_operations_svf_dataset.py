@@ -0,0 +1,61 @@
+from numpy.testing import assert_array_equal, assert_raises
+
+from calie.fields import generate as gen
+from calie.operations import svf_dataset
+
+from .decorators_tools import create_and_erase_temporary_folder, pfo_tmp_test
+
+
+@create_and_erase_temporary_folder
+def test_svf_dataset_lazy_generation_and_reopening():
+    generated = []
+
+    def svf_generator(index):
+        generated.append(index)
+        return gen.generate_random_spectral((20, 21), parameters=(3, 2), seed=46, first_sample=index)
+
+    def flow_generator(index, svf):
+        return 2 * svf
+
+    dataset = svf_dataset.SVFDataset(pfo_tmp_test, 'gau', 4, (20, 21), svf_generator, flow_generator=flow_generator)
+    svf, flow = dataset[2]
+    assert generated == [2]
+    assert dataset.is_generated(2) and not dataset.is_generated(0)
+    assert_array_equal(svf, gen.generate_random_spectral((20, 21), parameters=(3, 2), seed=46, first_sample=2))
+    assert_array_equal(flow, 2 * svf)
+    assert not svf.flags.writeable
+
+    dataset.generate()
+    assert generated == [2, 0, 1, 3]
+
+    # reopened read only, no sample is generated again.
+    dataset_reopened = svf_dataset.SVFDataset(pfo_tmp_test, 'gau', 4, (20, 21), svf_generator)
+    assert dataset_reopened.svfs.mode == 'r'
+    assert_array_equal(dataset_reopened[-1][0], dataset[3][0])
+    assert generated == [2, 0, 1, 3]
+
+    assert_raises(IndexError, dataset.__getitem__, 4)
+    assert_raises(IOError, svf_dataset.SVFDataset, pfo_tmp_test, 'gau', 5, (20, 21), svf_generator)
+
+
+@create_and_erase_temporary_folder
+def test_svf_dataset_parameters_and_overwrite():
+    def svf_generator_sigma(sigma_init):
+        return lambda index: gen.generate_random_spectral((10, 11), parameters=(sigma_init, 2), seed=47,
+                                                          first_sample=index)
+
+    dataset = svf_dataset.SVFDataset(pfo_tmp_test, 'gau', 2, (10, 11), svf_generator_sigma(3),
+                                     ground_num_steps=3, parameters={'sigma_init': 3, 'seed': 47})
+    dataset.generate()
+
+    # same parameters, given as json would read them back.
+    svf_dataset.SVFDataset(pfo_tmp_test, 'gau', 2, (10, 11), svf_generator_sigma(3), ground_num_steps=3,
+                           parameters={'seed': 47, 'sigma_init': 3})
+    # the samples of the store were generated with different parameters.
+    assert_raises(IOError, svf_dataset.SVFDataset, pfo_tmp_test, 'gau', 2, (10, 11), svf_generator_sigma(4),
+                  ground_num_steps=3, parameters={'sigma_init': 4, 'seed': 47})
+
+    dataset = svf_dataset.SVFDataset(pfo_tmp_test, 'gau', 2, (10, 11), svf_generator_sigma(4),
+                                     ground_num_steps=3, parameters={'sigma_init': 4, 'seed': 47}, overwrite=True)
+    assert not dataset.is_generated(0)
+    assert_array_equal(dataset[1][0], svf_generator_sigma(4)(1))
@@ -0,0 +1,53 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_raises
+
+from calie.operations import within_structures as ws
+from calie.operations import jacobians as jac
+from calie.fields import generate as gen
+
+
+def test_lie_log_composition_wrong_input():
+    svf = np.zeros((10, 10, 1, 1, 2))
+    assert_raises(IOError, ws.lie_log_composition, svf, svf, kind='spam')
+    assert_raises(IOError, ws.lie_log_composition, svf, svf, answer='spam')
+
+
+def test_lie_log_composition_bch_of_linear_fields():
+    # for linear fields the bch terms are matrix commutators.
+    np.random.seed(39)
+    omega = (10, 11, 12)
+    a, b = 0.1 * np.random.randn(3, 3), 0.1 * np.random.randn(3, 3)
+    x = np.stack(np.meshgrid(*[np.arange(n) for n in omega], indexing='ij'), axis=-1)[..., np.newaxis, :]
+    u = np.einsum('kl,...l->...k', a, x)
+    v = np.einsum('kl,...l->...k', b, x)
+    c = a.dot(b) - b.dot(a)
+
+    for kind, expected in [('bch0', a + b),
+                           ('bch1', a + b + 0.5 * c),
+                           ('bch1.5', a + b + 0.5 * c + (a.dot(c) - c.dot(a)) / 12.),
+                           ('bch2', a + b + 0.5 * c + (a.dot(c) - c.dot(a) - b.dot(c) + c.dot(b)) / 12.)]:
+        assert_array_almost_equal(ws.lie_log_composition(u, v, kind=kind), np.einsum('kl,...l->...k', expected, x))
+
+
+def test_lie_log_composition_with_cached_jacobians():
+    np.random.seed(40)
+    u = gen.generate_random((30, 30), parameters=(5, 3))
+    v = gen.generate_random((30, 30), parameters=(5, 3))
+
+    assert_array_almost_equal(ws.lie_log_composition(u, v, kind='bch2'),
+                              ws.lie_log_composition(u, v, kind='bch2', jacobian_left=jac.compute_jacobian(u),
+                                                     jacobian_right=jac.compute_jacobian(v)))
+
+
+def test_lie_log_composition_approximates_the_composition():
+    np.random.seed(41)
+    pp = 8
+    u = gen.generate_random((50, 50), parameters=(5, 5))
+    v = gen.generate_random((50, 50), parameters=(5, 5))
+
+    ground = ws.lie_log_composition(u, v, kind='ground', answer='disp')[pp:-pp, pp:-pp]
+    error_bch0 = np.max(np.abs(ws.lie_log_composition(u, v, kind='bch0', answer='disp')[pp:-pp, pp:-pp] - ground))
+
+    for kind in ['bch1', 'bch2', 'pt_warp']:
+        error = np.max(np.abs(ws.lie_log_composition(u, v, kind=kind, answer='disp')[pp:-pp, pp:-pp] - ground))
+        assert error < error_bch0 / 5.